@@ -0,0 +1,75 @@
+"""
+
+Run a batch of commands from a single request
+
+"""
+
+
+from pathlib import Path
+
+
+class CommandBatch():
+    """Parses a batch of commands and runs them in order with a function
+        that takes the command and data, and returns the status code,
+        message, and data like the command runner"""
+
+    # Commands that return a file or stop the server can't be batched
+    unsupported_commands = ["batch", "detach", "mesh", "brep", "sketches", "screenshot"]
+
+    def __init__(self, run_command):
+        self.run_command = run_command
+
+    def parse(self, data):
+        """Parse the batch data, returning the list of commands,
+            whether to stop on the first error, and an error or None"""
+        if not isinstance(data, dict) or "commands" not in data:
+            return None, None, "commands not specified"
+        commands = data["commands"]
+        if not isinstance(commands, list) or len(commands) == 0:
+            return None, None, "commands is not a list of commands"
+        for index, command in enumerate(commands):
+            if not isinstance(command, dict) or not isinstance(command.get("command"), str):
+                return None, None, f"command {index} is not valid"
+            if command["command"] in self.unsupported_commands:
+                return None, None, f"command {index} {command['command']} is not supported in a batch"
+        stop_on_error = data.get("stop_on_error", True)
+        if not isinstance(stop_on_error, bool):
+            return None, None, "invalid value for stop_on_error"
+        return commands, stop_on_error, None
+
+    def run(self, data):
+        """Run the batch of commands, returning the status code, message,
+            and the results with the status, message, and data of each command"""
+        commands, stop_on_error, error = self.parse(data)
+        if error is not None:
+            return 500, f"Failed processing batch command due to {error}", None
+        results = []
+        failed = 0
+        for command in commands:
+            status_code, message, return_data = self.run_command(
+                command["command"], command.get("data"))
+            if isinstance(return_data, Path):
+                # Files are only returned by some calls, e.g. a graph sequence
+                if return_data.is_file():
+                    return_data.unlink()
+                status_code = 500
+                message = f"Failed processing {command['command']} command due to file output not supported in a batch"
+                return_data = None
+            results.append({
+                "command": command["command"],
+                "status": status_code,
+                "message": message,
+                "data": return_data
+            })
+            if status_code != 200:
+                failed += 1
+                if stop_on_error:
+                    break
+        return_data = {
+            "results": results,
+            "skipped": len(commands) - len(results)
+        }
+        if failed > 0:
+            message = f"Failed processing batch command due to {failed} of {len(commands)} commands failing"
+            return 500, message, return_data
+        return 200, "Success processing batch command", return_data
@@ -0,0 +1,193 @@
+"""
+
+Binary encoding of responses with a graph or graph delta, as an alternative
+to JSON. The node features are sent as typed float32 arrays and the ids
+as a table, so they can be decoded straight into NumPy arrays
+
+Layout, little endian:
+- Magic bytes, format version, and length of the JSON header
+- JSON header with the status, message, response data without the graph,
+  the id table, columns of other node and link values, and the array table
+- Arrays, each aligned to 4 bytes at the offset given in the array table
+
+For a graph delta, the added and modified nodes and links are encoded
+as a graph, and the rest of the delta is in the JSON header
+
+"""
+
+
+import sys
+import json
+import struct
+from array import array
+
+
+CONTENT_TYPE = "application/vnd.fusion360gym.graph"
+MAGIC = b"F3DG"
+VERSION = 1
+PREFIX = struct.Struct("<4sII")
+
+
+def encode_response(status_code, message, data):
+    """Encode a response with a graph or graph delta in the data as bytes"""
+    data = dict(data)
+    header = {
+        "status": status_code,
+        "message": message,
+        "data": data
+    }
+    if "graph_delta" in data:
+        delta = dict(data.pop("graph_delta"))
+        # Encode the added and modified items as a graph
+        graph = {}
+        for key in ["nodes", "links"]:
+            item_delta = dict(delta[key])
+            graph[key] = item_delta.pop("added") + item_delta.pop("modified")
+            item_delta["num_added"] = len(graph[key]) - len(delta[key]["modified"])
+            delta[key] = item_delta
+        header["graph_delta"] = delta
+    else:
+        graph = data.pop("graph")
+    arrays = []
+    header["graph"] = encode_graph(graph, arrays)
+    # Place the arrays after the header
+    offset = 0
+    for entry, values in arrays:
+        entry["offset"] = offset
+        offset += len(values) * values.itemsize
+    header_bytes = json.dumps(header).encode("utf8")
+    header_bytes += b" " * (-len(header_bytes) % 4)
+    chunks = [PREFIX.pack(MAGIC, VERSION, len(header_bytes)), header_bytes]
+    for entry, values in arrays:
+        if sys.byteorder == "big":
+            values.byteswap()
+        chunks.append(values.tobytes())
+    return b"".join(chunks)
+
+
+def encode_graph(graph, arrays):
+    """Encode the graph as a JSON header, adding its arrays to the list"""
+    ids = {}
+    nodes = graph["nodes"]
+    links = graph["links"]
+    header = {
+        key: value for key, value in graph.items() if key not in ["nodes", "links"]
+    }
+    header["num_nodes"] = len(nodes)
+    header["num_links"] = len(links)
+    header["node_columns"] = {}
+    header["link_columns"] = {}
+    header["arrays"] = []
+
+    def add_array(name, typecode, shape, values):
+        entry = {
+            "name": name,
+            "dtype": {"f": "<f4", "i": "<i4"}[typecode],
+            "shape": shape
+        }
+        header["arrays"].append(entry)
+        arrays.append((entry, array(typecode, values)))
+
+    def add_ids(name, values):
+        add_array(name, "i", [len(values)], [ids.setdefault(x, len(ids)) for x in values])
+
+    for key in get_keys(nodes):
+        values = [node.get(key) for node in nodes]
+        if key == "id":
+            add_ids("node:id", values)
+            continue
+        # Lists of numbers with the same length for all nodes become 2D arrays
+        if len(values) > 0 and all(isinstance(x, list) for x in values):
+            length = len(values[0])
+            if all(len(x) == length for x in values):
+                flat = array("f")
+                for x in values:
+                    flat.extend(x)
+                add_array(f"node:{key}", "f", [len(values), length], flat)
+                continue
+        header["node_columns"][key] = values
+    for key in get_keys(links):
+        values = [link.get(key) for link in links]
+        if key in ["id", "source", "target"]:
+            add_ids(f"link:{key}", values)
+        else:
+            header["link_columns"][key] = values
+    # Strings of the id table in order of their index
+    header["ids"] = list(ids)
+    return header
+
+
+def get_keys(items):
+    """Get the keys of a list of dicts in order of first appearance"""
+    keys = {}
+    for item in items:
+        keys.update(dict.fromkeys(item))
+    return list(keys)
+
+
+def decode_response(content):
+    """Decode a binary response into the same structure as the JSON response,
+        with the graph node features as NumPy arrays"""
+    # The server in Fusion 360 encodes without NumPy
+    import numpy as np
+    content = memoryview(content)
+    magic, version, header_length = PREFIX.unpack_from(content)
+    if magic != MAGIC:
+        raise ValueError("Invalid binary graph response")
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary graph version: {version}")
+    start = PREFIX.size
+    header = json.loads(bytes(content[start:start + header_length]))
+    start += header_length
+    graph_header = header.pop("graph")
+    arrays = {}
+    for entry in graph_header["arrays"]:
+        count = int(np.prod(entry["shape"]))
+        arrays[entry["name"]] = np.frombuffer(
+            content, dtype=entry["dtype"], count=count,
+            offset=start + entry["offset"]
+        ).reshape(entry["shape"])
+    graph = decode_graph(graph_header, arrays)
+    if "graph_delta" in header:
+        delta = header.pop("graph_delta")
+        for key in ["nodes", "links"]:
+            num_added = delta[key].pop("num_added")
+            delta[key]["added"] = graph[key][:num_added]
+            delta[key]["modified"] = graph[key][num_added:]
+        header["data"]["graph_delta"] = delta
+    else:
+        header["data"]["graph"] = graph
+    return header
+
+
+def decode_graph(header, arrays):
+    """Decode a graph from its JSON header and arrays.
+        Each node has rows of the node feature arrays, which are also
+        given in node_features for the whole graph"""
+    ids = header["ids"]
+    graph = {
+        key: value for key, value in header.items() if key not in [
+            "num_nodes", "num_links", "node_columns", "link_columns", "arrays", "ids"
+        ]
+    }
+    node_features = {}
+    nodes = [{} for i in range(header["num_nodes"])]
+    links = [{} for i in range(header["num_links"])]
+    for name, values in arrays.items():
+        items, key = name.split(":", 1)
+        items = nodes if items == "node" else links
+        if values.dtype.kind == "i":
+            values = [ids[x] for x in values.tolist()]
+        else:
+            node_features[key] = values
+        for item, value in zip(items, values):
+            item[key] = value
+    for items, columns in [(nodes, header["node_columns"]), (links, header["link_columns"])]:
+        for key, values in columns.items():
+            for item, value in zip(items, values):
+                if value is not None:
+                    item[key] = value
+    graph["nodes"] = nodes
+    graph["links"] = links
+    graph["node_features"] = node_features
+    return graph
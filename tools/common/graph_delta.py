@@ -0,0 +1,118 @@
+"""
+
+Graph deltas to send only the nodes and links that changed
+since the last graph sent to a client
+
+A delta has the version of the graph it applies to (base_version),
+the version of the new graph, the graph attributes, and for both the nodes
+and links, the added and modified items and the ids of the removed items.
+If the new graph does not have the order given by applying the delta,
+the order of the ids is also given
+
+"""
+
+
+import time
+
+
+class GraphDeltaEncoder():
+    """Keeps the last graph sent to a client,
+        to send the changes to the next graph as a delta"""
+
+    def __init__(self):
+        # Versions start from the time in ms, so a client with a version
+        # from before the server was restarted doesn't get a delta
+        self.version = int(time.time() * 1000)
+        self.graph = None
+
+    def encode(self, return_data, base_version):
+        """Replace the graph in the response data with a delta,
+            if the client has the last graph, and add the graph version"""
+        return_data = dict(return_data)
+        graph = return_data.pop("graph")
+        delta = None
+        if self.graph is not None and base_version == self.version:
+            delta = get_delta(self.graph, graph)
+        self.version += 1
+        self.graph = graph
+        if delta is None:
+            return_data["graph"] = graph
+        else:
+            delta["base_version"] = base_version
+            delta["version"] = self.version
+            return_data["graph_delta"] = delta
+        return_data["graph_version"] = self.version
+        return return_data
+
+
+def get_delta(old_graph, new_graph):
+    """Get the delta from the old graph to the new graph,
+        or None if it is no smaller than the new graph"""
+    delta = {
+        "attributes": {
+            key: value for key, value in new_graph.items() if key not in ["nodes", "links"]
+        }
+    }
+    changes = 0
+    for key in ["nodes", "links"]:
+        old_items = get_items_by_id(old_graph[key])
+        new_items = get_items_by_id(new_graph[key])
+        # Duplicate ids can't be matched between graphs
+        if old_items is None or new_items is None:
+            return None
+        added = [item for item in new_graph[key] if item["id"] not in old_items]
+        modified = [
+            item for item in new_graph[key]
+            if item["id"] in old_items and item != old_items[item["id"]]
+        ]
+        removed = [item_id for item_id in old_items if item_id not in new_items]
+        changes += len(added) + len(modified)
+        delta[key] = {
+            "added": added,
+            "modified": modified,
+            "removed": removed
+        }
+        # Give the order if applying the delta doesn't reproduce it
+        order = [item["id"] for item in new_graph[key]]
+        if order != get_order(old_graph[key], delta[key]):
+            delta[key]["order"] = order
+    if changes >= len(new_graph["nodes"]) + len(new_graph["links"]) and changes > 0:
+        return None
+    return delta
+
+
+def get_items_by_id(items):
+    """Get a dict of items by id, or None if the ids are missing or not unique"""
+    if any("id" not in item for item in items):
+        return None
+    items_by_id = {item["id"]: item for item in items}
+    if len(items_by_id) != len(items):
+        return None
+    return items_by_id
+
+
+def get_order(old_items, item_delta):
+    """Get the order of the item ids after applying a delta,
+        keeping the order of the old items and adding new items at the end"""
+    removed = set(item_delta["removed"])
+    order = [item["id"] for item in old_items if item["id"] not in removed]
+    order.extend(item["id"] for item in item_delta["added"])
+    return order
+
+
+def apply_delta(graph, delta):
+    """Apply a delta to a graph, returning a new graph.
+        Unchanged nodes and links are shared with the old graph"""
+    new_graph = dict(delta["attributes"])
+    for key in ["nodes", "links"]:
+        item_delta = delta[key]
+        items = {item["id"]: item for item in graph[key]}
+        for item in item_delta["modified"]:
+            items[item["id"]] = item
+        for item in item_delta["added"]:
+            items[item["id"]] = item
+        order = item_delta.get("order")
+        if order is None:
+            order = get_order(graph[key], item_delta)
+        new_graph[key] = [items[item_id] for item_id in order]
+    return new_graph
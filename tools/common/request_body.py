@@ -0,0 +1,111 @@
+"""
+
+Request bodies sent to the gym server, either JSON compressed with
+gzip or deflate (Content-Encoding), or a file uploaded as the raw body
+with the command in a header, so large B-Rep files don't have to be
+escaped as a JSON string
+
+"""
+
+
+import json
+import zlib
+import shutil
+import tempfile
+from pathlib import Path
+
+
+UPLOAD_CONTENT_TYPE = "application/octet-stream"
+COMMAND_HEADER = "X-Fusion360Gym-Command"
+# zlib window bits for each supported content encoding
+CONTENT_ENCODINGS = {
+    "identity": None,
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS
+}
+CHUNK_SIZE = 64 * 1024
+
+
+def compress(body, encoding, level=1):
+    """Compress the body of a request with the given content encoding.
+        A low compression level is used by default as the server is
+        often local, where compression time matters more than size"""
+    compressor = zlib.compressobj(level, wbits=CONTENT_ENCODINGS[encoding])
+    return compressor.compress(body) + compressor.flush()
+
+
+def get_content_encoding(headers):
+    """Get the content encoding of a request"""
+    encoding = headers.get("Content-Encoding", "identity").strip().lower()
+    if encoding not in CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+    return encoding
+
+
+def is_upload(headers):
+    """Check if the request body is an uploaded file"""
+    content_type = headers.get("Content-Type", "")
+    return content_type.split(";")[0].strip() == UPLOAD_CONTENT_TYPE
+
+
+def read_chunks(rfile, headers):
+    """Read the request body in chunks, decompressing it if encoded"""
+    wbits = CONTENT_ENCODINGS[get_content_encoding(headers)]
+    decompressor = None
+    if wbits is not None:
+        decompressor = zlib.decompressobj(wbits)
+    remaining = int(headers.get("Content-Length", 0))
+    try:
+        while remaining > 0:
+            chunk = rfile.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError("Request body ended before Content-Length")
+            remaining -= len(chunk)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            yield chunk
+        if decompressor is not None:
+            yield decompressor.flush()
+            if not decompressor.eof:
+                raise ValueError("Compressed request body is incomplete")
+    except zlib.error as ex:
+        raise ValueError(f"Invalid compressed request body: {ex}")
+
+
+def read_json(rfile, headers):
+    """Read a JSON request body"""
+    return json.loads(b"".join(read_chunks(rfile, headers)))
+
+
+def read_upload(rfile, headers):
+    """Read the command from the header of an uploaded file
+        and stream the file to a temp directory, with the path
+        given in the file_upload value of the command data"""
+    command_header = headers.get(COMMAND_HEADER)
+    if command_header is None:
+        raise ValueError(f"{COMMAND_HEADER} header not present")
+    post_data = json.loads(command_header)
+    data = post_data.get("data") if isinstance(post_data, dict) else None
+    if not isinstance(data, dict) or not isinstance(data.get("file"), str):
+        raise ValueError("file not specified for upload")
+    # Keep only the name so the upload can't be written elsewhere
+    file_name = Path(data["file"]).name
+    if file_name == "":
+        raise ValueError("file not specified for upload")
+    upload_file = Path(tempfile.mkdtemp()) / file_name
+    try:
+        with open(upload_file, "wb") as file_handle:
+            for chunk in read_chunks(rfile, headers):
+                file_handle.write(chunk)
+    except Exception:
+        shutil.rmtree(upload_file.parent, ignore_errors=True)
+        raise
+    # A Path can't come from JSON, so commands can trust it is an upload
+    data["file_upload"] = upload_file
+    return post_data
+
+
+def remove_upload(data):
+    """Remove the temp directory of an uploaded file, if any"""
+    if isinstance(data, dict) and isinstance(data.get("file_upload"), Path):
+        shutil.rmtree(data["file_upload"].parent, ignore_errors=True)
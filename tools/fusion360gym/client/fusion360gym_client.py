@@ -1,4 +1,5 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import json
 from pathlib import Path
@@ -6,13 +7,35 @@ import shutil
 import tempfile
 from zipfile import ZipFile
 import random
+import sys
 import numpy as np
 
+# Add the common folder to sys.path
+COMMON_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "common")
+if COMMON_DIR not in sys.path:
+    sys.path.append(COMMON_DIR)
+
+import graph_binary
+import request_body
+from command_batch import CommandBatch
+
 
 class Fusion360GymClient():
 
-    def __init__(self, url="http://127.0.0.1:8080"):
+    def __init__(self, url="http://127.0.0.1:8080", pool_size=1, timeout=None, content_encoding=None):
         self.url = url
+        # Number of connections kept alive to the server
+        self.pool_size = pool_size
+        # Seconds to wait for the server to connect and respond,
+        # as a single value or a (connect, read) tuple, None to wait forever
+        self.timeout = timeout
+        # Compress large request bodies with gzip or deflate, None to not compress
+        if content_encoding not in [None, "gzip", "deflate"]:
+            raise Exception(f"Invalid content_encoding value: {content_encoding}")
+        self.content_encoding = content_encoding
+        # Smallest request body in bytes to compress
+        self.compress_min_size = 1024
+        self.session = None
         self.feature_operations = [
             "JoinFeatureOperation",
             "CutFeatureOperation",
@@ -20,6 +43,8 @@ class Fusion360GymClient():
             "NewBodyFeatureOperation"
         ]
         self.construction_planes = ["XY", "XZ", "YZ"]
+        # Formats the graph in a response can be requested in
+        self.response_formats = ["json", "binary"]
         self.distribution_categories = [
             "sketch_plane",
             "num_faces",
@@ -31,18 +56,79 @@ class Fusion360GymClient():
             "profile_areas"
         ]
 
-    def send_command(self, command, data=None, stream=False):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_session(self):
+        """Get the session that keeps connections to the server alive"""
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def close(self):
+        """Close the connections to the server,
+            a new session is started by the next command"""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def send_command(self, command, data=None, stream=False, response_format="json", graph_version=None, upload=None):
+        """Send a command to the server, with the file given by upload
+            sent as the raw request body and the command in a header"""
         command_data = {
             "command": command,
         }
         if data is not None:
             command_data["data"] = data
-        return requests.post(
+        if response_format != "json":
+            command_data["response_format"] = response_format
+        if graph_version is not None:
+            command_data["graph_delta"] = graph_version
+        headers = {}
+        if upload is None:
+            body = json.dumps(command_data).encode("utf8")
+        else:
+            headers["Content-Type"] = request_body.UPLOAD_CONTENT_TYPE
+            headers[request_body.COMMAND_HEADER] = json.dumps(command_data)
+            if self.content_encoding is None:
+                # Stream the file from disk
+                with open(upload, "rb") as file_handle:
+                    return self.post(file_handle, headers, stream)
+            with open(upload, "rb") as file_handle:
+                body = file_handle.read()
+        if self.content_encoding is not None and len(body) >= self.compress_min_size:
+            body = request_body.compress(body, self.content_encoding)
+            headers["Content-Encoding"] = self.content_encoding
+        return self.post(body, headers, stream)
+
+    def post(self, body, headers, stream=False):
+        """Post a request body to the server"""
+        return self.get_session().post(
             url=self.url,
-            data=json.dumps(command_data),
-            stream=stream
+            data=body,
+            headers=headers,
+            stream=stream,
+            timeout=self.timeout
         )
 
+    def batch(self):
+        """Start a batch of commands to send to the server in a single request"""
+        return Fusion360GymBatch(self)
+
+    def decode_response(self, r):
+        """Get the response data of a call, from either a JSON response,
+            or a binary response with the graph node features as NumPy arrays.
+            Use graph_delta.apply_delta() to apply a graph_delta in the data"""
+        if r.headers.get("Content-Type") == graph_binary.CONTENT_TYPE:
+            return graph_binary.decode_response(r.content)
+        return r.json()
+
     # -------------------------------------------------------------------------
     # RECONSTRUCTION
     # -------------------------------------------------------------------------
@@ -288,9 +374,13 @@ class Fusion360GymClient():
     # TARGET RECONSTRUCTION
     # -------------------------------------------------------------------------
 
-    def set_target(self, file):
+    def set_target(self, file, response_format="json", graph_version=None, upload=False):
         """Set the target that we want to reconstruct with a .step or .smt file.
+            The file is uploaded as the raw request body if upload is True,
+            rather than as text in the JSON command.
             This call will clear the current design"""
+        if response_format not in self.response_formats:
+            return self.__return_error(f"Invalid response_format value")
         if isinstance(file, str):
             file = Path(file)
         if not file.exists():
@@ -299,6 +389,12 @@ class Fusion360GymClient():
         valid_formats = [".step", ".stp", ".smt"]
         if suffix not in valid_formats:
             return self.__return_error(f"Invalid file format: {suffix}")
+        if upload:
+            return self.send_command(
+                "set_target", {"file": file.name},
+                response_format=response_format, graph_version=graph_version,
+                upload=file
+            )
         # Open the file and load the text
         with open(file, "r") as f:
             file_data = f.read()
@@ -306,14 +402,24 @@ class Fusion360GymClient():
             "file": file.name,
             "file_data": file_data
         }
-        return self.send_command("set_target", command_data)
+        return self.send_command(
+            "set_target", command_data,
+            response_format=response_format, graph_version=graph_version
+        )
 
-    def revert_to_target(self):
+    def revert_to_target(self, response_format="json", graph_version=None):
         """Reverts to the target design, removing all reconstruction"""
-        return self.send_command("revert_to_target")
+        if response_format not in self.response_formats:
+            return self.__return_error(f"Invalid response_format value")
+        return self.send_command(
+            "revert_to_target",
+            response_format=response_format, graph_version=graph_version
+        )
 
-    def add_extrude_by_target_face(self, start_face, end_face, operation):
+    def add_extrude_by_target_face(self, start_face, end_face, operation, response_format="json", graph_version=None):
         """Add an extrude between two faces of the target"""
+        if response_format not in self.response_formats:
+            return self.__return_error(f"Invalid response_format value")
         if not isinstance(start_face, str) or len(start_face) == 0:
             return self.__return_error(f"Invalid start_face value")
         if not isinstance(end_face, str) or len(end_face) == 0:
@@ -325,11 +431,16 @@ class Fusion360GymClient():
             "end_face": end_face,
             "operation": operation
         }
-        return self.send_command("add_extrude_by_target_face", command_data)
+        return self.send_command(
+            "add_extrude_by_target_face", command_data,
+            response_format=response_format, graph_version=graph_version
+        )
 
-    def add_extrudes_by_target_face(self, actions, revert=False):
+    def add_extrudes_by_target_face(self, actions, revert=False, response_format="json", graph_version=None):
         """Executes multiple extrude operations,
             between two faces of the target, in sequence"""
+        if response_format not in self.response_formats:
+            return self.__return_error(f"Invalid response_format value")
         if (actions is None or not isinstance(actions, list) or
            len(actions) == 0):
             return self.__return_error(f"Invalid actions")
@@ -351,7 +462,10 @@ class Fusion360GymClient():
             "actions": actions,
             "revert": revert
         }
-        return self.send_command("add_extrudes_by_target_face", command_data)
+        return self.send_command(
+            "add_extrudes_by_target_face", command_data,
+            response_format=response_format, graph_version=graph_version
+        )
 
     # -------------------------------------------------------------------------
     # RANDOMIZED RECONSTRUCTION
@@ -813,3 +927,41 @@ class Fusion360GymClient():
                 return "Invalid key"
             vector["type"] = "Vector3D"
         return None
+
+
+class Fusion360GymBatch(Fusion360GymClient):
+    """Builds a batch of commands with the same calls as the client,
+        which are added to the batch rather than sent, e.g.
+        client.batch().clear().add_sketch("XY").send()"""
+
+    def __init__(self, client):
+        super().__init__(client.url)
+        self.client = client
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def send_command(self, command, data=None, stream=False, response_format="json", graph_version=None, upload=None):
+        """Add a command to the batch, returning the batch to chain calls"""
+        is_file = command == "graph" and data is not None and data.get("sequence")
+        if command in CommandBatch.unsupported_commands or is_file or upload is not None:
+            raise Exception(f"{command} command is not supported in a batch")
+        batch_command = {
+            "command": command
+        }
+        if data is not None:
+            batch_command["data"] = data
+        self.commands.append(batch_command)
+        return self
+
+    def send(self, stop_on_error=True):
+        """Send the batch of commands in a single request.
+            The response data has the results of the commands, each with
+            a status, message, and data, and the number of commands skipped
+            after a failed command when stopping on the first error"""
+        command_data = {
+            "commands": self.commands,
+            "stop_on_error": stop_on_error
+        }
+        return self.client.send_command("batch", command_data)
@@ -24,18 +24,35 @@ from launcher import Launcher
 
 class GymEnv():
 
+    # Clients shared by the envs of each endpoint,
+    # so they reuse the same connections to the gym
+    clients = {}
+
     def __init__(self, host="127.0.0.1", port=8080, launch_gym=False):
         self.host = host
         self.port = port
-        self.client = Fusion360GymClient(f"http://{self.host}:{self.port}")
+        self.client = self.get_client(f"http://{self.host}:{self.port}")
         # Fusion subprocess
         self.p = None
         if launch_gym:
             self.launch_gym()
 
+    @classmethod
+    def get_client(cls, url):
+        """Get the client for an endpoint"""
+        if url not in cls.clients:
+            cls.clients[url] = Fusion360GymClient(url)
+        return cls.clients[url]
+
+    def close(self):
+        """Close the connections to the gym"""
+        self.client.close()
+
     def launch_gym(self):
         """Launch the Fusion 360 Gym on the given host/port"""
         print("Launching Gym...")
+        # Connections to the previous gym can't be reused
+        self.client.close()
         if self.p is not None:
             # Give a second for Fusion to crash
             time.sleep(2)
@@ -51,6 +68,7 @@ class GymEnv():
     def kill_gym(self, including_parent=True):
         """Kill this instance of the Fusion 360 Gym"""
         print("Killing Gym...")
+        self.client.close()
         if self.p is not None:
             try:
                 parent = psutil.Process(self.p.pid)
@@ -9,6 +9,7 @@ import adsk.fusion
 import os
 import sys
 import importlib
+from pathlib import Path
 
 from .command_base import CommandBase
 
@@ -40,10 +41,14 @@ class CommandFaceExtrusion(CommandBase):
         if error is not None:
             return self.runner.return_failure(error)
         # self.design.designType = adsk.fusion.DesignTypes.ParametricDesignType
-        # Create the file locally
-        temp_file = self.get_temp_file(data["file"])
-        with open(temp_file, "w") as f:
-            f.write(data["file_data"])
+        if isinstance(data.get("file_upload"), Path):
+            # The file was uploaded and saved locally by the server
+            temp_file = data["file_upload"]
+        else:
+            # Create the file locally
+            temp_file = self.get_temp_file(data["file"])
+            with open(temp_file, "w") as f:
+                f.write(data["file_data"])
         # We clear the design before importing
         # This also clears the local state
         self.design_state.clear()
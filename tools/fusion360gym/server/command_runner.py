@@ -10,9 +10,20 @@ import traceback
 import tempfile
 import shutil
 import os
+import sys
+import importlib
 from zipfile import ZipFile
 from pathlib import Path
 
+# Add the common folder to sys.path
+COMMON_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "common"))
+if COMMON_DIR not in sys.path:
+    sys.path.append(COMMON_DIR)
+
+import command_batch
+importlib.reload(command_batch)
+from command_batch import CommandBatch
+
 from .command_export import CommandExport
 from .command_sketch_extrusion import CommandSketchExtrusion
 from .command_face_extrusion import CommandFaceExtrusion
@@ -38,6 +49,8 @@ class CommandRunner():
             self.reconstruct
         ]
         self.design_state.set_command_objects(self.command_objects)
+        # Commands in a batch are run without updating the UI after each one
+        self.batch = CommandBatch(self.execute_command)
 
     def set_logger(self, logger):
         """Set the logger in all command objects"""
@@ -47,6 +60,14 @@ class CommandRunner():
             obj.set_logger(logger)
 
     def run_command(self, command, data=None):
+        """Run a command and update the UI"""
+        try:
+            return self.execute_command(command, data)
+        finally:
+            # Update the UI
+            adsk.doEvents()
+
+    def execute_command(self, command, data=None):
         """Run a command and route it to the right method"""
         try:
             self.last_command = command
@@ -93,14 +114,13 @@ class CommandRunner():
                 result = self.face_extrusion.add_extrude_by_target_face(data)
             elif command == "add_extrudes_by_target_face":
                 result = self.face_extrusion.add_extrudes_by_target_face(data)
+            elif command == "batch":
+                result = self.batch.run(data)
             else:
                 return self.return_failure("Unknown command")
             return result
         except Exception as ex:
             return self.return_exception(ex)
-        finally:
-            # Update the UI
-            adsk.doEvents()
 
     def ping(self):
         """Ping for debugging"""
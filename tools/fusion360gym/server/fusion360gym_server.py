@@ -18,6 +18,12 @@ COMMON_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..",
 if COMMON_DIR not in sys.path:
     sys.path.append(COMMON_DIR)
 
+import graph_binary
+import graph_delta
+import request_body
+importlib.reload(graph_binary)
+importlib.reload(graph_delta)
+importlib.reload(request_body)
 from logger import Logger
 from .command_runner import CommandRunner
 
@@ -40,17 +46,34 @@ class OnlineStatusChangedHandler(adsk.core.ApplicationEventHandler):
 
 class Fusion360GymServerRequestHandler(BaseHTTPRequestHandler):
 
-    def __init__(self, logger, runner, *args):
+    # Keep connections alive so clients can reuse them between commands
+    protocol_version = "HTTP/1.1"
+    # The server handles one connection at a time,
+    # so close idle connections to let other clients connect
+    timeout = 10
+    # Send small responses immediately rather than waiting for the previous ack
+    disable_nagle_algorithm = True
+
+    def __init__(self, logger, runner, graph_deltas, *args):
         self.logger = logger
         self.runner = runner
+        self.graph_deltas = graph_deltas
         BaseHTTPRequestHandler.__init__(self, *args)
 
     def do_HEAD(self):
+        # No response is sent, so the connection can't be reused
+        self.close_connection = True
         return
 
     def do_POST(self):
         try:
-            post_data = self.get_post_data()
+            try:
+                post_data = self.get_post_data()
+            except ValueError as ex:
+                # The rest of the body may not have been read
+                self.close_connection = True
+                self.respond(400, f"Invalid request body: {ex}")
+                return
             self.logger.log("\n")
             # logger.log(json.dumps(post_data))
             if "command" not in post_data:
@@ -73,9 +96,18 @@ class Fusion360GymServerRequestHandler(BaseHTTPRequestHandler):
                 data = post_data["data"]
 
             status_code, message, return_data = self.runner.run_command(command, data)
+            request_body.remove_upload(data)
+            if ("graph_delta" in post_data and
+                    isinstance(return_data, dict) and "graph" in return_data):
+                # Send the changes since the last graph the client has
+                return_data = self.graph_deltas.encode(return_data, post_data["graph_delta"])
             if return_data is not None and isinstance(return_data, Path):
                     self.logger.log(f"[{status_code}] {return_data}")
                     self.respond_binary_file(status_code, return_data)
+            elif (post_data.get("response_format") == "binary" and
+                    isinstance(return_data, dict) and ("graph" in return_data or "graph_delta" in return_data)):
+                self.logger.log(f"[{status_code}] {message}")
+                self.respond_binary_graph(status_code, message, return_data)
             else:
                 self.logger.log(f"[{status_code}] {message}")
                 # if return_data is not None:
@@ -92,8 +124,10 @@ class Fusion360GymServerRequestHandler(BaseHTTPRequestHandler):
         self.respond(400, "GET not supported, use POST")
 
     def get_post_data(self):
-        content_len = int(self.headers.get('Content-Length'))
-        post_body = self.rfile.read(content_len)
+        if request_body.is_upload(self.headers):
+            # Stream an uploaded file straight to a temp file
+            return request_body.read_upload(self.rfile, self.headers)
+        post_body = b"".join(request_body.read_chunks(self.rfile, self.headers))
         # self.logger.log(f"post_body: {post_body}")
         post_body_json = json.loads(post_body)
         return post_body_json
@@ -101,12 +135,21 @@ class Fusion360GymServerRequestHandler(BaseHTTPRequestHandler):
     def respond_binary_file(self, status_code, binary_file):
         self.send_response(status_code)
         self.send_header("Content-type", "application/octet-stream")
+        self.send_header("Content-Length", str(binary_file.stat().st_size))
         self.end_headers()
         with open(binary_file, "rb") as file_handle:
             shutil.copyfileobj(file_handle, self.wfile)
         # Remove the file we made after we are done
         binary_file.unlink()
 
+    def respond_binary_graph(self, status_code, message, return_data):
+        binary_bytes = graph_binary.encode_response(status_code, message, return_data)
+        self.send_response(status_code)
+        self.send_header("Content-type", graph_binary.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(binary_bytes)))
+        self.end_headers()
+        self.wfile.write(binary_bytes)
+
     def respond(self, status_code, message, return_data=None):
         data = {
             "status": status_code,
@@ -114,13 +157,16 @@ class Fusion360GymServerRequestHandler(BaseHTTPRequestHandler):
         }
         if return_data is not None:
             data["data"] = return_data
-        json_string = json.dumps(data)
+        json_bytes = json.dumps(data).encode(encoding='utf_8')
         self.send_response(status_code)
         self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(json_bytes)))
         self.end_headers()
-        self.wfile.write(json_string.encode(encoding='utf_8'))
+        self.wfile.write(json_bytes)
 
     def detach(self):
+        # Close this connection so the server can stop
+        self.close_connection = True
         # We have to shutdown the server from a separate thread to avoid deadlock
         server_shutdown_thread = threading.Thread(target=self.server.shutdown)
         server_shutdown_thread.daemon = True
@@ -162,10 +208,12 @@ def start_server():
     # # Set up the command runner we use to execute commands
     runner = CommandRunner()
     runner.set_logger(logger)
+    # Last graph sent, for clients that request graph deltas
+    graph_deltas = graph_delta.GraphDeltaEncoder()
 
-    # Workaround to pass the logger and runner
+    # Workaround to pass the logger, runner and graph deltas
     def handler(*args):
-        Fusion360GymServerRequestHandler(logger, runner, *args)
+        Fusion360GymServerRequestHandler(logger, runner, graph_deltas, *args)
 
     # Check if we need to use a different host name and port
     host_name, port_number = get_launch_endpoint()
@@ -0,0 +1,197 @@
+"""
+
+Test parsing and running batches of commands with a stubbed runner,
+does not require the Fusion 360 Gym to be running
+
+"""
+import unittest
+import sys
+import os
+from pathlib import Path
+import tempfile
+
+# Add the client folder to sys.path
+CLIENT_DIR = os.path.join(os.path.dirname(__file__), "..", "client")
+if CLIENT_DIR not in sys.path:
+    sys.path.append(CLIENT_DIR)
+
+from fusion360gym_client import Fusion360GymClient
+from command_batch import CommandBatch
+
+
+class StubRunner():
+    """Runner that records the commands it runs,
+        failing those in the list of failing commands"""
+
+    def __init__(self, failing_commands=None, return_data=None):
+        self.commands = []
+        self.failing_commands = failing_commands or []
+        self.return_data = return_data
+
+    def run_command(self, command, data=None):
+        self.commands.append((command, data))
+        if command in self.failing_commands:
+            return 500, f"Failed processing {command} command due to stub failure", None
+        return 200, f"Success processing {command} command", self.return_data
+
+
+class StubClient():
+    """Client that records the commands it sends"""
+
+    def __init__(self):
+        self.url = "http://127.0.0.1:8080"
+        self.commands = []
+
+    def send_command(self, command, data=None):
+        self.commands.append((command, data))
+        return command, data
+
+
+class TestCommandBatch(unittest.TestCase):
+
+    def test_parse(self):
+        batch = CommandBatch(StubRunner().run_command)
+        commands, stop_on_error, error = batch.parse({
+            "commands": [
+                {"command": "clear"},
+                {"command": "add_sketch", "data": {"sketch_plane": "XY"}}
+            ]
+        })
+        self.assertIsNone(error, msg="error is None")
+        self.assertEqual(len(commands), 2, msg="commands length equals 2")
+        self.assertTrue(stop_on_error, msg="stop_on_error defaults to True")
+        commands, stop_on_error, error = batch.parse({
+            "commands": [{"command": "clear"}],
+            "stop_on_error": False
+        })
+        self.assertIsNone(error, msg="error is None")
+        self.assertFalse(stop_on_error, msg="stop_on_error is False")
+
+    def test_parse_invalid(self):
+        batch = CommandBatch(StubRunner().run_command)
+        invalid_data = [
+            None,
+            {},
+            {"commands": "clear"},
+            {"commands": []},
+            {"commands": ["clear"]},
+            {"commands": [{"data": {}}]},
+            {"commands": [{"command": 1}]},
+            {"commands": [{"command": "mesh", "data": {"file": "test.stl"}}]},
+            {"commands": [{"command": "batch", "data": {"commands": []}}]},
+            {"commands": [{"command": "detach"}]},
+            {"commands": [{"command": "clear"}], "stop_on_error": "yes"}
+        ]
+        for data in invalid_data:
+            commands, stop_on_error, error = batch.parse(data)
+            self.assertIsNone(commands, msg=f"commands is None for {data}")
+            self.assertIsInstance(error, str, msg=f"error is a string for {data}")
+
+    def test_run(self):
+        runner = StubRunner(return_data={"value": 1})
+        batch = CommandBatch(runner.run_command)
+        status_code, message, return_data = batch.run({
+            "commands": [
+                {"command": "clear"},
+                {"command": "add_sketch", "data": {"sketch_plane": "XY"}},
+                {"command": "ping"}
+            ]
+        })
+        self.assertEqual(status_code, 200, msg="batch status code")
+        self.assertEqual(message, "Success processing batch command", msg="batch message")
+        self.assertEqual(runner.commands, [
+            ("clear", None),
+            ("add_sketch", {"sketch_plane": "XY"}),
+            ("ping", None)
+        ], msg="commands run in order")
+        results = return_data["results"]
+        self.assertEqual(len(results), 3, msg="results length equals 3")
+        self.assertEqual(return_data["skipped"], 0, msg="skipped equals 0")
+        for result, command in zip(results, ["clear", "add_sketch", "ping"]):
+            self.assertEqual(result["command"], command, msg="result command")
+            self.assertEqual(result["status"], 200, msg="result status")
+            self.assertEqual(result["data"], {"value": 1}, msg="result data")
+
+    def test_run_stop_on_error(self):
+        runner = StubRunner(failing_commands=["add_sketch"])
+        batch = CommandBatch(runner.run_command)
+        status_code, message, return_data = batch.run({
+            "commands": [
+                {"command": "clear"},
+                {"command": "add_sketch"},
+                {"command": "ping"}
+            ]
+        })
+        self.assertEqual(status_code, 500, msg="batch status code")
+        self.assertIn("1 of 3 commands failing", message, msg="batch message")
+        self.assertEqual(len(runner.commands), 2, msg="commands after the error are not run")
+        results = return_data["results"]
+        self.assertEqual([x["status"] for x in results], [200, 500], msg="result status")
+        self.assertEqual(return_data["skipped"], 1, msg="skipped equals 1")
+
+    def test_run_continue_on_error(self):
+        runner = StubRunner(failing_commands=["clear", "add_sketch"])
+        batch = CommandBatch(runner.run_command)
+        status_code, message, return_data = batch.run({
+            "commands": [
+                {"command": "clear"},
+                {"command": "add_sketch"},
+                {"command": "ping"}
+            ],
+            "stop_on_error": False
+        })
+        self.assertEqual(status_code, 500, msg="batch status code")
+        self.assertIn("2 of 3 commands failing", message, msg="batch message")
+        self.assertEqual(len(runner.commands), 3, msg="all commands are run")
+        results = return_data["results"]
+        self.assertEqual([x["status"] for x in results], [500, 500, 200], msg="result status")
+        self.assertEqual(return_data["skipped"], 0, msg="skipped equals 0")
+
+    def test_run_invalid(self):
+        runner = StubRunner()
+        batch = CommandBatch(runner.run_command)
+        status_code, message, return_data = batch.run({"commands": []})
+        self.assertEqual(status_code, 500, msg="batch status code")
+        self.assertIsNone(return_data, msg="return_data is None")
+        self.assertEqual(len(runner.commands), 0, msg="no commands are run")
+
+    def test_run_file_output(self):
+        temp_file_handle, temp_file_path = tempfile.mkstemp(suffix=".zip")
+        os.close(temp_file_handle)
+        temp_file = Path(temp_file_path)
+        runner = StubRunner(return_data=temp_file)
+        batch = CommandBatch(runner.run_command)
+        status_code, message, return_data = batch.run({
+            "commands": [{"command": "graph", "data": {"sequence": True}}]
+        })
+        self.assertEqual(status_code, 500, msg="batch status code")
+        self.assertIsNone(return_data["results"][0]["data"], msg="file is not returned")
+        self.assertFalse(temp_file.exists(), msg="file is deleted")
+
+    def test_client_batch(self):
+        client = StubClient()
+        batch = Fusion360GymClient.batch(client)
+        batch.clear().add_sketch("XY").ping().send(stop_on_error=False)
+        self.assertEqual(len(batch), 3, msg="batch length equals 3")
+        self.assertEqual(client.commands, [
+            ("batch", {
+                "commands": [
+                    {"command": "clear"},
+                    {"command": "add_sketch", "data": {"sketch_plane": "XY"}},
+                    {"command": "ping"}
+                ],
+                "stop_on_error": False
+            })
+        ], msg="batch is sent in one command")
+
+    def test_client_batch_unsupported(self):
+        batch = Fusion360GymClient.batch(StubClient())
+        with self.assertRaises(Exception):
+            batch.mesh("test.stl")
+        with self.assertRaises(Exception):
+            batch.detach()
+        self.assertEqual(len(batch), 0, msg="batch length equals 0")
+
+
+if __name__ == "__main__":
+    unittest.main()
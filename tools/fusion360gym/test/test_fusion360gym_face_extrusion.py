@@ -14,6 +14,7 @@ import json
 import shutil
 import time
 import math
+import numpy
 
 import common_test
 
@@ -22,7 +23,14 @@ CLIENT_DIR = os.path.join(os.path.dirname(__file__), "..", "client")
 if CLIENT_DIR not in sys.path:
     sys.path.append(CLIENT_DIR)
 
+# Add the search folder to sys.path
+SEARCH_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "search")
+if SEARCH_DIR not in sys.path:
+    sys.path.append(SEARCH_DIR)
+
 from fusion360gym_client import Fusion360GymClient
+from face_pair_index import FacePairIndex
+from graph_delta import apply_delta
 
 HOST_NAME = "127.0.0.1"
 PORT_NUMBER = 8080
@@ -73,6 +81,28 @@ class TestFusion360ServerFaceExtrusion(unittest.TestCase):
         common_test.check_bounding_box(self, response_json["data"])
         r = self.client.clear()
 
+    def test_set_target_upload(self):
+        r = self.client.set_target(self.couch_design_smt_file, upload=True)
+        self.assertIsNotNone(r, msg="set_target response is not None")
+        self.assertEqual(r.status_code, 200, msg="set_target status code")
+        response_json = r.json()
+        common_test.check_graph_format(self, response_json["data"])
+        common_test.check_bounding_box(self, response_json["data"])
+        r = self.client.clear()
+
+    def test_set_target_compressed(self):
+        for content_encoding in ["gzip", "deflate"]:
+            with Fusion360GymClient(f"http://{HOST_NAME}:{PORT_NUMBER}", content_encoding=content_encoding) as client:
+                for upload in [False, True]:
+                    r = client.set_target(self.couch_design_step_file, upload=upload)
+                    self.assertIsNotNone(r, msg="set_target response is not None")
+                    self.assertEqual(r.status_code, 200, msg="set_target status code")
+                    self.assertEqual(r.request.headers["Content-Encoding"], content_encoding, msg="request is compressed")
+                    response_json = r.json()
+                    common_test.check_graph_format(self, response_json["data"])
+                    common_test.check_bounding_box(self, response_json["data"])
+                    r = client.clear()
+
     def test_set_target_box(self):
         r = self.client.set_target(self.box_design_smt_file)
         self.assertIsNotNone(r, msg="set_target response is not None")
@@ -152,6 +182,43 @@ class TestFusion360ServerFaceExtrusion(unittest.TestCase):
         self.assertIsNotNone(r, msg="add_extrude_by_target_face response is not None")
         self.assertEqual(r.status_code, 500, msg="add_extrude_by_target_face status code")
 
+    def test_face_pair_index(self):
+        # Reasons the server rejects a face pair before extruding
+        geometry_errors = [
+            "Start face is not a plane",
+            "End face is not a plane",
+            "End face is not parallel to start face",
+            "End face is coplanar to start face"
+        ]
+        smt_files = [
+            self.box_design_smt_file,
+            self.boxes_design_smt_file,
+            self.couch_design_smt_file
+        ]
+        for smt_file in smt_files:
+            r = self.client.set_target(smt_file)
+            self.assertIsNotNone(r, msg="set_target response is not None")
+            self.assertEqual(r.status_code, 200, msg="set_target status code")
+            response_json = r.json()
+            graph = response_json["data"]["graph"]
+            face_pairs = FacePairIndex(graph)
+            self.assertGreater(face_pairs.valid.sum(), 0, msg="Valid face pairs > 0")
+            for start_face in face_pairs.node_names:
+                for end_face in face_pairs.node_names:
+                    r = self.client.add_extrudes_by_target_face([{
+                        "start_face": start_face,
+                        "end_face": end_face,
+                        "operation": "NewBodyFeatureOperation"
+                    }], revert=True)
+                    self.assertIsNotNone(r, msg="add_extrudes_by_target_face response is not None")
+                    message = r.json()["message"] if r.status_code != 200 else ""
+                    is_rejected = any(error in message for error in geometry_errors)
+                    self.assertEqual(
+                        face_pairs.is_valid(start_face, end_face), not is_rejected,
+                        msg=f"Face pair index agrees with server for {smt_file.name}"
+                    )
+            r = self.client.clear()
+
     def test_add_extrude_by_target_face_invalid_inputs(self):
         r = self.client.add_extrude_by_target_face(
             "",
@@ -282,6 +349,96 @@ class TestFusion360ServerFaceExtrusion(unittest.TestCase):
         common_test.check_extrude_data(self, response_data, has_iou=True)
         self.assertEqual(response_data["iou"], prev_iou, msg="iou == prev_iou")
 
+    def test_add_extrudes_by_target_face_binary(self):
+        r = self.client.set_target(self.couch_design_smt_file)
+        self.assertEqual(r.status_code, 200, msg="set_target status code")
+        json_data = self.client.decode_response(r)["data"]
+        r = self.client.set_target(self.couch_design_smt_file, response_format="binary")
+        self.assertEqual(r.status_code, 200, msg="set_target status code")
+        binary_data = self.client.decode_response(r)["data"]
+        self.assertEqual(json_data["bounding_box"], binary_data["bounding_box"], msg="bounding_box is equal")
+        json_graph = json_data["graph"]
+        binary_graph = binary_data["graph"]
+        self.assertEqual(json_graph["links"], binary_graph["links"], msg="links are equal")
+        self.assertEqual(len(json_graph["nodes"]), len(binary_graph["nodes"]), msg="nodes are equal")
+        for json_node, binary_node in zip(json_graph["nodes"], binary_graph["nodes"]):
+            self.assertEqual(json_node["id"], binary_node["id"], msg="node id is equal")
+            self.assertEqual(json_node["surface_type"], binary_node["surface_type"], msg="node surface_type is equal")
+            for key in ["points", "normals", "trimming_mask"]:
+                self.assertTrue(numpy.allclose(json_node[key], binary_node[key], atol=1e-5), msg=f"node {key} is close")
+        points = binary_graph["node_features"]["points"]
+        self.assertEqual(points.shape, (len(binary_graph["nodes"]), 300), msg="points array shape")
+
+        nodes = json_graph["nodes"]
+        actions = [
+            {
+                "start_face": nodes[0]["id"],
+                "end_face": nodes[9]["id"],
+                "operation": "NewBodyFeatureOperation"
+            }
+        ]
+        r = self.client.add_extrudes_by_target_face(actions, revert=True, response_format="binary")
+        self.assertEqual(r.status_code, 200, msg="add_extrudes_by_target_face status code")
+        binary_data = self.client.decode_response(r)["data"]
+        r = self.client.add_extrudes_by_target_face(actions, revert=True)
+        self.assertEqual(r.status_code, 200, msg="add_extrudes_by_target_face status code")
+        json_data = self.client.decode_response(r)["data"]
+        self.assertEqual(json_data["iou"], binary_data["iou"], msg="iou is equal")
+        self.assertEqual(json_data["extrude"], binary_data["extrude"], msg="extrude is equal")
+        self.assertEqual(
+            len(json_data["graph"]["nodes"]), len(binary_data["graph"]["nodes"]), msg="nodes are equal")
+
+    def test_add_extrude_by_target_face_graph_delta(self):
+        r = self.client.set_target(self.couch_design_smt_file, graph_version=0)
+        self.assertEqual(r.status_code, 200, msg="set_target status code")
+        response_data = r.json()["data"]
+        self.assertIn("graph", response_data, msg="set_target returns the whole graph")
+        self.assertIn("graph_version", response_data, msg="set_target returns the graph version")
+        nodes = response_data["graph"]["nodes"]
+        actions = [
+            {
+                "start_face": nodes[0]["id"],
+                "end_face": nodes[9]["id"],
+                "operation": "NewBodyFeatureOperation"
+            },
+            {
+                "start_face": nodes[1]["id"],
+                "end_face": nodes[3]["id"],
+                "operation": "CutFeatureOperation"
+            }
+        ]
+        # Extrude one action at a time, applying the deltas
+        graph = response_data["graph"]
+        graph_version = response_data["graph_version"]
+        for action in actions:
+            r = self.client.add_extrude_by_target_face(
+                action["start_face"],
+                action["end_face"],
+                action["operation"],
+                graph_version=graph_version
+            )
+            self.assertEqual(r.status_code, 200, msg="add_extrude_by_target_face status code")
+            response_data = r.json()["data"]
+            if "graph_delta" in response_data:
+                self.assertEqual(
+                    response_data["graph_delta"]["base_version"], graph_version, msg="graph delta base_version")
+                graph = apply_delta(graph, response_data["graph_delta"])
+            else:
+                graph = response_data["graph"]
+            self.assertGreater(response_data["graph_version"], graph_version, msg="graph_version increases")
+            graph_version = response_data["graph_version"]
+        # The same extrudes returning the whole graph
+        r = self.client.add_extrudes_by_target_face(actions, revert=True)
+        self.assertEqual(r.status_code, 200, msg="add_extrudes_by_target_face status code")
+        full_graph = r.json()["data"]["graph"]
+        self.assertEqual(graph["nodes"], full_graph["nodes"], msg="delta nodes equal the whole graph")
+        self.assertEqual(graph["links"], full_graph["links"], msg="delta links equal the whole graph")
+        # An unknown version returns the whole graph
+        r = self.client.revert_to_target(graph_version=-1)
+        self.assertEqual(r.status_code, 200, msg="revert_to_target status code")
+        self.assertIn("graph", r.json()["data"], msg="revert_to_target returns the whole graph")
+        r = self.client.clear()
+
     def test_add_extrudes_by_target_face_invalid_inputs(self):
         r = self.client.add_extrudes_by_target_face(
             "okok",
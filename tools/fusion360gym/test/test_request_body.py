@@ -0,0 +1,105 @@
+"""
+
+Test reading compressed and uploaded request bodies,
+does not require the Fusion 360 Gym to be running
+
+"""
+import unittest
+import sys
+import os
+import io
+import json
+from pathlib import Path
+
+# Add the client folder to sys.path
+CLIENT_DIR = os.path.join(os.path.dirname(__file__), "..", "client")
+if CLIENT_DIR not in sys.path:
+    sys.path.append(CLIENT_DIR)
+
+# Importing the client adds the common folder to sys.path
+from fusion360gym_client import Fusion360GymClient
+import request_body
+
+
+class TestRequestBody(unittest.TestCase):
+
+    def get_request(self, body, content_encoding=None, headers=None):
+        """Get the body as a file and the headers of a request"""
+        if content_encoding is not None:
+            body = request_body.compress(body, content_encoding)
+        request_headers = {"Content-Length": str(len(body))}
+        if content_encoding is not None:
+            request_headers["Content-Encoding"] = content_encoding
+        if headers is not None:
+            request_headers.update(headers)
+        return io.BytesIO(body), request_headers
+
+    def test_read_json(self):
+        command_data = {
+            "command": "reconstruct",
+            "data": {"text": "a\n\"b\"" * 100000}
+        }
+        body = json.dumps(command_data).encode("utf8")
+        for content_encoding in [None, "gzip", "deflate"]:
+            rfile, headers = self.get_request(body, content_encoding)
+            if content_encoding is not None:
+                self.assertLess(int(headers["Content-Length"]), len(body), msg="body is compressed")
+            post_data = request_body.read_json(rfile, headers)
+            self.assertEqual(post_data, command_data, msg="body is read")
+
+    def test_read_invalid(self):
+        body = json.dumps({"command": "ping"}).encode("utf8")
+        rfile, headers = self.get_request(body, headers={"Content-Encoding": "br"})
+        with self.assertRaises(ValueError):
+            request_body.read_json(rfile, headers)
+        rfile, headers = self.get_request(body, headers={"Content-Encoding": "gzip"})
+        with self.assertRaises(ValueError):
+            request_body.read_json(rfile, headers)
+        rfile, headers = self.get_request(body, "gzip")
+        headers["Content-Length"] = str(int(headers["Content-Length"]) + 10)
+        with self.assertRaises(ValueError):
+            request_body.read_json(rfile, headers)
+        rfile, headers = self.get_request(body[:-1])
+        with self.assertRaises(ValueError):
+            request_body.read_json(rfile, headers)
+
+    def test_read_upload(self):
+        file_data = b"Binary B-Rep\r\n\x00\xff" * 10000
+        command_data = {
+            "command": "set_target",
+            "data": {"file": "../../Couch.smt"}
+        }
+        for content_encoding in [None, "gzip", "deflate"]:
+            rfile, headers = self.get_request(file_data, content_encoding, {
+                "Content-Type": request_body.UPLOAD_CONTENT_TYPE,
+                request_body.COMMAND_HEADER: json.dumps(command_data)
+            })
+            self.assertTrue(request_body.is_upload(headers), msg="request is an upload")
+            post_data = request_body.read_upload(rfile, headers)
+            upload_file = post_data["data"]["file_upload"]
+            self.assertIsInstance(upload_file, Path, msg="file_upload is a Path")
+            self.assertEqual(upload_file.name, "Couch.smt", msg="file_upload name")
+            self.assertEqual(upload_file.read_bytes(), file_data, msg="file_upload data")
+            request_body.remove_upload(post_data["data"])
+            self.assertFalse(upload_file.parent.exists(), msg="upload is removed")
+
+    def test_read_upload_invalid(self):
+        rfile, headers = self.get_request(b"data", headers={
+            "Content-Type": request_body.UPLOAD_CONTENT_TYPE
+        })
+        with self.assertRaises(ValueError):
+            request_body.read_upload(rfile, headers)
+        rfile, headers = self.get_request(b"data", headers={
+            "Content-Type": request_body.UPLOAD_CONTENT_TYPE,
+            request_body.COMMAND_HEADER: json.dumps({"command": "set_target"})
+        })
+        with self.assertRaises(ValueError):
+            request_body.read_upload(rfile, headers)
+
+    def test_client_content_encoding(self):
+        with self.assertRaises(Exception):
+            Fusion360GymClient(content_encoding="br")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+import scipy.sparse as sp
+
+import torch
+
+from train import format_graph_data,build_adjacency_matrix,normalize,sparse_mx_to_torch_sparse_tensor
+
+# Microbenchmark of format_graph_data against the original row by row implementation,
+# checking the features and adjacency matrices are bit-identical
+
+def format_graph_data_reference(data,bbox):
+    surf_type_dict={'ConeSurfaceType':2,'CylinderSurfaceType':1,'EllipticalConeSurfaceType':6,
+    'EllipticalCylinderSurfaceType':5,'NurbsSurfaceType':7,'PlaneSurfaceType':0,
+    'SphereSurfaceType':3,'TorusSurfaceType':4}
+    node_names=[x['id'] for x in data['nodes']]
+    # surface type
+    features_SurTyp=np.zeros((len(node_names),8))
+    for i in range(len(data['nodes'])):
+        features_SurTyp[i,surf_type_dict[data['nodes'][i]['surface_type']]]=1
+    # points
+    features_Poi=np.zeros((len(node_names),len(data['nodes'][0]['points'])))
+    for i in range(len(data['nodes'])):
+        features_Poi[i,:]=data['nodes'][i]['points']
+    mp1,mp2=bbox['max_point'],bbox['min_point']
+    span_x,span_y,span_z=mp1['x']-mp2['x'],mp1['y']-mp2['y'],mp1['z']-mp2['z']
+    scale=np.max([span_x,span_y,span_z,1e-2])
+    features_Poi=features_Poi/scale
+    # normals
+    features_Nor=np.zeros((len(node_names),len(data['nodes'][0]['normals'])))
+    for i in range(len(data['nodes'])):
+        features_Nor[i,:]=data['nodes'][i]['normals']
+    # trimming_mask
+    features_TriMas=np.zeros((len(node_names),len(data['nodes'][0]['trimming_mask'])))
+    for i in range(len(data['nodes'])):
+        features_TriMas[i,:]=data['nodes'][i]['trimming_mask']
+    features=np.concatenate((features_SurTyp,features_Poi,features_Nor,features_TriMas),axis=1)
+    features=torch.FloatTensor(features)
+    # edges
+    edges_from,edges_to=[],[]
+    for link in data['links']:
+        if (link['source'] not in node_names) or (link['target'] not in node_names):
+            continue
+        idx1=node_names.index(link['source'])
+        idx2=node_names.index(link['target'])
+        edges_from.append(idx1)
+        edges_to.append(idx2)
+    adj=build_adjacency_matrix(len(node_names),edges_from,edges_to)
+    adj=normalize(adj+sp.eye(adj.shape[0]))
+    adj=sparse_mx_to_torch_sparse_tensor(adj)
+    return adj,features
+
+def is_identical(result,reference):
+    adj,features=result
+    adj_ref,features_ref=reference
+    if not torch.equal(features,features_ref) or features.dtype!=features_ref.dtype:
+        return False
+    if adj.size()!=adj_ref.size() or adj.dtype!=adj_ref.dtype:
+        return False
+    return torch.equal(adj._indices(),adj_ref._indices()) and torch.equal(adj._values(),adj_ref._values())
+
+def load_graphs(dataset_path):
+    graphs=[]
+    for seq_file in sorted(os.listdir(dataset_path)):
+        if not seq_file.endswith('_sequence.json'):
+            continue
+        with open('%s/%s'%(dataset_path,seq_file)) as json_data:
+            data_seq=json.load(json_data)
+        bbox=data_seq['properties']['bounding_box']
+        for step in data_seq['sequence']:
+            with open('%s/%s'%(dataset_path,step['graph'])) as json_data:
+                graphs.append((json.load(json_data),bbox))
+    return graphs
+
+def time_function(function,graphs,repeat):
+    t1=time.time()
+    for _ in range(repeat):
+        for data,bbox in graphs:
+            function(data,bbox)
+    return (time.time()-t1)/repeat
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--dataset',type=str,default='data',help='Dataset name or path.')
+    parser.add_argument('--repeat',type=int,default=20,help='Number of timed passes over the dataset.')
+    args=parser.parse_args()
+    if os.path.isdir(args.dataset):
+        dataset_path=args.dataset
+    else:
+        dataset_path='../%s'%(args.dataset)
+    graphs=load_graphs(dataset_path)
+    num_nodes=sum([len(data['nodes']) for data,bbox in graphs])
+    print('Graphs: %d, nodes: %d'%(len(graphs),num_nodes))
+    # bit-identical check
+    mismatches=0
+    for data,bbox in graphs:
+        if not is_identical(format_graph_data(data,bbox),format_graph_data_reference(data,bbox)):
+            mismatches+=1
+    print('Bit-identical: %d/%d'%(len(graphs)-mismatches,len(graphs)))
+    # timing
+    t_reference=time_function(format_graph_data_reference,graphs,args.repeat)
+    t_fast=time_function(format_graph_data,graphs,args.repeat)
+    print('Reference: %.3f ms per graph'%(t_reference/len(graphs)*1000.0))
+    print('Vectorized: %.3f ms per graph'%(t_fast/len(graphs)*1000.0))
+    print('Speedup: %.2fx'%(t_reference/t_fast))
+    if mismatches>0:
+        exit(1)
@@ -0,0 +1,123 @@
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+from tqdm import tqdm
+
+# Index of the sequences in one or more dataset directories, built once and saved as json.
+# Each sequence maps to its dataset path, step graph files, number of step files found,
+# number of target nodes, bounding box and split membership, so lookups do not need
+# to scan the directory listing or the split lists. The size and modified time of the
+# directories and of the json files read for each sequence are recorded, so the index
+# is rebuilt when files are added, removed or regenerated.
+
+INDEX_VERSION=2
+
+def stat_path(path):
+    stat=os.stat(path)
+    return [stat.st_size,stat.st_mtime_ns]
+
+class DatasetIndex():
+    def __init__(self,sequences,dirs):
+        # sequences: seq -> entry, in directory listing order
+        # dirs: dataset path -> number of files and modified time, used to check the index is current
+        self.sequences=sequences
+        self.dirs=dirs
+        self.split_sets={}
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def __contains__(self,seq):
+        return seq in self.sequences
+
+    def __getitem__(self,seq):
+        return self.sequences[seq]
+
+    def __iter__(self):
+        return iter(self.sequences)
+
+    @classmethod
+    def build(cls,dataset_paths):
+        sequences,dirs={},{}
+        for dataset_path in dataset_paths:
+            dir_list=os.listdir(dataset_path)
+            dir_set=set(dir_list)
+            dirs[dataset_path]={'num_files':len(dir_list),'mtime_ns':os.stat(dataset_path).st_mtime_ns}
+            seqs=[x[:-14] for x in dir_list if (x.endswith('_sequence.json'))]
+            print('Indexing %d sequences in:'%len(seqs), dataset_path)
+            for seq in tqdm(seqs):
+                # a sequence found in several directories keeps the first one
+                if seq in sequences:
+                    continue
+                # find number of steps
+                num_step=0
+                while '%s_%04d.json'%(seq,num_step) in dir_set:
+                    num_step+=1
+                files=['%s_sequence.json'%seq]
+                with open('%s/%s'%(dataset_path,files[0])) as json_data:
+                    data_seq=json.load(json_data)
+                steps=[step['graph'] for step in data_seq['sequence']]
+                num_nodes=0
+                if len(steps)>0 and steps[-1] in dir_set:
+                    files.append(steps[-1])
+                    with open('%s/%s'%(dataset_path,steps[-1])) as json_data:
+                        num_nodes=len(json.load(json_data)['nodes'])
+                sequences[seq]={
+                    'path':dataset_path,
+                    'steps':steps,
+                    'num_step':num_step,
+                    'num_nodes':num_nodes,
+                    'bbox':data_seq['properties']['bounding_box'],
+                    'split':None,
+                    'files':files,
+                    'stat':[stat_path('%s/%s'%(dataset_path,x)) for x in files]
+                }
+        return cls(sequences,dirs)
+
+    @classmethod
+    def load(cls,index_file,dataset_paths):
+        # saved index, or None if it is missing or the dataset files have changed
+        if not os.path.isfile(index_file):
+            return None
+        with open(index_file) as json_data:
+            data=json.load(json_data)
+        if data['version']!=INDEX_VERSION or list(data['dirs'].keys())!=list(dataset_paths):
+            return None
+        for dataset_path,dir_stat in data['dirs'].items():
+            if os.stat(dataset_path).st_mtime_ns!=dir_stat['mtime_ns']:
+                return None
+            if len(os.listdir(dataset_path))!=dir_stat['num_files']:
+                return None
+        # the files read for each sequence, as they can be regenerated in place
+        for entry in data['sequences'].values():
+            for name,stat in zip(entry['files'],entry['stat']):
+                path='%s/%s'%(entry['path'],name)
+                if not os.path.isfile(path) or stat_path(path)!=stat:
+                    return None
+        index=cls(data['sequences'],data['dirs'])
+        index.split_sets={name:set(seqs) for name,seqs in data['splits'].items()}
+        return index
+
+    def save(self,index_file):
+        data={
+            'version':INDEX_VERSION,
+            'dirs':self.dirs,
+            'splits':{name:sorted(seqs) for name,seqs in self.split_sets.items()},
+            'sequences':self.sequences
+        }
+        with open(index_file,'w') as f:
+            json.dump(data,f)
+
+    def set_split(self,train_test_split):
+        # record the split each sequence belongs to, test taking precedence
+        self.split_sets={name:set(seqs) for name,seqs in train_test_split.items()}
+        for seq,entry in self.sequences.items():
+            entry['split']=None
+            for name in ['train','test']:
+                if seq in self.split_sets.get(name,()):
+                    entry['split']=name
+
+    def in_split(self,seq,name):
+        return seq in self.split_sets.get(name,())
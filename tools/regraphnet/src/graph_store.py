@@ -0,0 +1,147 @@
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+import torch
+
+# Sharded binary store of featurized graph sequences, written with train.py --preprocess.
+# Each shard holds the step graphs and labels of a group of sequences as .npy arrays,
+# memory mapped on load. The manifest records the size and modified time of the source
+# json files of every sequence when the store is written, which are checked on load
+# without reading the files, so stale sequences are loaded from json instead.
+
+def stat_files(paths):
+    stats=[os.stat(path) for path in paths]
+    return [[x.st_size,x.st_mtime_ns] for x in stats]
+
+class GraphStore():
+    def __init__(self,store_path,featurizer_version):
+        self.store_path=store_path
+        self.featurizer_version=featurizer_version
+        self.manifest_file=os.path.join(store_path,'manifest.json')
+        self.sequences={}
+        self.shards={}
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file) as json_data:
+                manifest=json.load(json_data)
+            if manifest['featurizer_version']==featurizer_version:
+                self.sequences=manifest['sequences']
+            else:
+                print('Graph store featurizer version %s does not match %s, loading from json'%(manifest['featurizer_version'],featurizer_version))
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def load_sequence(self,seq,dataset_path):
+        # step graphs and labels of a sequence, or None if it is missing or stale
+        entry=self.sequences.get(seq)
+        if entry is None:
+            return None
+        paths=[os.path.join(dataset_path,x) for x in entry['files']]
+        if not all([os.path.isfile(x) for x in paths]):
+            return None
+        if stat_files(paths)!=entry.get('stat'):
+            return None
+        shard=self.get_shard(entry['shard'])
+        graph_start,graph_count=entry['graphs']
+        label_start,label_count=entry['labels']
+        graphs=[self.get_graph(shard,i) for i in range(graph_start,graph_start+graph_count)]
+        labels=[tuple([int(y) for y in x]) for x in shard['labels'][label_start:label_start+label_count]]
+        return graphs,labels
+
+    def get_shard(self,shard_id):
+        if shard_id not in self.shards:
+            shard_path=os.path.join(self.store_path,'shard_%05d'%shard_id)
+            self.shards[shard_id]={name:np.load(os.path.join(shard_path,'%s.npy'%name),mmap_mode='r')
+                for name in ['features','adj_indices','adj_values','graphs','labels']}
+        return self.shards[shard_id]
+
+    def get_graph(self,shard,graph_id):
+        node_start,node_count,edge_start,edge_count=[int(x) for x in shard['graphs'][graph_id]]
+        features=torch.from_numpy(np.array(shard['features'][node_start:node_start+node_count]))
+        indices=torch.from_numpy(np.array(shard['adj_indices'][:,edge_start:edge_start+edge_count]))
+        values=torch.from_numpy(np.array(shard['adj_values'][edge_start:edge_start+edge_count]))
+        adj=torch.sparse_coo_tensor(indices,values,(node_count,node_count))
+        return adj,features
+
+class GraphStoreWriter():
+    def __init__(self,store_path,featurizer_version,shard_size=1000):
+        self.store_path=store_path
+        self.featurizer_version=featurizer_version
+        self.shard_size=shard_size
+        self.sequences={}
+        self.shard_id=0
+        # only replace a previous graph store, never a directory with other data
+        if os.path.exists(store_path):
+            is_store=os.path.isfile(os.path.join(store_path,'manifest.json'))
+            if not os.path.isdir(store_path) or (len(os.listdir(store_path))>0 and not is_store):
+                raise FileExistsError('Not a graph store, refusing to overwrite: %s'%store_path)
+        # write into a temp sibling directory, moved into place by close()
+        store_parent,store_name=os.path.split(os.path.abspath(store_path))
+        os.makedirs(store_parent,exist_ok=True)
+        self.temp_path=tempfile.mkdtemp(prefix='.%s.'%store_name,dir=store_parent)
+        self.reset_shard()
+
+    def reset_shard(self):
+        self.shard_seqs=0
+        self.features,self.adj_indices,self.adj_values,self.graphs,self.labels=[],[],[],[],[]
+        self.num_nodes,self.num_edges,self.num_graphs=0,0,0
+
+    def add_sequence(self,seq,dataset_path,files,graphs,labels):
+        paths=[os.path.join(dataset_path,x) for x in files]
+        self.sequences[seq]={
+            'shard':self.shard_id,
+            'files':files,
+            'stat':stat_files(paths),
+            'graphs':[self.num_graphs,len(graphs)],
+            'labels':[len(self.labels),len(labels)]
+        }
+        for adj,features in graphs:
+            indices,values=adj._indices().numpy(),adj._values().numpy()
+            self.features.append(features.numpy())
+            self.adj_indices.append(indices)
+            self.adj_values.append(values)
+            self.graphs.append([self.num_nodes,features.shape[0],self.num_edges,values.shape[0]])
+            self.num_nodes+=features.shape[0]
+            self.num_edges+=values.shape[0]
+            self.num_graphs+=1
+        self.labels.extend(labels)
+        self.shard_seqs+=1
+        if self.shard_seqs>=self.shard_size:
+            self.write_shard()
+
+    def write_shard(self):
+        if self.shard_seqs==0:
+            return
+        shard_path=os.path.join(self.temp_path,'shard_%05d'%self.shard_id)
+        os.makedirs(shard_path)
+        np.save(os.path.join(shard_path,'features.npy'),np.concatenate(self.features,axis=0).astype(np.float32))
+        np.save(os.path.join(shard_path,'adj_indices.npy'),np.concatenate(self.adj_indices,axis=1).astype(np.int64))
+        np.save(os.path.join(shard_path,'adj_values.npy'),np.concatenate(self.adj_values,axis=0).astype(np.float32))
+        np.save(os.path.join(shard_path,'graphs.npy'),np.array(self.graphs,dtype=np.int64).reshape(-1,4))
+        np.save(os.path.join(shard_path,'labels.npy'),np.array(self.labels,dtype=np.int64).reshape(-1,3))
+        self.shard_id+=1
+        self.reset_shard()
+
+    def close(self):
+        self.write_shard()
+        # the manifest is written last, so an interrupted run leaves the previous store in place
+        manifest={
+            'featurizer_version':self.featurizer_version,
+            'sequences':self.sequences
+        }
+        with open(os.path.join(self.temp_path,'manifest.json'),'w') as f:
+            json.dump(manifest,f)
+        # move the previous store aside, as os.replace can't replace a non empty directory
+        old_path=None
+        if os.path.isdir(self.store_path):
+            old_path=self.temp_path+'.old'
+            os.replace(self.store_path,old_path)
+        os.replace(self.temp_path,self.store_path)
+        if old_path is not None:
+            shutil.rmtree(old_path)
@@ -29,39 +29,48 @@ def load_graph_pair(path_tar,path_cur,bbox):
     node_names=[x['id'] for x in data_tar['nodes']]
     return graph_pair_formatted,node_names,operation_names
 
-def inference(graph_pair_formatted,node_names,operation_names,use_gpu=False):
+def inference(graph_pair_formatted,node_names,operation_names,use_gpu=False,batched=True,top_k=None):
     model.eval()
     num_nodes=graph_pair_formatted[1].size()[0]
     output_end_conditioned=np.zeros((num_nodes,num_nodes))
     with torch.no_grad():
-        graph_pair_formatted.append(0)
-        output_start,_,output_op=model(graph_pair_formatted,use_gpu=use_gpu)
-        output_start=F.softmax(output_start.view(1,-1),dim=1)
-        output_op=F.softmax(output_op,dim=1)
-        for i in range(num_nodes):
-            graph_pair_formatted[4]=i
-            _,output_end,_=model(graph_pair_formatted,use_gpu=use_gpu)
-            output_end=F.softmax(output_end.view(1,-1),dim=1)
+        if batched:
+            # all end face distributions, conditioned on each start face, in one pass
+            output_start,output_end,output_op=model.forward_batched(graph_pair_formatted,use_gpu=use_gpu)
+            output_end=F.softmax(output_end,dim=1)
             if use_gpu:
-                output_end_conditioned[i,:]=output_end.data.cpu().numpy()
+                output_end_conditioned[:,:]=output_end.data.cpu().numpy()
             else:
-                output_end_conditioned[i,:]=output_end.data.numpy()
+                output_end_conditioned[:,:]=output_end.data.numpy()
+        else:
+            graph_pair_formatted.append(0)
+            output_start,_,output_op=model(graph_pair_formatted,use_gpu=use_gpu)
+            for i in range(num_nodes):
+                graph_pair_formatted[4]=i
+                _,output_end,_=model(graph_pair_formatted,use_gpu=use_gpu)
+                output_end=F.softmax(output_end.view(1,-1),dim=1)
+                if use_gpu:
+                    output_end_conditioned[i,:]=output_end.data.cpu().numpy()
+                else:
+                    output_end_conditioned[i,:]=output_end.data.numpy()
+        output_start=F.softmax(output_start.view(1,-1),dim=1)
+        output_op=F.softmax(output_op,dim=1)
     if use_gpu:
         ps=[output_start.data.cpu().numpy()[0,:],output_end_conditioned,output_op.data.cpu().numpy()[0,:]]
     else:
         ps=[output_start.data.numpy()[0,:],output_end_conditioned,output_op.data.numpy()[0,:]]
-    # enumerate all actions
-    actions,probs=[],[]
-    for i in range(len(node_names)):
-        for j in range(len(node_names)):
-            for k in range(len(operation_names)):
-                actions.append([node_names[i],node_names[j],operation_names[k]])
-                probs.append(ps[0][i]*ps[1][i,j]*ps[2][k])
-    actions_sorted,probs_sorted=[],[]
-    idx=np.argsort(-np.array(probs))
-    for i in range(len(probs)):
-        actions_sorted.append(actions[idx[i]])
-        probs_sorted.append(probs[idx[i]])
+    # enumerate all actions as an outer product, indexed [start,end,operation]
+    probs=(ps[0][:,None]*ps[1])[:,:,None]*ps[2][None,None,:]
+    probs=probs.reshape(-1)
+    if top_k is None or top_k>=len(probs):
+        idx=np.argsort(-probs,kind='stable')
+    else:
+        idx=np.argpartition(-probs,top_k-1)[:top_k]
+        idx=idx[np.argsort(-probs[idx],kind='stable')]
+    # only build the actions that are returned
+    starts,ends,ops=np.unravel_index(idx,(len(node_names),len(node_names),len(operation_names)))
+    actions_sorted=[[node_names[i],node_names[j],operation_names[k]] for i,j,k in zip(starts,ends,ops)]
+    probs_sorted=probs[idx].tolist()
     return actions_sorted,probs_sorted
 
 if __name__=="__main__":
@@ -69,6 +78,7 @@ if __name__=="__main__":
     parser=argparse.ArgumentParser()
     parser.add_argument('--no-cuda',action='store_true',default=True,help='Disables CUDA training.')
     parser.add_argument('--dataset',type=str,default='data',help='Dataset name.')
+    parser.add_argument('--no_batched',action='store_true',default=False,help='Run one forward pass per start face instead of a single batched pass.')
     args=parser.parse_args()
     args.cuda=not args.no_cuda and torch.cuda.is_available()
     # load model
@@ -103,7 +113,7 @@ if __name__=="__main__":
                 for j in range(4):
                     graph_pair_formatted[j]=graph_pair_formatted[j].cuda()
             # inference
-            actions_sorted,probs_sorted=inference(graph_pair_formatted,node_names,operation_names,use_gpu=args.cuda)
+            actions_sorted,probs_sorted=inference(graph_pair_formatted,node_names,operation_names,use_gpu=args.cuda,batched=not args.no_batched,top_k=10)
             print(actions_sorted[:10])
             print(probs_sorted[:10])
     t2=time.time()
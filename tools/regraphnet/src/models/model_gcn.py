@@ -29,6 +29,8 @@ class GraphConvolution(Module):
             self.bias.data.uniform_(-stdv, stdv)
 
     def forward(self, input, adj):
+        if input.dim() == 3:
+            return self.forward_batched(input, adj)
         support = torch.mm(input, self.weight)
         output = torch.spmm(adj, support)
         if self.bias is not None:
@@ -36,6 +38,22 @@ class GraphConvolution(Module):
         else:
             return output
 
+    def forward_batched(self, input, adj):
+        """
+        Apply the layer to a batch of node features (batch, nodes, features)
+        that all share the same adjacency matrix
+        """
+        batch, nodes = input.size()[0], input.size()[1]
+        support = torch.matmul(input, self.weight)
+        # Fold the batch into the feature dimension so one spmm covers it
+        support = support.transpose(0, 1).reshape(nodes, -1)
+        output = torch.spmm(adj, support)
+        output = output.reshape(nodes, batch, -1).transpose(0, 1)
+        if self.bias is not None:
+            return output + self.bias
+        else:
+            return output
+
     def __repr__(self):
         return self.__class__.__name__ + ' (' \
                + str(self.in_features) + ' -> ' \
@@ -5,18 +5,22 @@ import os
 import json
 import time
 import argparse
+import multiprocessing
 import numpy as np
 import scipy.sparse as sp
 from tqdm import tqdm
-
+from collections import OrderedDict
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+from torch.utils.data import Dataset,DataLoader,Subset
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 
 from models.model_gcn import GCN
+from graph_store import GraphStore,GraphStoreWriter
+from dataset_index import DatasetIndex
 
 class NodePointer(nn.Module):
     def __init__(self,nfeat,nhid,dropout=0.0,Use_GCN=True):
@@ -63,159 +67,434 @@ class NodePointer(nn.Module):
                 m.bias.data.fill_(0.00)
 
     def forward(self,gpf,use_gpu=True):
-        x2=torch.cat((gpf[1],gpf[1][gpf[4],:].repeat(gpf[1].size()[0],1)),dim=1)
+        x0=self.encode_target(gpf[0],gpf[1])
+        x_end=self.decode_end(gpf[0],gpf[1],gpf[4])
+        x1=self.encode_current(gpf[2],gpf[3],use_gpu=use_gpu)
+        x_start,op=self.decode_start_op(x0,x1)
+        return x_start,x_end,op
+
+    def forward_batched(self,gpf,use_gpu=True,chunk_size=32):
+        # same as forward, but the end face logits are conditioned on every
+        # target node at once: row i of x_end is the output of forward with gpf[4]=i
+        x0=self.encode_target(gpf[0],gpf[1])
+        x1=self.encode_current(gpf[2],gpf[3],use_gpu=use_gpu)
+        x_start,op=self.decode_start_op(x0,x1)
+        x_end=self.decode_end_batched(gpf[0],gpf[1],chunk_size=chunk_size)
+        return x_start,x_end,op
+
+    def encode_target(self,adj_tar,features_tar):
+        x0=F.relu(self.fc01(F.relu(self.fc00(features_tar))))
         if self.Use_GCN:
-            x0=F.relu(self.fc01(F.relu(self.fc00(gpf[1]))))
-            x0=self.gcn0(x0,gpf[0])
+            x0=self.gcn0(x0,adj_tar)
             x0=F.relu(self.fc03(F.relu(self.fc02(x0))))
-            x2=F.relu(self.fc21(F.relu(self.fc20(x2))))
-            x2=self.gcn2(x2,gpf[0])
-            x2=F.relu(self.fc23(F.relu(self.fc22(x2))))
-            if gpf[2].size()[0]==0:
-                if use_gpu:
-                    x1=torch.zeros((1,self.nhid)).cuda()
-                else:
-                    x1=torch.zeros((1,self.nhid))
+        return x0
+
+    def forward_batch(self,batch,use_gpu=True):
+        # forward over a block-diagonal batch from collate_graph_pairs,
+        # the start and end logits are padded to (num_pairs,max_nodes) with -inf
+        x0=self.encode_target(batch['adj_tar'],batch['features_tar'])
+        x2=torch.cat((batch['features_tar'],batch['features_tar'][batch['start'][batch['batch_tar']],:]),dim=1)
+        x2=F.relu(self.fc21(F.relu(self.fc20(x2))))
+        x_end=self.decode_end_hidden(x2,batch['adj_tar'])
+        # pairs with an empty current graph keep a zero embedding
+        x1=torch.zeros((batch['num_pairs'],self.nhid))
+        if use_gpu:
+            x1=x1.cuda()
+        if batch['features_cur'].size()[0]>0:
+            x1=x1.index_add(0,batch['batch_cur'],self.encode_current_nodes(batch['adj_cur'],batch['features_cur']))
+        op=self.fc_operation(x1)
+        x_start=self.decode_start(x0,x1[batch['batch_tar']])
+        return pad_graph_pairs(x_start,batch),pad_graph_pairs(x_end,batch),op
+
+    def encode_current(self,adj_cur,features_cur,use_gpu=True):
+        # current graph embedding pooled over its nodes, shape (1,nhid)
+        if adj_cur.size()[0]==0:
+            if use_gpu:
+                x1=torch.zeros((1,self.nhid)).cuda()
             else:
-                x1=F.relu(self.fc11(F.relu(self.fc10(gpf[3]))))
-                x1=self.gcn1(x1,gpf[2])
-                x1=F.relu(self.fc13(F.relu(self.fc12(x1))))
+                x1=torch.zeros((1,self.nhid))
         else:
-            x0=F.relu(self.fc01(F.relu(self.fc00(gpf[1]))))
-            x2=F.relu(self.fc21(F.relu(self.fc20(x2))))
-            if gpf[2].size()[0]==0:
-                if use_gpu:
-                    x1=torch.zeros((1,self.nhid)).cuda()
-                else:
-                    x1=torch.zeros((1,self.nhid))
-            else:
-                x1=F.relu(self.fc11(F.relu(self.fc10(gpf[3]))))
-        x1=torch.sum(x1,dim=0,keepdim=True).repeat(x0.size()[0],1)
+            x1=self.encode_current_nodes(adj_cur,features_cur)
+        return torch.sum(x1,dim=0,keepdim=True)
+
+    def encode_current_nodes(self,adj_cur,features_cur):
+        x1=F.relu(self.fc11(F.relu(self.fc10(features_cur))))
+        if self.Use_GCN:
+            x1=self.gcn1(x1,adj_cur)
+            x1=F.relu(self.fc13(F.relu(self.fc12(x1))))
+        return x1
+
+    def decode_start_op(self,x0,x1):
+        x1=x1.repeat(x0.size()[0],1)
         op=self.fc_operation(x1[0:1,:])
+        x_start=self.decode_start(x0,x1)
+        return x_start,op
+
+    def decode_start(self,x0,x1):
         x=torch.cat((x0,x1),dim=1)
         x=F.relu(self.fc0(x))
         x=F.relu(self.fc1(x))
         x=F.relu(self.fc2(x))
         x=F.relu(self.fc3(x))
-        x_start=self.fc_start(x)
+        return self.fc_start(x)
+
+    def decode_end(self,adj_tar,features_tar,start):
+        x2=torch.cat((features_tar,features_tar[start,:].repeat(features_tar.size()[0],1)),dim=1)
+        x2=F.relu(self.fc21(F.relu(self.fc20(x2))))
+        return self.decode_end_hidden(x2,adj_tar)
+
+    def decode_end_batched(self,adj_tar,features_tar,chunk_size=32):
+        # fc20 acts on [features_j,features_start], so split its weight and
+        # project each half once instead of once per start node
+        nfeat=features_tar.size()[1]
+        x_node=F.linear(features_tar,self.fc20.weight[:,:nfeat],self.fc20.bias)
+        x_start=F.linear(features_tar,self.fc20.weight[:,nfeat:])
+        num_nodes=features_tar.size()[0]
+        x_end=[]
+        for i in range(0,num_nodes,chunk_size):
+            # (chunk,num_nodes,nhid) for start nodes i:i+chunk_size
+            x2=F.relu(x_node.unsqueeze(0)+x_start[i:i+chunk_size].unsqueeze(1))
+            x2=F.relu(self.fc21(x2))
+            x_end.append(self.decode_end_hidden(x2,adj_tar).squeeze(2))
+        return torch.cat(x_end,dim=0)
+
+    def decode_end_hidden(self,x2,adj_tar):
+        if self.Use_GCN:
+            x2=self.gcn2(x2,adj_tar)
+            x2=F.relu(self.fc23(F.relu(self.fc22(x2))))
         x2=F.relu(self.fc4(x2))
         x2=F.relu(self.fc5(x2))
         x2=F.relu(self.fc6(x2))
         x2=F.relu(self.fc7(x2))
-        x_end=self.fc_end(x2)
-        return x_start,x_end,op
+        return self.fc_end(x2)
 
-def load_dataset(args):
-    action_type_dict={'CutFeatureOperation':1,'IntersectFeatureOperation':2,'JoinFeatureOperation':0,
-    'NewBodyFeatureOperation':3,'NewComponentFeatureOperation':4}
-    graph_pairs_formatted=[]
+# bump when format_graph_data changes, so stored graphs are featurized again
+FEATURIZER_VERSION=1
+
+def split_file_path(args):
+    # Check if this is a full path to a valid file
+    if os.path.isfile(args.split):
+        return args.split
+    return '../data/%s.json'%(args.split)
+
+def load_dataset_index(args):
+    # index of the dataset and augmentation data, loaded from --index if it is current
     # Check if this is a full path to a valid directory
     if os.path.isdir(args.dataset):
         dataset_path=args.dataset
     else:
         dataset_path='../data/%s'%(args.dataset)
     print("Using dataset_path:", dataset_path)
-    dir_list=os.listdir(dataset_path)
-    seqs=[x[:-14] for x in dir_list if (x.endswith('_sequence.json'))]
+    dataset_paths=[dataset_path]
     if args.augment is not None and os.path.isdir(args.augment):
-        aug_dataset_path=args.augment
-        print('Loading augmentation data from:', aug_dataset_path)
-        aug_dir_list=os.listdir(aug_dataset_path)
-        aug_seqs=[x[:-14] for x in aug_dir_list if (x.endswith('_sequence.json'))]
-        seqs.extend(aug_seqs)
-        dir_list.extend(aug_dir_list)
-    # find number of steps
-    seqs_num_step={}
-    for seq in seqs:
-        ct=0
-        while True:
-            if '%s_%04d.json'%(seq,ct) not in dir_list:
-                seqs_num_step[seq]=ct
-                break
-            ct+=1
-    counter=[0,0,0]
-    for k in tqdm(range(len(seqs))):
-        seq=seqs[k]
+        print('Loading augmentation data from:', args.augment)
+        dataset_paths.append(args.augment)
+    index=None
+    if args.index is not None:
+        index=DatasetIndex.load(args.index,dataset_paths)
+        if index is not None:
+            print('Using dataset index with %d sequences from:'%len(index), args.index)
+    save=index is None
+    if index is None:
+        index=DatasetIndex.build(dataset_paths)
+    split_file=split_file_path(args)
+    if os.path.isfile(split_file):
+        with open(split_file) as json_data:
+            train_test_split=json.load(json_data)
+        if {name:set(seqs) for name,seqs in train_test_split.items()}!=index.split_sets:
+            index.set_split(train_test_split)
+            save=True
+    if args.index is not None and save:
+        print('Saving dataset index to:', args.index)
+        index.save(args.index)
+    return index
+
+def find_sequences(args,index):
+    # (dataset_path,seq,num_step) of each sequence in the dataset and augmentation data
+    sequences=[]
+    for seq in index:
         # If we are training with synthetic data, ignore real training data
-        if args.only_augment and seq in train_test_split["train"]:
+        if args.only_augment and index.in_split(seq,'train'):
             continue
-        alt_dataset_path=dataset_path
-        seq_file='%s/%s_sequence.json'%(dataset_path,seq)
-        if not os.path.isfile(seq_file):
-            alt_dataset_path=aug_dataset_path
-        with open('%s/%s_sequence.json'%(alt_dataset_path,seq)) as json_data:
-            data_seq=json.load(json_data)
-        bbox=data_seq['properties']['bounding_box']
-        len_equal = len(data_seq['sequence'])==seqs_num_step[seq]
-        if not len_equal:
-            print(f'Skipping {seq} due to unequal lengths: {len(data_seq["sequence"])} in json, but {seqs_num_step[seq]} files found')
+        entry=index[seq]
+        if len(entry['steps'])!=entry['num_step']:
+            print(f'Skipping {seq} due to unequal lengths: {len(entry["steps"])} in json, but {entry["num_step"]} files found')
             continue
-#         assert(len(data_seq['sequence'])==seqs_num_step[seq])
-        with open('%s/%s'%(alt_dataset_path,data_seq['sequence'][-1]['graph'])) as json_data:
-            data_tar=json.load(json_data)
-        adj_tar,features_tar=format_graph_data(data_tar,bbox)
-        node_names_tar=[x['id'] for x in data_tar['nodes']]
-        for sid,step in enumerate(data_seq['sequence']):
-            if sid==0:
-                adj_cur,features_cur=torch.zeros((0)),torch.zeros((0))
-            else:
-                with open('%s/%s'%(alt_dataset_path,data_seq['sequence'][sid-1]['graph'])) as json_data:
-                    data_cur=json.load(json_data)
-                adj_cur,features_cur=format_graph_data(data_cur,bbox)
-            label_start_now=[node_names_tar.index(step['start_face'])]
-            label_end_now=[node_names_tar.index(step['end_face'])]
-            label_action_now=[action_type_dict[step['operation']]]
-            label_start_now=torch.LongTensor(label_start_now)
-            label_end_now=torch.LongTensor(label_end_now)
-            label_action_now=torch.LongTensor(label_action_now)
-            graph_pairs_formatted.append([adj_tar,features_tar,adj_cur,features_cur,label_start_now,label_end_now,label_action_now,seq,sid])
-            counter[0]+=1
-            counter[1]+=len(node_names_tar)
-            counter[2]+=adj_tar.shape[0]
+        sequences.append((entry['path'],seq,entry['num_step']))
+    return sequences
+
+def load_dataset(args,index):
+    graph_pairs_formatted=[]
+    sequences=find_sequences(args,index)
+    store,store_writer=None,None
+    if args.store is not None:
+        if args.preprocess:
+            print('Writing graph store to:', args.store)
+            store_writer=GraphStoreWriter(args.store,FEATURIZER_VERSION)
+        else:
+            store=GraphStore(args.store,FEATURIZER_VERSION)
+            print('Using graph store with %d sequences from:'%len(store), args.store)
+    counter=[0,0,0]
+    loaded=[None]*len(sequences)
+    if store is not None:
+        for k in tqdm(range(len(sequences))):
+            alt_dataset_path,seq,num_step=sequences[k]
+            loaded[k]=store.load_sequence(seq,alt_dataset_path)
+        store_hits=len(sequences)-loaded.count(None)
+        print('graph store sequences: %d, stale or missing: %d'%(store_hits,len(sequences)-store_hits))
+    # featurize the remaining sequences from json
+    missing=[k for k in range(len(sequences)) if loaded[k] is None]
+    if args.workers>0:
+        load_sequences_parallel(sequences,missing,loaded,args.workers)
+    else:
+        for k in tqdm(missing):
+            loaded[k]=load_sequence(*sequences[k])
+    for k in range(len(sequences)):
+        alt_dataset_path,seq,num_step=sequences[k]
+        sequence=loaded[k]
+        if sequence is None:
+            continue
+        if store_writer is not None:
+            files=sequence_files(alt_dataset_path,seq)
+            store_writer.add_sequence(seq,alt_dataset_path,files,*sequence)
+        graphs,labels=sequence
+        graph_pairs=format_graph_pairs(seq,graphs,labels)
+        graph_pairs_formatted.extend(graph_pairs)
+        counter[0]+=len(graph_pairs)
+        counter[1]+=len(graph_pairs)*graphs[-1][1].shape[0]
+        counter[2]+=len(graph_pairs)*graphs[-1][0].shape[0]
+    if store_writer is not None:
+        store_writer.close()
     print('total graph pairs: %d, total nodes: %d - %d'%(counter[0],counter[1],counter[2]))
     return graph_pairs_formatted
 
+def load_sequences_parallel(sequences,ids,loaded,workers,shard_size=64):
+    # featurize sequences[ids] in a pool of worker processes, in shards of shard_size sequences.
+    # Shards are merged back into loaded in order so the dataset is the same as a serial load,
+    # the sequences of a shard that raised an error are skipped and reported
+    shards=[(sid,[sequences[k] for k in ids[i:i+shard_size]]) for sid,i in enumerate(range(0,len(ids),shard_size))]
+    failed=[]
+    with multiprocessing.Pool(workers) as pool:
+        for sid,packed,error in tqdm(pool.imap(load_sequence_shard,shards),total=len(shards)):
+            if error is not None:
+                failed.append((sid,error))
+                continue
+            for i,sequence in enumerate(packed):
+                if sequence is not None:
+                    graphs,labels=sequence
+                    loaded[ids[sid*shard_size+i]]=[unpack_graph(x) for x in graphs],labels
+    if len(failed)>0:
+        print('Failed to load %d of %d shards:'%(len(failed),len(shards)))
+        for sid,error in failed:
+            seqs=[x[1] for x in shards[sid][1]]
+            print('  shard %d (%d sequences, %s to %s): %s'%(sid,len(seqs),seqs[0],seqs[-1],error))
+    return failed
+
+def load_sequence_shard(shard):
+    # graphs are returned as numpy arrays, as pickling many tensors between processes is slow
+    sid,sequences=shard
+    try:
+        packed=[]
+        for dataset_path,seq,num_step in sequences:
+            sequence=load_sequence(dataset_path,seq,num_step)
+            if sequence is not None:
+                graphs,labels=sequence
+                sequence=[pack_graph(x) for x in graphs],labels
+            packed.append(sequence)
+        return sid,packed,None
+    except Exception as e:
+        return sid,None,'%s: %s'%(type(e).__name__,e)
+
+def pack_graph(graph):
+    adj,features=graph
+    return adj._indices().numpy(),adj._values().numpy(),features.numpy()
+
+def unpack_graph(packed):
+    indices,values,features=packed
+    num_nodes=features.shape[0]
+    return torch.sparse_coo_tensor(torch.from_numpy(indices),torch.from_numpy(values),(num_nodes,num_nodes)),torch.from_numpy(features)
+
+def load_dataset_stream(args,index):
+    # index the graph pairs without featurizing them, graphs are loaded as they are iterated
+    store=None
+    if args.store is not None:
+        store=GraphStore(args.store,FEATURIZER_VERSION)
+        print('Using graph store with %d sequences from:'%len(store), args.store)
+    dataset=GraphPairDataset(find_sequences(args,index),store=store,cache_size=args.cache_size)
+    print('total graph pairs: %d, streaming with %d workers'%(len(dataset),args.workers))
+    return dataset
+
+class GraphPairDataset(Dataset):
+    # graph pairs loaded lazily from the sequence json files, or the graph store if given.
+    # The target graph and labels of recently used sequences are kept in a bounded
+    # least recently used cache, one per DataLoader worker, shared by the steps of a sequence
+    def __init__(self,sequences,store=None,cache_size=64):
+        self.store=store
+        self.cache_size=cache_size
+        self.cache=OrderedDict()
+        self.items=[]
+        for dataset_path,seq,num_step in sequences:
+            for sid in range(num_step):
+                self.items.append((dataset_path,seq,sid))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self,index):
+        dataset_path,seq,sid=self.items[index]
+        entry=self.load_entry(dataset_path,seq)
+        graphs=entry['graphs']
+        if sid>0 and graphs[sid-1] is None:
+            with open('%s/%s'%(dataset_path,entry['steps'][sid-1])) as json_data:
+                graphs[sid-1]=format_graph_data(json.load(json_data),entry['bbox'])
+        return format_graph_pair(seq,sid,graphs,entry['labels'])
+
+    def load_entry(self,dataset_path,seq):
+        if seq in self.cache:
+            self.cache.move_to_end(seq)
+            return self.cache[seq]
+        sequence=None
+        if self.store is not None:
+            sequence=self.store.load_sequence(seq,dataset_path)
+        if sequence is not None:
+            graphs,labels=sequence
+            entry={'graphs':graphs,'labels':labels}
+        else:
+            with open('%s/%s_sequence.json'%(dataset_path,seq)) as json_data:
+                data_seq=json.load(json_data)
+            bbox=data_seq['properties']['bounding_box']
+            steps=[step['graph'] for step in data_seq['sequence']]
+            with open('%s/%s'%(dataset_path,steps[-1])) as json_data:
+                data_tar=json.load(json_data)
+            # current graphs are featurized when first used
+            graphs=[None]*len(steps)
+            graphs[-1]=format_graph_data(data_tar,bbox)
+            entry={'bbox':bbox,'steps':steps,'graphs':graphs,'labels':sequence_labels(data_seq,data_tar)}
+        self.cache[seq]=entry
+        while len(self.cache)>self.cache_size:
+            self.cache.popitem(last=False)
+        return entry
+
+    def seqs(self):
+        return [x[1] for x in self.items]
+
+def load_sequence(dataset_path,seq,num_step):
+    # load and featurize the graph of each step of a sequence from json, parsing each file once
+    # returns the step graphs and the (start,end,operation) label indices of each step
+    with open('%s/%s_sequence.json'%(dataset_path,seq)) as json_data:
+        data_seq=json.load(json_data)
+    len_equal = len(data_seq['sequence'])==num_step
+    if not len_equal:
+        print(f'Skipping {seq} due to unequal lengths: {len(data_seq["sequence"])} in json, but {num_step} files found')
+        return None
+#     assert(len(data_seq['sequence'])==num_step)
+    bbox=data_seq['properties']['bounding_box']
+    graphs=[]
+    for step in data_seq['sequence']:
+        with open('%s/%s'%(dataset_path,step['graph'])) as json_data:
+            data_step=json.load(json_data)
+        graphs.append(format_graph_data(data_step,bbox))
+    return graphs,sequence_labels(data_seq,data_step)
+
+def sequence_labels(data_seq,data_tar):
+    # (start,end,operation) label indices of each step, the faces are indexed in the target graph
+    action_type_dict={'CutFeatureOperation':1,'IntersectFeatureOperation':2,'JoinFeatureOperation':0,
+    'NewBodyFeatureOperation':3,'NewComponentFeatureOperation':4}
+    node_names_tar=[x['id'] for x in data_tar['nodes']]
+    labels=[]
+    for step in data_seq['sequence']:
+        labels.append((node_names_tar.index(step['start_face']),node_names_tar.index(step['end_face']),action_type_dict[step['operation']]))
+    return labels
+
+def sequence_files(dataset_path,seq):
+    # source json files of a sequence, relative to the dataset path
+    seq_file='%s_sequence.json'%(seq)
+    with open('%s/%s'%(dataset_path,seq_file)) as json_data:
+        data_seq=json.load(json_data)
+    return [seq_file]+[step['graph'] for step in data_seq['sequence']]
+
+def format_graph_pairs(seq,graphs,labels):
+    # the target is the last step graph, the current graph is the graph of the previous step
+    return [format_graph_pair(seq,sid,graphs,labels) for sid in range(len(labels))]
+
+def format_graph_pair(seq,sid,graphs,labels):
+    adj_tar,features_tar=graphs[-1]
+    if sid==0:
+        adj_cur,features_cur=torch.zeros((0)),torch.zeros((0))
+    else:
+        adj_cur,features_cur=graphs[sid-1]
+    label=labels[sid]
+    label_start_now=torch.LongTensor([label[0]])
+    label_end_now=torch.LongTensor([label[1]])
+    label_action_now=torch.LongTensor([label[2]])
+    return [adj_tar,features_tar,adj_cur,features_cur,label_start_now,label_end_now,label_action_now,seq,sid]
+
 def format_graph_data(data,bbox):
     surf_type_dict={'ConeSurfaceType':2,'CylinderSurfaceType':1,'EllipticalConeSurfaceType':6,
     'EllipticalCylinderSurfaceType':5,'NurbsSurfaceType':7,'PlaneSurfaceType':0,
     'SphereSurfaceType':3,'TorusSurfaceType':4}
-    node_names=[x['id'] for x in data['nodes']]
+    nodes=data['nodes']
+    num_nodes=len(nodes)
     # surface type
-    features_SurTyp=np.zeros((len(node_names),8))
-    for i in range(len(data['nodes'])):
-        features_SurTyp[i,surf_type_dict[data['nodes'][i]['surface_type']]]=1
+    features_SurTyp=np.zeros((num_nodes,8))
+    features_SurTyp[np.arange(num_nodes),[surf_type_dict[x['surface_type']] for x in nodes]]=1
     # points
-    features_Poi=np.zeros((len(node_names),len(data['nodes'][0]['points'])))
-    for i in range(len(data['nodes'])):
-        features_Poi[i,:]=data['nodes'][i]['points']
+    features_Poi=get_node_features(data,'points')
     mp1,mp2=bbox['max_point'],bbox['min_point']
     span_x,span_y,span_z=mp1['x']-mp2['x'],mp1['y']-mp2['y'],mp1['z']-mp2['z']
     scale=np.max([span_x,span_y,span_z,1e-2])
     features_Poi=features_Poi/scale
     # normals
-    features_Nor=np.zeros((len(node_names),len(data['nodes'][0]['normals'])))
-    for i in range(len(data['nodes'])):
-        features_Nor[i,:]=data['nodes'][i]['normals']
+    features_Nor=get_node_features(data,'normals')
     # trimming_mask
-    features_TriMas=np.zeros((len(node_names),len(data['nodes'][0]['trimming_mask'])))
-    for i in range(len(data['nodes'])):
-        features_TriMas[i,:]=data['nodes'][i]['trimming_mask']
+    features_TriMas=get_node_features(data,'trimming_mask')
     features=np.concatenate((features_SurTyp,features_Poi,features_Nor,features_TriMas),axis=1)
-    features=torch.FloatTensor(features)
-    # edges
+    features=torch.from_numpy(features.astype(np.float32))
+    # edges, using the first node for duplicate ids
+    node_index={}
+    for i,x in enumerate(nodes):
+        node_index.setdefault(x['id'],i)
     edges_from,edges_to=[],[]
     for link in data['links']:
-        if (link['source'] not in node_names) or (link['target'] not in node_names):
+        idx1=node_index.get(link['source'])
+        idx2=node_index.get(link['target'])
+        if idx1 is None or idx2 is None:
             continue
-        idx1=node_names.index(link['source'])
-        idx2=node_names.index(link['target'])
         edges_from.append(idx1)
         edges_to.append(idx2)
-    adj=build_adjacency_matrix(len(node_names),edges_from,edges_to)
-    adj=normalize(adj+sp.eye(adj.shape[0]))
-    adj=sparse_mx_to_torch_sparse_tensor(adj)
+    adj=build_normalized_adjacency(num_nodes,edges_from,edges_to)
     return adj,features
 
+def get_node_features(data,name):
+    # graphs decoded from binary gym responses have the features of all nodes as an array
+    if name in data.get('node_features',{}):
+        return data['node_features'][name].astype(np.float64)
+    nodes=data['nodes']
+    return np.asarray([x[name] for x in nodes],dtype=np.float64).reshape(len(nodes),-1)
+
+def build_normalized_adjacency(num_nodes,edges_from,edges_to):
+    # same result as normalize(build_adjacency_matrix(...)+I) converted to a torch sparse tensor,
+    # built directly from sorted (row,col) keys: symmetrize by taking the max edge count
+    # of both directions, add self loops and row normalize
+    edges_from=np.asarray(edges_from,dtype=np.int64)
+    edges_to=np.asarray(edges_to,dtype=np.int64)
+    keys,counts=np.unique(edges_from*num_nodes+edges_to,return_counts=True)
+    keys_t=(keys%num_nodes)*num_nodes+keys//num_nodes
+    diag=np.arange(num_nodes,dtype=np.int64)*(num_nodes+1)
+    keys_all=np.concatenate((keys,keys_t,diag))
+    values_all=np.concatenate((counts,counts,np.zeros(num_nodes,dtype=counts.dtype)))
+    order=np.lexsort((-values_all,keys_all))
+    keys_all,values_all=keys_all[order],values_all[order]
+    first=np.ones(len(keys_all),dtype=bool)
+    first[1:]=keys_all[1:]!=keys_all[:-1]
+    keys,values=keys_all[first],values_all[first].astype(np.float64)
+    rows,cols=keys//num_nodes,keys%num_nodes
+    values[rows==cols]+=1.0
+    rowsum=np.bincount(rows,weights=values,minlength=num_nodes)
+    values=(np.power(rowsum,-1)[rows]*values).astype(np.float32)
+    indices=torch.from_numpy(np.vstack((rows,cols)))
+    return torch.sparse_coo_tensor(indices,torch.from_numpy(values),(num_nodes,num_nodes))
+
 def build_adjacency_matrix(num_nodes,edges_from,edges_to):
     adj=sp.coo_matrix((np.ones(len(edges_from)),(edges_from,edges_to)),shape=(num_nodes,num_nodes),dtype=np.float32)
     adj=adj+adj.T.multiply(adj.T>adj)-adj.multiply(adj.T>adj)
@@ -236,9 +515,72 @@ def sparse_mx_to_torch_sparse_tensor(sparse_mx):
     shape=torch.Size(sparse_mx.shape)
     return torch.sparse.FloatTensor(indices,values,shape)
 
+def collate_graph_pairs(graph_pairs):
+    # pack graph pairs into block-diagonal target and current graphs,
+    # with the index of the graph pair each node belongs to
+    device=graph_pairs[0][1].device
+    adj_tar,features_tar,batch_tar,local_tar,start=[],[],[],[],[]
+    adj_cur,features_cur,batch_cur=[],[],[]
+    offset_tar,offset_cur=0,0
+    for pid,gpf in enumerate(graph_pairs):
+        num_nodes=gpf[1].size()[0]
+        adj=gpf[0].coalesce()
+        adj_tar.append((adj.indices()+offset_tar,adj.values()))
+        features_tar.append(gpf[1])
+        batch_tar.append(torch.full((num_nodes,),pid,dtype=torch.long,device=device))
+        local_tar.append(torch.arange(num_nodes,device=device))
+        start.append(gpf[4]+offset_tar)
+        offset_tar+=num_nodes
+        if gpf[2].size()[0]>0:
+            num_nodes=gpf[3].size()[0]
+            adj=gpf[2].coalesce()
+            adj_cur.append((adj.indices()+offset_cur,adj.values()))
+            features_cur.append(gpf[3])
+            batch_cur.append(torch.full((num_nodes,),pid,dtype=torch.long,device=device))
+            offset_cur+=num_nodes
+    batch={
+        'num_pairs':len(graph_pairs),
+        'max_nodes':max([gpf[1].size()[0] for gpf in graph_pairs]),
+        'adj_tar':torch.sparse_coo_tensor(torch.cat([x[0] for x in adj_tar],dim=1),torch.cat([x[1] for x in adj_tar]),(offset_tar,offset_tar)),
+        'features_tar':torch.cat(features_tar,dim=0),
+        'batch_tar':torch.cat(batch_tar),
+        'local_tar':torch.cat(local_tar),
+        'start':torch.cat(start),
+        'labels_start':torch.cat([gpf[4] for gpf in graph_pairs]),
+        'labels_end':torch.cat([gpf[5] for gpf in graph_pairs]),
+        'labels_op':torch.cat([gpf[6] for gpf in graph_pairs])
+    }
+    if offset_cur>0:
+        batch['adj_cur']=torch.sparse_coo_tensor(torch.cat([x[0] for x in adj_cur],dim=1),torch.cat([x[1] for x in adj_cur]),(offset_cur,offset_cur))
+        batch['features_cur']=torch.cat(features_cur,dim=0)
+        batch['batch_cur']=torch.cat(batch_cur)
+    else:
+        batch['adj_cur'],batch['features_cur'],batch['batch_cur']=torch.zeros((0)),torch.zeros((0)),torch.zeros((0),dtype=torch.long)
+    return batch
+
+def pad_graph_pairs(x,batch):
+    # per node logits to (num_pairs,max_nodes), padding with -inf so the softmax
+    # and cross entropy over each row only cover the nodes of that graph pair
+    x_pad=torch.full((batch['num_pairs'],batch['max_nodes']),float('-inf'),device=x.device)
+    x_pad[batch['batch_tar'],batch['local_tar']]=x.view(-1)
+    return x_pad
+
+def forward_graph_pairs(model,graph_pairs,use_gpu=True):
+    # start, end and operation logits, one row per graph pair, and their labels
+    if len(graph_pairs)==1:
+        output_start,output_end,output_op=model(graph_pairs[0],use_gpu=use_gpu)
+        return output_start.view(1,-1),output_end.view(1,-1),output_op,graph_pairs[0][4],graph_pairs[0][5],graph_pairs[0][6]
+    batch=collate_graph_pairs(graph_pairs)
+    output_start,output_end,output_op=model.forward_batch(batch,use_gpu=use_gpu)
+    return output_start,output_end,output_op,batch['labels_start'],batch['labels_end'],batch['labels_op']
+
+def graph_pairs_to_cuda(graph_pairs):
+    return [[x.cuda() for x in gpf[:7]]+gpf[7:] for gpf in graph_pairs]
+
 def accuracy(acc,output,labels):
+    # counts are kept as tensors to avoid a device sync per batch
     preds=output.max(1)[1].type_as(labels)
-    correct=preds.eq(labels).double().sum().item()
+    correct=preds.eq(labels).sum()
     acc[0]+=correct
     acc[1]+=len(labels)
     return acc
@@ -247,86 +589,96 @@ def accuracy_overall(acc_all,output0,output1,output2,labels0,labels1,labels2):
     preds0=output0.max(1)[1].type_as(labels0)
     preds1=output1.max(1)[1].type_as(labels1)
     preds2=output2.max(1)[1].type_as(labels2)
-    correct0=preds0.eq(labels0).item()
-    correct1=preds1.eq(labels1).item()
-    correct2=preds2.eq(labels2).item()
-    correct=np.logical_and(np.logical_and(correct0,correct1),correct2)
-    if correct:
-        acc_all[0]+=1
-    acc_all[1]+=1
+    correct=preds0.eq(labels0)&preds1.eq(labels1)&preds2.eq(labels2)
+    acc_all[0]+=correct.sum()
+    acc_all[1]+=len(labels0)
     return acc_all,correct
 
-def train_test(graph_pairs_formatted,args):
+def accuracy_item(*accs):
+    for acc in accs:
+        acc[0]=float(acc[0])
+    return accs
+
+def train_test(graph_pairs_formatted,index,args):
     results=[]
     exp_name=f'model_{time.strftime("%Y-%m-%d_%H-%M-%S",time.localtime())}'
     if args.exp_name is not None:
         exp_name = args.exp_name
-    # Check if this is a full path to a valid file
-    if os.path.isfile(args.split):
-        split_file=args.split
+    if len(index.split_sets)==0:
+        raise FileNotFoundError('Split file not found: %s'%split_file_path(args))
+    if isinstance(graph_pairs_formatted,GraphPairDataset):
+        seqs,workers=graph_pairs_formatted.seqs(),args.workers
     else:
-        split_file='../data/%s.json'%(args.split)
-    with open(split_file) as json_data:
-        train_test_split=json.load(json_data)
+        seqs,workers=[x[7] for x in graph_pairs_formatted],0
+    train_ids=[i for i in range(len(seqs)) if not index.in_split(seqs[i],'test')]
+    test_ids=[i for i in range(len(seqs)) if index.in_split(seqs[i],'test')]
+    # batches are lists of graph pairs, prefetched by the workers when streaming
+    train_loader=DataLoader(Subset(graph_pairs_formatted,train_ids),batch_size=args.batch_size,collate_fn=list,num_workers=workers)
+    test_loader=DataLoader(Subset(graph_pairs_formatted,test_ids),batch_size=args.batch_size,collate_fn=list,num_workers=workers)
     train_losses=[]
     for epoch in range(args.epochs):
         # train
+        # Just want to ignore any data that is in test
+        # so we can add augmented data as needed
         model.train()
         loss,acc0,acc1,acc2,acc_all=0,[0,0],[0,0],[0,0],[0,0]
-        for iter in tqdm(range(len(graph_pairs_formatted))):
-            # Just want to ignore any data that is in test
-            # so we can add augmented data as needed
-            if graph_pairs_formatted[iter][7] in train_test_split['test']:
-                continue
+        t1=time.time()
+        for graph_pairs in tqdm(train_loader):
+            if args.cuda:
+                graph_pairs=graph_pairs_to_cuda(graph_pairs)
             optimizer.zero_grad()
-            output_start,output_end,output_op=model(graph_pairs_formatted[iter])
-            output_start=output_start.view(1,-1)
-            output_end=output_end.view(1,-1)
-            loss0=F.cross_entropy(output_start,graph_pairs_formatted[iter][4],reduction='sum')
-            loss1=F.cross_entropy(output_end,graph_pairs_formatted[iter][5],reduction='sum')
-            loss2=F.cross_entropy(output_op,graph_pairs_formatted[iter][6],reduction='sum')
+            output_start,output_end,output_op,labels_start,labels_end,labels_op=forward_graph_pairs(model,graph_pairs,use_gpu=args.cuda)
+            loss0=F.cross_entropy(output_start,labels_start,reduction='sum')
+            loss1=F.cross_entropy(output_end,labels_end,reduction='sum')
+            loss2=F.cross_entropy(output_op,labels_op,reduction='sum')
             loss_now=loss0+loss1+loss2
-            loss_now.backward()
+            # mean over the graph pairs in the batch
+            (loss_now/len(graph_pairs)).backward()
             optimizer.step()
-            acc0=accuracy(acc0,output_start,graph_pairs_formatted[iter][4])
-            acc1=accuracy(acc1,output_end,graph_pairs_formatted[iter][5])
-            acc2=accuracy(acc2,output_op,graph_pairs_formatted[iter][6])
-            acc_all,correct=accuracy_overall(acc_all,output_start,output_end,output_op,graph_pairs_formatted[iter][4],graph_pairs_formatted[iter][5],graph_pairs_formatted[iter][6])
-            loss=loss+loss_now.item()
+            acc0=accuracy(acc0,output_start,labels_start)
+            acc1=accuracy(acc1,output_end,labels_end)
+            acc2=accuracy(acc2,output_op,labels_op)
+            acc_all,correct=accuracy_overall(acc_all,output_start,output_end,output_op,labels_start,labels_end,labels_op)
+            loss=loss+loss_now.detach()
+        loss=float(loss)
+        acc0,acc1,acc2,acc_all=accuracy_item(acc0,acc1,acc2,acc_all)
+        pairs_per_sec=acc0[1]/(time.time()-t1)
         scheduler.step(loss/acc0[1])
         # do not save checkpoint if training exploded
         if epoch==0 or (loss/acc0[1])<np.min(train_losses):
             torch.save(model.state_dict(),f'../ckpt/{exp_name}.ckpt')
         train_losses.append(loss/acc0[1])
-        print('(Train)Epoch: {:04d}'.format(epoch+1),'loss: {:.4f}'.format(loss/acc0[1]),'start: {:.3f}'.format(acc0[0]/acc0[1]*100.0),'end: {:.3f}'.format(acc1[0]/acc1[1]*100.0),'op: {:.3f}'.format(acc2[0]/acc2[1]*100.0),'all: {:.3f}'.format(acc_all[0]/acc_all[1]*100.0))
+        print('(Train)Epoch: {:04d}'.format(epoch+1),'loss: {:.4f}'.format(loss/acc0[1]),'start: {:.3f}'.format(acc0[0]/acc0[1]*100.0),'end: {:.3f}'.format(acc1[0]/acc1[1]*100.0),'op: {:.3f}'.format(acc2[0]/acc2[1]*100.0),'all: {:.3f}'.format(acc_all[0]/acc_all[1]*100.0),'pairs/sec: {:.1f}'.format(pairs_per_sec))
         log_results(results,exp_name,'Train',epoch,loss,acc0,acc1,acc2,acc_all)
         # test
         model.eval()
         loss,acc0,acc1,acc2,acc_all=0,[0,0],[0,0],[0,0],[0,0]
         shape_ids,not_perfect_shapes={},[]
         with torch.no_grad():
-            for iter in tqdm(range(len(graph_pairs_formatted))):
-                if graph_pairs_formatted[iter][7] not in train_test_split['test']:
-                    continue
-                if graph_pairs_formatted[iter][7] not in shape_ids:
-                    shape_ids[graph_pairs_formatted[iter][7]]=graph_pairs_formatted[iter][8]
-                else:
-                    if graph_pairs_formatted[iter][8]>shape_ids[graph_pairs_formatted[iter][7]]:
-                        shape_ids[graph_pairs_formatted[iter][7]]=graph_pairs_formatted[iter][8]
-                output_start,output_end,output_op=model(graph_pairs_formatted[iter])
-                output_start=output_start.view(1,-1)
-                output_end=output_end.view(1,-1)
-                loss0=F.cross_entropy(output_start,graph_pairs_formatted[iter][4],reduction='sum')
-                loss1=F.cross_entropy(output_end,graph_pairs_formatted[iter][5],reduction='sum')
-                loss2=F.cross_entropy(output_op,graph_pairs_formatted[iter][6],reduction='sum')
+            for graph_pairs in tqdm(test_loader):
+                for gpf in graph_pairs:
+                    if gpf[7] not in shape_ids:
+                        shape_ids[gpf[7]]=gpf[8]
+                    else:
+                        if gpf[8]>shape_ids[gpf[7]]:
+                            shape_ids[gpf[7]]=gpf[8]
+                if args.cuda:
+                    graph_pairs=graph_pairs_to_cuda(graph_pairs)
+                output_start,output_end,output_op,labels_start,labels_end,labels_op=forward_graph_pairs(model,graph_pairs,use_gpu=args.cuda)
+                loss0=F.cross_entropy(output_start,labels_start,reduction='sum')
+                loss1=F.cross_entropy(output_end,labels_end,reduction='sum')
+                loss2=F.cross_entropy(output_op,labels_op,reduction='sum')
                 loss_now=loss0+loss1+loss2
-                acc0=accuracy(acc0,output_start,graph_pairs_formatted[iter][4])
-                acc1=accuracy(acc1,output_end,graph_pairs_formatted[iter][5])
-                acc2=accuracy(acc2,output_op,graph_pairs_formatted[iter][6])
-                acc_all,correct=accuracy_overall(acc_all,output_start,output_end,output_op,graph_pairs_formatted[iter][4],graph_pairs_formatted[iter][5],graph_pairs_formatted[iter][6])
-                if (not correct) and (graph_pairs_formatted[iter][7] not in not_perfect_shapes):
-                    not_perfect_shapes.append(graph_pairs_formatted[iter][7])
-                loss=loss+loss_now.item()
+                acc0=accuracy(acc0,output_start,labels_start)
+                acc1=accuracy(acc1,output_end,labels_end)
+                acc2=accuracy(acc2,output_op,labels_op)
+                acc_all,correct=accuracy_overall(acc_all,output_start,output_end,output_op,labels_start,labels_end,labels_op)
+                for gpf,correct_now in zip(graph_pairs,correct.tolist()):
+                    if (not correct_now) and (gpf[7] not in not_perfect_shapes):
+                        not_perfect_shapes.append(gpf[7])
+                loss=loss+loss_now
+        loss=float(loss)
+        acc0,acc1,acc2,acc_all=accuracy_item(acc0,acc1,acc2,acc_all)
         acc_shape=[len(shape_ids)-len(not_perfect_shapes),len(shape_ids)]
         step_counter={}
         for seq in shape_ids:
@@ -370,7 +722,18 @@ if __name__=="__main__":
     parser.add_argument('--augment',type=str,help='Directory for augmentation data.')
     parser.add_argument('--only_augment',dest='only_augment',default=False,action='store_true',help='Train with only augmented data')
     parser.add_argument('--exp_name',type=str,help='Name of the experiment. Used for the checkpoint and log files.')
+    parser.add_argument('--batch_size',type=int,default=1,help='Number of graph pairs per training batch.')
+    parser.add_argument('--stream',action='store_true',default=False,help='Load graph pairs lazily while training instead of preloading the dataset.')
+    parser.add_argument('--workers',type=int,default=0,help='Number of worker processes used to load the dataset, or to prefetch graph pairs when streaming.')
+    parser.add_argument('--cache_size',type=int,default=64,help='Number of sequences cached by each worker when streaming.')
+    parser.add_argument('--index',type=str,help='Dataset index file, built on the first run and reused while the dataset is unchanged.')
+    parser.add_argument('--store',type=str,help='Directory of the preprocessed graph store to load the dataset from.')
+    parser.add_argument('--preprocess',action='store_true',default=False,help='Write the dataset to the graph store given by --store and exit.')
     args=parser.parse_args()
+    if args.preprocess and args.store is None:
+        parser.error('--preprocess requires --store')
+    if args.preprocess and args.stream:
+        parser.error('--preprocess cannot be used with --stream')
     args.cuda=not args.no_cuda and torch.cuda.is_available()
     args.gcn=not args.no_gcn
     # seed
@@ -379,15 +742,22 @@ if __name__=="__main__":
     if args.cuda:
         torch.cuda.manual_seed(args.seed)
     # data and model
-    graph_pairs_formatted=load_dataset(args)
+    index=load_dataset_index(args)
+    if args.stream:
+        graph_pairs_formatted=load_dataset_stream(args,index)
+    else:
+        graph_pairs_formatted=load_dataset(args,index)
+    if args.preprocess:
+        exit()
     model=NodePointer(nfeat=graph_pairs_formatted[0][1].size()[1],nhid=args.hidden,dropout=args.dropout,Use_GCN=args.gcn)
     optimizer=optim.Adam(model.parameters(),lr=args.lr)
     scheduler=ReduceLROnPlateau(optimizer,'min')
     # cuda
     if args.cuda:
         model.cuda()
+    if args.cuda and not args.stream:
         for i in range(len(graph_pairs_formatted)):
             for j in range(7):
                 graph_pairs_formatted[i][j]=graph_pairs_formatted[i][j].cuda()
     # train and test
-    train_test(graph_pairs_formatted,args)
+    train_test(graph_pairs_formatted,index,args)
@@ -0,0 +1,138 @@
+import numpy as np
+
+
+class ActionSpace:
+    """Joint (start_face, end_face, operation) action space backed by index arrays.
+        Actions are indexed in the same order as the nested enumeration
+        start_face -> end_face -> operation, and are only turned into
+        action dicts when they are consumed"""
+
+    def __init__(self, node_names, operations, start_probabilities,
+                 end_probabilities, operation_probabilities):
+        self.node_names = node_names
+        self.operations = operations
+        num_nodes = len(node_names)
+        num_operations = len(operations)
+        # Probability of each start face, shape (num_nodes,)
+        self.start_probabilities = np.asarray(start_probabilities)
+        # Probability of each end face conditioned on the start face,
+        # shape (num_nodes, num_nodes)
+        self.end_probabilities = np.asarray(end_probabilities)
+        # Probability of each operation, shape (num_operations,)
+        self.operation_probabilities = np.asarray(operation_probabilities)
+        assert self.start_probabilities.shape == (num_nodes,)
+        assert self.end_probabilities.shape == (num_nodes, num_nodes)
+        assert self.operation_probabilities.shape == (num_operations,)
+        self.shape = (num_nodes, num_nodes, num_operations)
+        self.size = num_nodes * num_nodes * num_operations
+        # Joint probability as an outer product
+        joint = self.start_probabilities[:, None] * self.end_probabilities
+        joint = joint[:, :, None] * self.operation_probabilities[None, None, :]
+        self.probabilities = joint.reshape(-1)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.action(index)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.action(index)
+
+    def action(self, index):
+        """Get the action dict at a given index"""
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError("Action index out of range")
+        start, end, operation = np.unravel_index(index, self.shape)
+        return {
+            "start_face": self.node_names[start],
+            "end_face": self.node_names[end],
+            "operation": self.operations[operation]
+        }
+
+    def take(self, indices):
+        """Get the actions at the given indices as an ActionSubset"""
+        start_indices, end_indices, operation_indices = np.unravel_index(
+            np.asarray(indices, dtype=np.int64), self.shape)
+        return ActionSubset(
+            self.node_names, self.operations,
+            start_indices, end_indices, operation_indices
+        )
+
+    def iter_sorted(self, probabilities=None, chunk_size=64):
+        """Iterate over (action, probability) in descending order of probability,
+            only sorting the actions that are consumed"""
+        if probabilities is None:
+            probabilities = self.probabilities
+        for index in iter_sorted_indices(probabilities, chunk_size):
+            yield self.action(index), probabilities[index]
+
+
+def top_k_indices(values, k, include_ties=False):
+    """Get the indices of the k largest values in descending order,
+        with ties kept in index order as a stable sort would.
+        If include_ties is set, every value tied with the k-th largest is returned"""
+    values = np.asarray(values)
+    size = len(values)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= size:
+        return np.argsort(-values, kind="stable")
+    # Partial selection to find the k-th largest value
+    partition = np.argpartition(-values, k - 1)[:k]
+    threshold = values[partition].min()
+    above = np.flatnonzero(values > threshold)
+    tied = np.flatnonzero(values == threshold)
+    if not include_ties:
+        tied = tied[:k - len(above)]
+    indices = np.concatenate((above, tied))
+    return indices[np.argsort(-values[indices], kind="stable")]
+
+
+class ActionSubset:
+    """Actions at some of the indices of an ActionSpace, kept as face and
+        operation indices so the probabilities of the whole action space
+        don't need to be kept"""
+
+    def __init__(self, node_names, operations, start_indices, end_indices, operation_indices):
+        self.node_names = node_names
+        self.operations = operations
+        self.start_indices = start_indices
+        self.end_indices = end_indices
+        self.operation_indices = operation_indices
+
+    def __len__(self):
+        return len(self.start_indices)
+
+    def __getitem__(self, index):
+        return {
+            "start_face": self.node_names[self.start_indices[index]],
+            "end_face": self.node_names[self.end_indices[index]],
+            "operation": self.operations[self.operation_indices[index]]
+        }
+
+
+def take_actions(actions, indices):
+    """Get the actions at the given indices, from either an ActionSpace
+        or an array of action dicts"""
+    if isinstance(actions, ActionSpace):
+        return actions.take(indices)
+    return np.asarray(actions)[indices]
+
+
+def iter_sorted_indices(values, chunk_size=64):
+    """Iterate over the indices of values in descending order, in the same
+        order as top_k_indices. Each chunk is selected with a partial sort
+        and the chunk size doubles, so stopping early avoids a full sort"""
+    values = np.asarray(values)
+    count = 0
+    k = max(chunk_size, 1)
+    while count < len(values):
+        indices = top_k_indices(values, k)
+        for index in indices[count:]:
+            yield index
+        count = len(indices)
+        k *= 2
@@ -1,15 +1,19 @@
 
 
+# The operations an agent can choose from, in action order
+OPERATIONS = [
+    "JoinFeatureOperation",
+    "CutFeatureOperation",
+    "IntersectFeatureOperation",
+    "NewBodyFeatureOperation",
+    "NewComponentFeatureOperation"
+]
+
+
 class Agent:
 
     def __init__(self):
-        self.operations = [
-            "JoinFeatureOperation",
-            "CutFeatureOperation",
-            "IntersectFeatureOperation",
-            "NewBodyFeatureOperation",
-            "NewComponentFeatureOperation"
-        ]
+        self.operations = list(OPERATIONS)
 
     def set_target(self, target_graph, bounding_box):
         """Set the target graph and bounding box"""
@@ -22,3 +26,8 @@ class Agent:
                 where each action is a triple (start_face, end_face, operation)
             2) the associated probability for each action"""
         pass
+
+    def get_cache_stats(self):
+        """Get a dict of cache statistics to report in the search log,
+            or None if the agent does not cache anything"""
+        return None
@@ -8,6 +8,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from agent import Agent
+from action_space import ActionSpace
+from graph_cache import GraphCache, graph_hash
 
 # Add the network folder to sys.path
 REGRAPHNET_DIR = os.path.join(os.path.dirname(__file__), "..", "regraphnet")
@@ -20,8 +22,10 @@ from train import *
 
 class AgentSupervised(Agent):
 
-    def __init__(self, use_gcn=True, use_aug=False):
+    def __init__(self, use_gcn=True, use_aug=False, batched=True, cache_size=1024):
         super().__init__()
+        # Compute the end face probabilities for all start faces in one pass
+        self.batched = batched
         self.model = NodePointer(nfeat=708, nhid=256, Use_GCN=use_gcn)
         regraphnet_dir = Path(REGRAPHNET_DIR)
         if use_gcn:
@@ -41,55 +45,110 @@ class AgentSupervised(Agent):
         self.model.load_state_dict(
             torch.load(checkpoint_file, map_location=torch.device("cpu"))
         )
+        self.model.eval()
+        # Featurized target and target-only network outputs
+        self.target_data = None
+        self.target_cache_hits = 0
+        self.target_cache_misses = 0
+        # Encoded current graphs, as search revisits the same states
+        self.current_cache = GraphCache(max_size=cache_size)
+
+    def set_target(self, target_graph, bounding_box):
+        """Set the target graph and bounding box"""
+        super().set_target(target_graph, bounding_box)
+        # The target is fixed for the whole search so we featurize it
+        # and run the parts of the network that only see the target once
+        self.target_data = self.load_target(target_graph)
+        self.target_cache_hits = 0
+        self.target_cache_misses = 1
+        # Graph features are scaled by the target bounding box
+        self.current_cache.clear()
 
     def get_actions_probabilities(self, current_graph, target_graph):
         super().get_actions_probabilities(current_graph, target_graph)
-        graph_pair_formatted, node_names = self.load_graph_pair(target_graph, current_graph)
-        actions_sorted, probs_sorted = self.inference(graph_pair_formatted, node_names)
-        return np.array(actions_sorted), np.array(probs_sorted)
+        if self.target_data is not None and target_graph is self.target_graph:
+            target_data = self.target_data
+            self.target_cache_hits += 1
+        else:
+            target_data = self.load_target(target_graph)
+            self.target_cache_misses += 1
+        x_cur = self.encode_current(current_graph)
+        actions = self.inference(target_data, x_cur)
+        return actions, actions.probabilities.copy()
+
+    def get_cache_stats(self):
+        """Get the hit/miss counts of the target featurization cache"""
+        lookups = self.target_cache_hits + self.target_cache_misses
+        hit_ratio = self.target_cache_hits / lookups if lookups > 0 else 0.0
+        current_stats = self.current_cache.get_stats()
+        return {
+            "target_hits": self.target_cache_hits,
+            "target_misses": self.target_cache_misses,
+            "target_hit_ratio": hit_ratio,
+            "current_size": current_stats["size"],
+            "current_max_size": current_stats["max_size"],
+            "current_hits": current_stats["hits"],
+            "current_misses": current_stats["misses"],
+            "current_hit_ratio": current_stats["hit_ratio"]
+        }
 
-    def load_graph_pair(self, data_tar, data_cur):
+    def load_target(self, data_tar):
+        """Featurize the target graph and calculate the target branch
+            activations and the end face probabilities,
+            which do not depend on the current graph"""
         adj_tar, features_tar = format_graph_data(data_tar, self.bounding_box)
+        node_names = [x["id"] for x in data_tar["nodes"]]
+        num_nodes = features_tar.size()[0]
+        with torch.no_grad():
+            x_tar = self.model.encode_target(adj_tar, features_tar)
+            if self.batched:
+                # All end faces conditioned on each start face in one pass
+                output_end = self.model.decode_end_batched(adj_tar, features_tar)
+                output_end = F.softmax(output_end, dim=1)
+                end_probabilities = output_end.data.numpy().astype(np.float64)
+            else:
+                end_probabilities = np.zeros((num_nodes, num_nodes))
+                for i in range(num_nodes):
+                    output_end = self.model.decode_end(adj_tar, features_tar, i)
+                    output_end = F.softmax(output_end.view(1, -1), dim=1)
+                    end_probabilities[i, :] = output_end.data.numpy()
+        return {
+            "adj": adj_tar,
+            "features": features_tar,
+            "node_names": node_names,
+            "x": x_tar,
+            "end_probabilities": end_probabilities
+        }
+
+    def load_current(self, data_cur):
+        """Featurize the current graph"""
         # If the current graph is empty
         if len(data_cur["nodes"]) == 0:
-            adj_cur, features_cur = torch.zeros((0)), torch.zeros((0))
-        else:
-            adj_cur, features_cur = format_graph_data(
-                data_cur, self.bounding_box
-            )
-        graph_pair_formatted = [adj_tar, features_tar, adj_cur, features_cur]
-        node_names = [x["id"] for x in data_tar["nodes"]]
-        return graph_pair_formatted, node_names
+            return torch.zeros((0)), torch.zeros((0))
+        return format_graph_data(data_cur, self.bounding_box)
 
-    def inference(self, graph_pair_formatted, node_names):
-        self.model.eval()
-        num_nodes = graph_pair_formatted[1].size()[0]
-        output_end_conditioned = np.zeros((num_nodes, num_nodes))
+    def encode_current(self, data_cur):
+        """Featurize and encode the current graph,
+            reusing the result if we have seen the same graph before"""
+        key = graph_hash(data_cur)
+        x_cur = self.current_cache.get(key)
+        if x_cur is None:
+            adj_cur, features_cur = self.load_current(data_cur)
+            with torch.no_grad():
+                x_cur = self.model.encode_current(adj_cur, features_cur, use_gpu=False)
+            self.current_cache.put(key, x_cur)
+        return x_cur
+
+    def inference(self, target_data, x_cur):
         with torch.no_grad():
-            graph_pair_formatted.append(0)
-            output_start, _, output_op = self.model(
-                graph_pair_formatted, use_gpu=False)
+            output_start, output_op = self.model.decode_start_op(target_data["x"], x_cur)
             output_start = F.softmax(output_start.view(1, -1), dim=1)
             output_op = F.softmax(output_op, dim=1)
-            for i in range(num_nodes):
-                graph_pair_formatted[4] = i
-                _, output_end, _ = self.model(graph_pair_formatted, use_gpu=False)
-                output_end = F.softmax(output_end.view(1, -1), dim=1)
-                output_end_conditioned[i, :] = output_end.data.numpy()
-        ps = [
+        # The action space enumerates all (start, end, operation) triples
+        return ActionSpace(
+            target_data["node_names"],
+            self.operations,
             output_start.data.numpy()[0, :],
-            output_end_conditioned,
+            target_data["end_probabilities"],
             output_op.data.numpy()[0, :]
-        ]
-        # enumerate all actions
-        actions, probs = [], []
-        for i in range(len(node_names)):
-            for j in range(len(node_names)):
-                for k in range(len(self.operations)):
-                    actions.append({
-                        "start_face": node_names[i],
-                        "end_face": node_names[j],
-                        "operation": self.operations[k]
-                    })
-                    probs.append(ps[0][i]*ps[1][i, j]*ps[2][k])
-        return actions, probs
+        )
@@ -0,0 +1,247 @@
+"""
+
+Benchmark the search strategies and agents on cost and score
+over a folder of targets, reporting per step latency
+and solved rate vs budget curves as JSON
+
+"""
+import json
+import time
+import random
+import argparse
+import tempfile
+import traceback
+import functools
+from pathlib import Path
+import numpy as np
+
+from search_factory import get_env, get_agent, get_search
+
+
+# Latency categories recorded for each step
+LATENCY_CATEGORIES = ["agent", "filter", "env", "log"]
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, required=True, help="File or folder of targets to reconstruct")
+    parser.add_argument("--split", type=str, help="Train/test split file from which to select test files to process")
+    parser.add_argument("--output", type=str, default="benchmark_report.json", help="File to save the JSON report to [default: benchmark_report.json]")
+    parser.add_argument("--env", type=str, default="sim", help="Environment to use, can be gym or sim [default: sim]")
+    parser.add_argument("--launch_gym", dest="launch_gym", default=False, action="store_true",
+                        help="Launch the Fusion 360 Gym automatically, requires the gym to be set to run on startup [default: False]")
+    parser.add_argument("--graph_delta", dest="graph_delta", default=False, action="store_true", help="Request the changes since the last graph from the gym rather than the whole graph [default: False]")
+    parser.add_argument("--response_format", type=str, default="binary", help="Format of the graphs in gym responses, binary to decode the face features straight into arrays, or json [default: binary]")
+    parser.add_argument("--agents", type=str, default="rand", help="Comma separated agents to benchmark, from rand, mpn, and mlp [default: rand]")
+    parser.add_argument("--searches", type=str, default="rand,beam,best", help="Comma separated searches to benchmark, from rand, beam, and best [default: rand,beam,best]")
+    parser.add_argument("--budget", type=int, default=100, help="The number of steps to search [default: 100]")
+    parser.add_argument("--cache_size", type=int, default=1024, help="The number of encoded graphs the mpn/mlp agents keep in memory, 0 to disable [default: 1024]")
+    parser.add_argument("--augment", dest="augment", default=False, action="store_true", help="Use agents trained on augmented data [default: False]")
+    parser.add_argument("--log_format", type=str, default="jsonl", help="Format of the search logs, jsonl or json [default: jsonl]")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed set before searching each target [default: 0]")
+    parser.add_argument("--limit", type=int, help="Maximum number of targets to benchmark")
+    return parser.parse_args()
+
+
+def get_files(input, env_type, split=None, limit=None):
+    """Get the target files, sequence files for the offline environment"""
+    input = Path(input)
+    suffix = "_sequence.json" if env_type == "sim" else ".smt"
+    if input.is_dir():
+        files = sorted(input.glob(f"**/*{suffix}"))
+    else:
+        files = [input]
+    if split is not None:
+        with open(split, encoding="utf8") as f:
+            test_files = set(f"{x}{suffix}" for x in json.load(f)["test"])
+        files = [f for f in files if f.name in test_files]
+    if limit is not None:
+        files = files[:limit]
+    return files
+
+
+class LatencyRecorder:
+    """Record the time spent in the methods of the agent, search and env
+        by replacing them on the instance with timed wrappers"""
+
+    def __init__(self):
+        self.instrumented = []
+        self.reset()
+
+    def reset(self):
+        self.totals = {category: 0.0 for category in LATENCY_CATEGORIES}
+        self.counts = {category: 0 for category in LATENCY_CATEGORIES}
+
+    def instrument(self, obj, method_name, category):
+        """Time calls to a method of an object under the given category"""
+        method = getattr(obj, method_name)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.totals[category] += time.perf_counter() - start_time
+                self.counts[category] += 1
+        setattr(obj, method_name, timed)
+        self.instrumented.append((obj, method_name))
+
+    def restore(self):
+        """Remove the timed wrappers"""
+        for obj, method_name in self.instrumented:
+            delattr(obj, method_name)
+        self.instrumented = []
+
+    def get_stats(self, steps):
+        """Get the total and per step latency of each category"""
+        stats = {}
+        for category in LATENCY_CATEGORIES:
+            stats[category] = {
+                "total": self.totals[category],
+                "calls": self.counts[category],
+                "per_step": self.totals[category] / steps if steps > 0 else 0.0
+            }
+        return stats
+
+
+def pad_scores(max_scores, budget):
+    """Pad the best score over time to the budget,
+        as search stops early when the target is solved"""
+    scores = list(max_scores[:budget])
+    last_score = scores[-1] if len(scores) > 0 else 0
+    return scores + [last_score] * (budget - len(scores))
+
+
+def get_curves(results, budget):
+    """Solved rate and mean best score at each budget"""
+    scores = np.array([
+        pad_scores(result["max_scores"], budget)
+        for result in results if result["status"] == "Success"
+    ])
+    if len(scores) == 0:
+        return {"solved_rate": [], "mean_score": []}
+    solved = np.isclose(scores, 1, atol=0.00001)
+    return {
+        "solved_rate": solved.mean(axis=0).tolist(),
+        "mean_score": scores.mean(axis=0).tolist()
+    }
+
+
+def benchmark(env, agent_type, search_type, files, args, log_dir):
+    """Benchmark one agent and search combination over the target files"""
+    recorder = LatencyRecorder()
+    agent = get_agent(agent_type, use_aug=args.augment, cache_size=args.cache_size)
+    search = get_search(search_type, env, log_dir, args.log_format)
+    recorder.instrument(agent, "get_actions_probabilities", "agent")
+    recorder.instrument(search, "filter_bad_actions", "filter")
+    for method_name in ["extrude", "extrudes", "revert_to_target"]:
+        recorder.instrument(env, method_name, "env")
+    recorder.instrument(search.log, "log", "log")
+
+    results = []
+    for file in files:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+        recorder.reset()
+        result = {
+            "file": file.name,
+            "status": "Success"
+        }
+        start_time = time.perf_counter()
+        try:
+            target_graph, bounding_box = search.set_target(file)
+            agent.set_target(target_graph, bounding_box)
+            max_scores = search.search(agent, args.budget)
+            # Include writing the log to disk in the time
+            search.log.sync()
+            result["max_scores"] = max_scores
+            result["score"] = max_scores[-1] if len(max_scores) > 0 else 0
+            result["steps"] = len(max_scores)
+            # Env calls saved by the transposition table do not use budget
+            result["transpositions"] = search.transpositions.get_stats()
+        except Exception as ex:
+            result["status"] = "Fail"
+            result["exception"] = type(ex).__name__
+            result["trace"] = traceback.format_exc()
+            result["steps"] = 0
+        result["time"] = time.perf_counter() - start_time
+        result["latency"] = recorder.get_stats(result["steps"])
+        results.append(result)
+        print(f"[{agent_type}/{search_type}] {file.name} {result['status']} in {result['steps']} steps ({result['time']:.2f} sec)")
+    recorder.restore()
+    search.log.close()
+    return results, agent
+
+
+def summarize(results, budget):
+    """Summarize the results of an agent and search combination"""
+    success = [result for result in results if result["status"] == "Success"]
+    steps = sum(result["steps"] for result in success)
+    total_time = sum(result["time"] for result in success)
+    latency = {}
+    for category in LATENCY_CATEGORIES:
+        total = sum(result["latency"][category]["total"] for result in success)
+        latency[category] = {
+            "total": total,
+            "per_step": total / steps if steps > 0 else 0.0
+        }
+    # Time not spent in any of the categories
+    other = total_time - sum(latency[category]["total"] for category in LATENCY_CATEGORIES)
+    latency["other"] = {
+        "total": other,
+        "per_step": other / steps if steps > 0 else 0.0
+    }
+    return {
+        "files": len(results),
+        "failed": len(results) - len(success),
+        "solved": sum(1 for result in success if np.isclose(result["score"], 1, atol=0.00001)),
+        "mean_score": float(np.mean([result["score"] for result in success])) if len(success) > 0 else 0.0,
+        "steps": steps,
+        "time": total_time,
+        "steps_per_sec": steps / total_time if total_time > 0 else 0.0,
+        "latency": latency,
+        "curves": get_curves(results, budget)
+    }
+
+
+def main():
+    args = get_args()
+    files = get_files(args.input, args.env, args.split, args.limit)
+    if len(files) == 0:
+        print("No target files found")
+        exit()
+    env = get_env(args.env, launch_gym=args.launch_gym,
+                  response_format=args.response_format, graph_delta=args.graph_delta)
+    report = {
+        "env": args.env,
+        "budget": args.budget,
+        "augment": args.augment,
+        "seed": args.seed,
+        "files": [file.name for file in files],
+        "runs": []
+    }
+    # Search logs are written to a temporary folder, so their cost is measured
+    with tempfile.TemporaryDirectory() as log_dir:
+        for agent_type in args.agents.split(","):
+            for search_type in args.searches.split(","):
+                results, agent = benchmark(env, agent_type, search_type, files, args, Path(log_dir))
+                run = {
+                    "agent": agent_type,
+                    "search": search_type,
+                    "summary": summarize(results, args.budget),
+                    "results": results
+                }
+                cache_stats = agent.get_cache_stats()
+                if cache_stats is not None:
+                    run["agent_cache"] = cache_stats
+                report["runs"].append(run)
+                summary = run["summary"]
+                print(f"[{agent_type}/{search_type}] Solved {summary['solved']}/{summary['files']}, mean score {summary['mean_score']:.3f}, {summary['steps_per_sec']:.1f} steps/sec")
+    with open(args.output, "w", encoding="utf8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
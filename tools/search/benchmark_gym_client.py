@@ -0,0 +1,170 @@
+"""
+
+Benchmark the round trip time and response size of gym commands
+against a local stand-in server, sending each command on a new connection
+to an HTTP/1.0 server (before), reusing a kept alive connection
+to an HTTP/1.1 server (after), requesting graphs in the binary format (binary),
+and requesting graph deltas (delta and binary_delta)
+
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+import numpy as np
+from requests.exceptions import ConnectionError
+
+from repl_env import ReplEnv
+from sim_env import SimEnv
+from face_pair_index import FacePairIndex
+from fusion360gym_client import Fusion360GymClient
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", type=str, required=True, help="Target .smt file, with a *_sequence.json file of the same name in the dataset folder")
+    parser.add_argument("--dataset", type=str, required=True, help="Folder of *_sequence.json files for the stand-in server")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host name of the stand-in server [default: 127.0.0.1]")
+    parser.add_argument("--port", type=int, default=8199, help="Port of the stand-in server [default: 8199]")
+    parser.add_argument("--iterations", type=int, default=500, help="Number of times each command is sent [default: 500]")
+    parser.add_argument("--output", type=str, help="File to save the JSON report to")
+    return parser.parse_args()
+
+
+class BenchmarkClient(Fusion360GymClient):
+    """Client that records the size of each response,
+        and can open a new connection for each command as before keep-alive"""
+
+    def __init__(self, url, keep_alive=True):
+        super().__init__(url)
+        self.keep_alive = keep_alive
+        self.response_sizes = []
+
+    def get_session(self):
+        if not self.keep_alive:
+            self.close()
+        return super().get_session()
+
+    def send_command(self, *args, **kwargs):
+        r = super().send_command(*args, **kwargs)
+        self.response_sizes.append(len(r.content))
+        return r
+
+
+def start_server(args, protocol):
+    """Start the stand-in server and wait for it to respond"""
+    server_file = Path(__file__).resolve().parent / "sim_gym_server.py"
+    server = subprocess.Popen([
+        sys.executable, str(server_file),
+        "--dataset", args.dataset,
+        "--host", args.host,
+        "--port", str(args.port),
+        "--protocol", protocol
+    ], stdout=subprocess.DEVNULL)
+    client = BenchmarkClient(f"http://{args.host}:{args.port}", keep_alive=False)
+    for attempt in range(100):
+        try:
+            if client.ping().status_code == 200:
+                return server
+        except ConnectionError:
+            time.sleep(0.1)
+    server.terminate()
+    raise Exception("Stand-in server is not responding")
+
+
+def time_command(client, function, iterations):
+    """Time a number of calls to a function that sends a command
+        and decodes the response, returning the latency stats in ms
+        and the mean response size in bytes"""
+    client.response_sizes = []
+    times = []
+    for i in range(iterations):
+        start_time = time.perf_counter()
+        function(i)
+        times.append(time.perf_counter() - start_time)
+    times = np.array(times) * 1000
+    return {
+        "mean_ms": float(times.mean()),
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "total_sec": float(times.sum() / 1000),
+        "mean_bytes": float(np.mean(client.response_sizes))
+    }
+
+
+def benchmark(env, target_file, dataset, iterations):
+    """Time the ping, extrudes, and sequence of extrude commands"""
+    graph, bounding_box = env.set_target(target_file)
+    # Extrude between the first valid pair of faces
+    face_pairs = FacePairIndex(graph)
+    start, end = np.argwhere(face_pairs.valid)[0]
+    actions = [{
+        "start_face": face_pairs.node_names[start],
+        "end_face": face_pairs.node_names[end],
+        "operation": "NewBodyFeatureOperation"
+    }]
+    # Extrude the ground truth sequence one action at a time,
+    # reverting before each pass, so each graph differs from the last
+    sim_env = SimEnv(dataset)
+    sim_env.set_target(target_file)
+    sequence = sim_env.sequence
+
+    def ping(i):
+        assert env.client.ping().status_code == 200
+
+    def extrudes(i):
+        graph, iou = env.extrudes(actions, revert=True)
+        assert graph is not None
+
+    def sequence_step(i):
+        step = i % (len(sequence) + 1)
+        if step == 0:
+            env.revert_to_target()
+        else:
+            graph, iou = env.extrude(*sequence[step - 1])
+            assert graph is not None
+
+    return {
+        "ping": time_command(env.client, ping, iterations),
+        "add_extrudes_by_target_face": time_command(env.client, extrudes, iterations),
+        "sequence": time_command(env.client, sequence_step, iterations)
+    }
+
+
+def main():
+    args = get_args()
+    url = f"http://{args.host}:{args.port}"
+    report = {}
+    runs = [
+        ("before", "HTTP/1.0", False, "json", False),
+        ("after", "HTTP/1.1", True, "json", False),
+        ("binary", "HTTP/1.1", True, "binary", False),
+        ("delta", "HTTP/1.1", True, "json", True),
+        ("binary_delta", "HTTP/1.1", True, "binary", True)
+    ]
+    for name, protocol, keep_alive, response_format, graph_delta in runs:
+        server = start_server(args, protocol)
+        env = ReplEnv(args.host, args.port, response_format=response_format, graph_delta=graph_delta)
+        env.client = BenchmarkClient(url, keep_alive)
+        try:
+            with env.client:
+                report[name] = benchmark(env, Path(args.target), args.dataset, args.iterations)
+        finally:
+            server.terminate()
+            server.wait()
+        for command, stats in report[name].items():
+            print(f"[{name}] {command}: {stats['mean_ms']:.3f} ms mean, {stats['p50_ms']:.3f} ms p50, {stats['p95_ms']:.3f} ms p95, {stats['mean_bytes']:.0f} bytes")
+    for name in list(report)[1:]:
+        for command in report["before"]:
+            speedup = report["before"][command]["mean_ms"] / report[name][command]["mean_ms"]
+            print(f"[{name}] {command}: {speedup:.2f}x faster than before")
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+
+Convert search logs and the results journal from the jsonl format,
+with a record per line, to the json format read by the evaluation notebook
+
+"""
+import json
+import argparse
+from pathlib import Path
+
+from log import convert_log
+from results_journal import load_results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, required=True, help="Log file or folder of search logs and results to convert")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    input = Path(args.input)
+    if input.is_dir():
+        log_files = sorted(input.glob("**/*_log.jsonl"))
+    else:
+        log_files = [input]
+    for log_file in log_files:
+        json_file = convert_log(log_file)
+        print(f"Converted {log_file.name} to {json_file.name}")
+    print(f"Converted {len(log_files)} log files")
+    # Convert the results journal to search_results.json
+    results_file = input / "search_results.jsonl"
+    if input.is_dir() and results_file.exists():
+        results = load_results(results_file)
+        json_file = results_file.with_suffix(".json")
+        with open(json_file, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=4)
+        print(f"Converted {len(results)} results to {json_file.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import numpy as np
+
+
+class FacePairIndex:
+    """Index of the target face pairs that can be extruded between,
+        computed once per target from the per face normals and points
+        of the PerFace graph.
+        Approximates the checks in the server's __check_extrude_actions:
+        both faces must be planar, parallel to each other and not coplanar.
+        The server uses Fusion's isParallelToPlane and isCoPlanarTo, while
+        this index compares the averaged sampled normals and points of each face
+        within parallel_tolerance and coplanar_tolerance, so a pair near a tolerance
+        can be marked invalid here but accepted by the server.
+        test_face_pair_index checks the two agree on the test data"""
+
+    # Planes are parallel if the absolute dot product of their normals
+    # is within this tolerance of 1
+    parallel_tolerance = 1e-5
+    # Planes are coplanar if they are parallel
+    # and the distance between them is within this tolerance
+    coplanar_tolerance = 1e-5
+
+    def __init__(self, graph):
+        nodes = graph["nodes"]
+        self.node_names = [node["id"] for node in nodes]
+        self.node_index = {name: index for index, name in enumerate(self.node_names)}
+        num_nodes = len(nodes)
+        self.planar = np.array(
+            [node["surface_type"] == "PlaneSurfaceType" for node in nodes], dtype=bool)
+        # Unit normal and a point on the plane of each planar face
+        self.normals = np.zeros((num_nodes, 3))
+        self.points = np.zeros((num_nodes, 3))
+        # Faces without features can't be checked, so pairs with them are kept
+        self.has_plane = np.zeros(num_nodes, dtype=bool)
+        for index, node in enumerate(nodes):
+            if not self.planar[index]:
+                continue
+            plane = self.get_plane(node)
+            if plane is not None:
+                self.normals[index], self.points[index] = plane
+                self.has_plane[index] = True
+        self.valid = self.get_valid_pairs()
+
+    def __len__(self):
+        return len(self.node_names)
+
+    def get_plane(self, node):
+        """Get the unit normal and a point on the plane of a face,
+            or None if the face has no normal and point features"""
+        if "normals" not in node or "points" not in node:
+            return None
+        normal = np.mean(np.array(node["normals"], dtype=np.float64).reshape(-1, 3), axis=0)
+        length = np.linalg.norm(normal)
+        if length == 0:
+            return None
+        point = np.mean(np.array(node["points"], dtype=np.float64).reshape(-1, 3), axis=0)
+        return normal / length, point
+
+    def get_valid_pairs(self):
+        """Get the (num_nodes, num_nodes) mask of valid (start_face, end_face) pairs"""
+        parallel = np.abs(self.normals @ self.normals.T) >= 1 - self.parallel_tolerance
+        # Distance from the plane of the start face to the point of the end face
+        offsets = self.points[None, :, :] - self.points[:, None, :]
+        distances = np.abs(np.einsum("ik,ijk->ij", self.normals, offsets))
+        coplanar = parallel & (distances <= self.coplanar_tolerance)
+        checked = self.has_plane[:, None] & self.has_plane[None, :]
+        geometry_valid = np.where(checked, parallel & ~coplanar, True)
+        valid = self.planar[:, None] & self.planar[None, :] & geometry_valid
+        # A face is always coplanar to itself
+        np.fill_diagonal(valid, False)
+        return valid
+
+    def is_valid(self, start_face, end_face):
+        """Check if an extrude between two faces can be valid"""
+        start = self.node_index.get(start_face)
+        end = self.node_index.get(end_face)
+        if start is None or end is None:
+            return False
+        return bool(self.valid[start, end])
+
+    def get_mask(self, node_names):
+        """Get the mask of valid pairs over the given node names,
+            with names that are not in the target never valid"""
+        indices = np.array([self.node_index.get(name, -1) for name in node_names], dtype=np.int64)
+        mask = self.valid[indices[:, None], indices[None, :]]
+        known = indices >= 0
+        return mask & known[:, None] & known[None, :]
+
+    def get_stats(self):
+        """Get the number of planar faces and valid pairs"""
+        return {
+            "faces": len(self.node_names),
+            "planar_faces": int(self.planar.sum()),
+            "valid_pairs": int(self.valid.sum())
+        }
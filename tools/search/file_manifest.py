@@ -0,0 +1,130 @@
+import os
+import json
+from pathlib import Path
+
+
+def get_manifest_key(input_dir, suffix, split_file=None):
+    """Key of the input folder, file suffix and split file,
+        with the modification time of the split file so a manifest
+        is rebuilt when it changes"""
+    input_dir = Path(input_dir).resolve()
+    key = {
+        "input": str(input_dir),
+        "suffix": suffix,
+        "split": None,
+        "split_mtime": None
+    }
+    if split_file is not None:
+        split_file = Path(split_file).resolve()
+        key["split"] = str(split_file)
+        key["split_mtime"] = split_file.stat().st_mtime_ns
+    return key
+
+
+def get_dir_mtimes(input_dir):
+    """Get the modification time of the input folder and every folder in it,
+        which change when files or folders are added to or removed from them.
+        This walks the whole folder, so it is only used when searching for files"""
+    input_dir = Path(input_dir)
+    dir_mtimes = {}
+    for dir_path, dir_names, file_names in os.walk(input_dir):
+        dir_mtimes[os.path.relpath(dir_path, input_dir)] = os.stat(dir_path).st_mtime_ns
+    return dir_mtimes
+
+
+def load_manifest(manifest_file, key):
+    """Load the list of files in a manifest, or None if there is no manifest
+        for the key or files have been added to or removed from the input folder"""
+    manifest_file = Path(manifest_file)
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file, encoding="utf8") as f:
+        manifest = json.load(f)
+    if manifest.get("key") != key:
+        return None
+    input_dir = Path(key["input"])
+    if not is_manifest_current(input_dir, manifest.get("dirs")):
+        return None
+    return [input_dir / file for file in manifest["files"]]
+
+
+def is_manifest_current(input_dir, dir_mtimes):
+    """Check the folders found when the manifest was saved are unchanged,
+        only reading the modification time of each rather than listing them.
+        A new folder changes the modification time of its parent"""
+    if not dir_mtimes:
+        return False
+    for dir_path, mtime in dir_mtimes.items():
+        try:
+            if os.stat(input_dir / dir_path).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def save_manifest(manifest_file, key, files, dir_mtimes):
+    """Save the list of files, relative to the input folder, to a manifest
+        with the modification times of the folders they were found in"""
+    manifest_file = Path(manifest_file)
+    input_dir = Path(key["input"])
+    manifest = {
+        "key": key,
+        "dirs": dir_mtimes,
+        "files": [os.path.relpath(Path(file).resolve(), input_dir) for file in files]
+    }
+    temp_file = manifest_file.with_suffix(".tmp")
+    with open(temp_file, "w", encoding="utf8") as f:
+        json.dump(manifest, f)
+    os.replace(temp_file, manifest_file)
+
+
+def get_files(input, suffix, split_file=None, output_dir=None, rescan=False):
+    """Get the files with a suffix in the input folder,
+        only those in the test set if a split file is given.
+        The files are cached in a manifest in the output folder,
+        so they are only searched for on the first run"""
+    input = Path(input)
+    if not input.is_dir():
+        return [input]
+    # Use the files found by a previous run on the same input and split
+    manifest_file = None
+    if output_dir is not None:
+        manifest_file = Path(output_dir) / "file_manifest.json"
+        manifest_key = get_manifest_key(input, suffix, split_file)
+        if not rescan:
+            files = load_manifest(manifest_file, manifest_key)
+            if files is not None:
+                print(f"Using {len(files)} files from {manifest_file.name}")
+                return files
+    test_files = None
+    if split_file is not None:
+        with open(split_file, encoding="utf8") as f:
+            json_data = json.load(f)
+            if "test" not in json_data:
+                print("Split file does not have a test set")
+            else:
+                test_files = set()
+                for test_file in json_data["test"]:
+                    test_files.add(f"{test_file}{suffix}")
+
+    files = []
+    # Taken before searching, so files added during the search trigger a rescan
+    dir_mtimes = get_dir_mtimes(input.resolve())
+    smt_files = [f for f in input.glob(f"**/*{suffix}")]
+    if len(smt_files) == 0:
+        print(f"No {suffix} files found")
+        return files
+    for smt_file in smt_files:
+        if test_files is None:
+            # If we don't have a split
+            # use all files
+            files.append(smt_file)
+        else:
+            # If we have a split
+            # use only the test files
+            if smt_file.name in test_files:
+                files.append(smt_file)
+    if manifest_file is not None:
+        save_manifest(manifest_file, manifest_key, files, dir_mtimes)
+    return files
@@ -0,0 +1,62 @@
+import json
+import hashlib
+from collections import OrderedDict
+
+
+def graph_hash(graph):
+    """Cheap canonical hash of a graph from its node ids and links,
+        independent of the order of the nodes and links"""
+    nodes = sorted(node["id"] for node in graph["nodes"])
+    links = sorted(
+        sorted((link["source"], link["target"])) for link in graph["links"]
+    )
+    graph_string = json.dumps([nodes, links], separators=(",", ":"))
+    return hashlib.sha1(graph_string.encode("utf8")).hexdigest()
+
+
+class GraphCache:
+    """Bounded least recently used cache keyed by graph hash"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Get a cached value or None if it is not in the cache"""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """Add a value to the cache, evicting the least recently used entry"""
+        if self.max_size <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        """Get the size and hit/miss counts of the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups > 0 else 0.0
+        }
@@ -1,11 +1,20 @@
+import os
 import time
 import json
+import queue
+import threading
 from pathlib import Path
 
 
+# Log formats, json rewrites a JSON array of all steps on every step,
+# jsonl appends one JSON record per line from a background thread
+LOG_FORMATS = ["json", "jsonl"]
+
+
 class Log:
 
-    def __init__(self, env, log_dir):
+    def __init__(self, env, log_dir, log_format="jsonl", buffer_size=1024):
+        assert log_format in LOG_FORMATS
         self.env = env
         self.current_dir = Path(__file__).resolve().parent
         if log_dir is not None:
@@ -14,10 +23,17 @@ class Log:
             self.log_dir = Path(__file__).resolve().parent / "log"
             if not self.log_dir.exists():
                 self.log_dir.mkdir()
+        self.log_format = log_format
         self.log_data = []
+        self.log_file = None
+        self.writer = None
+        if self.log_format == "jsonl":
+            self.writer = LogWriter(buffer_size)
 
     def set_target(self, target_file):
         """Set the target file so the log can be named after it"""
+        # Make sure the log of the previous target is on disk
+        self.sync()
         self.target_file = target_file
         self.log_data = []
         # Create a log folder for this file
@@ -25,7 +41,9 @@ class Log:
         self.log_file_dir = self.log_dir / self.target_file.stem
         if not self.log_file_dir.exists():
             self.log_file_dir.mkdir()
-        self.log_file = self.log_file_dir / f"{self.target_file.stem}_log.json"
+        self.log_file = self.log_file_dir / f"{self.target_file.stem}_log.{self.log_format}"
+        if self.writer is not None:
+            self.writer.open(self.log_file)
 
     def log(self, data, screenshot=False):
         """Log data to the log array"""
@@ -36,13 +54,18 @@ class Log:
             else:
                 time_stamp = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
                 file = self.log_file_dir / f"Screenshot_{time_stamp}.png"
-            result = self.env.screenshot(file)
+            # The env waits for the screenshot before the next command
+            # so the search loop can carry on in the meantime
+            result = self.env.screenshot(file, block=False)
             if isinstance(data, dict):
                 data["screenshot"] = file.name
         if isinstance(data, dict):
             data["time"] = time.time()
-        self.log_data.append(data)
-        self.save()
+        if self.writer is not None:
+            self.writer.write(json.dumps(data) + "\n")
+        else:
+            self.log_data.append(data)
+            self.save()
 
     def save(self):
         """Save out a log of the search sequence"""
@@ -51,3 +74,115 @@ class Log:
                 self.log_file is not None):
             with open(self.log_file, "w", encoding="utf8") as f:
                 json.dump(self.log_data, f, indent=4)
+
+    def sync(self):
+        """Wait for the log of the current target to be written and synced to disk"""
+        if self.writer is not None:
+            self.writer.sync()
+
+    def close(self):
+        """Sync the log and stop the background writer"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class LogWriter:
+    """Background thread that appends lines to a log file.
+        The queue of lines is bounded, so the search loop only waits
+        when the writer falls behind by more than buffer_size lines.
+        Lines are flushed whenever the queue is empty
+        and synced to disk when requested"""
+
+    def __init__(self, buffer_size=1024):
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def open(self, file):
+        """Start a new log file, replacing any previous log"""
+        self.queue.put(("open", file))
+
+    def write(self, line):
+        """Append a line to the current log file"""
+        self.queue.put(("write", line))
+
+    def sync(self):
+        """Wait until all lines are written and synced to disk"""
+        done = threading.Event()
+        self.queue.put(("sync", done))
+        done.wait()
+        self.raise_error()
+
+    def close(self):
+        """Sync and stop the writer thread"""
+        done = threading.Event()
+        self.queue.put(("close", done))
+        done.wait()
+        self.thread.join()
+        self.raise_error()
+
+    def raise_error(self):
+        """Raise the last error of the writer thread"""
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def run(self):
+        f = None
+        while True:
+            command, value = self.queue.get()
+            try:
+                if command == "open":
+                    if f is not None:
+                        f.close()
+                    f = open(value, "w", encoding="utf8")
+                elif command == "write":
+                    if f is not None:
+                        f.write(value)
+                elif f is not None:
+                    # sync or close
+                    f.flush()
+                    os.fsync(f.fileno())
+                    if command == "close":
+                        f.close()
+                        f = None
+                # Flush when caught up so a crash loses as little as possible
+                if f is not None and self.queue.empty():
+                    f.flush()
+            except Exception as ex:
+                self.error = ex
+            finally:
+                if command in ["sync", "close"]:
+                    value.set()
+            if command == "close":
+                return
+
+
+def load_log(log_file):
+    """Load a log file in either format as a list of records"""
+    log_file = Path(log_file)
+    with open(log_file, encoding="utf8") as f:
+        if log_file.suffix == ".json":
+            return json.load(f)
+        # Skip a partial last line left by a crash
+        records = []
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+        return records
+
+
+def convert_log(log_file, json_file=None):
+    """Convert a jsonl log file to the json array format, returning the json file"""
+    log_file = Path(log_file)
+    if json_file is None:
+        json_file = log_file.with_suffix(".json")
+    log_data = load_log(log_file)
+    with open(json_file, "w", encoding="utf8") as f:
+        json.dump(log_data, f, indent=4)
+    return json_file
@@ -8,69 +8,51 @@ from pathlib import Path
 from threading import Timer
 from requests.exceptions import ConnectionError
 
-from repl_env import ReplEnv
-from agent_random import AgentRandom
-from agent_supervised import AgentSupervised
-from search_random import SearchRandom
-from search_beam import SearchBeam
-from search_best import SearchBest
+from search_factory import get_env, get_agent, get_search
+from results_journal import ResultsJournal
+import file_manifest
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--input", type=str, required=True, help="File or folder target smt files to reconstruct")
 parser.add_argument("--split", type=str, help="Train/test split file from which to select test files to process")
 parser.add_argument("--output", type=str, help="Folder to save the output logs to [default: log]")
+parser.add_argument("--rescan", dest="rescan", default=False, action="store_true", help="Search the input folder for files again instead of using the cached file manifest [default: False]")
+parser.add_argument("--log_format", type=str, default="jsonl", help="Format of the search logs, jsonl to append a line per step or json to rewrite a JSON array [default: jsonl]")
 parser.add_argument("--screenshot", dest="screenshot", default=False, action="store_true", help="Save screenshots during reconstruction [default: False]")
 parser.add_argument("--launch_gym", dest="launch_gym", default=False, action="store_true",
                     help="Launch the Fusion 360 Gym automatically, requires the gym to be set to run on startup [default: False]")
+parser.add_argument("--env", type=str, default="gym", help="Environment to use, can be gym or sim to replay *_sequence.json files offline [default: gym]")
+parser.add_argument("--graph_delta", dest="graph_delta", default=False, action="store_true", help="Request the changes since the last graph from the gym rather than the whole graph [default: False]")
+parser.add_argument("--response_format", type=str, default="binary", help="Format of the graphs in gym responses, binary to decode the face features straight into arrays, or json [default: binary]")
 parser.add_argument("--agent", type=str, default="rand", help="Agent to use, can be rand, mpn, or mlp [default: rand]")
 parser.add_argument("--search", type=str, default="rand", help="Search to use, can be rand, beam or best [default: rand]")
 parser.add_argument("--budget", type=int, default=100, help="The number of steps to search [default: 100]")
+parser.add_argument("--cache_size", type=int, default=1024, help="The number of encoded graphs the mpn/mlp agents keep in memory, 0 to disable [default: 1024]")
 parser.add_argument("--augment", dest="augment", default=False, action="store_true", help="Use an agent trained on augmented data [default: False]")
 args = parser.parse_args()
 
 
-def get_files():
+def get_files(output_dir):
     """Process the command line arguments"""
     input = Path(args.input)
+    # The offline environment replays sequence files instead of smt files
+    if args.env == "sim":
+        suffix = "_sequence.json"
+    else:
+        suffix = ".smt"
     if not input.exists():
         print("Input file/folder does not exist")
         exit()
-    test_files = None
+    split_file = None
     if args.split is not None:
         split_file = Path(args.split)
         if not split_file.exists():
             print("Split file does not exists")
-        else:
-            with open(split_file, encoding="utf8") as f:
-                json_data = json.load(f)
-                if "test" not in json_data:
-                    print("Split file does not have a test set")
-                else:
-                    test_files = set()
-                    for test_file in json_data["test"]:
-                        test_files.add(f"{test_file}.smt")
-
-    files = []
-    if input.is_dir():
-        smt_files = [f for f in input.glob("**/*.smt")]
-        if len(smt_files) == 0:
-            print("No .smt files found")
-            exit()
-        else:
-            # We store an index with the file for debug output
-            for smt_file in smt_files:
-                if test_files is None:
-                    # If we don't have a split
-                    # use all files
-                    files.append(smt_file)
-                else:
-                    # If we have a split
-                    # use only the test files
-                    if smt_file.name in test_files:
-                        files.append(smt_file)
-    else:
-        files.append(input)
+            split_file = None
+    files = file_manifest.get_files(input, suffix, split_file, output_dir, args.rescan)
+    if len(files) == 0:
+        exit()
     return files
 
 
@@ -85,48 +67,9 @@ def get_output_dir():
     return output_dir
 
 
-def get_search(env, output_dir):
-    """Get the agent based on user input"""
-    if args.search == "rand":
-        return SearchRandom(env, output_dir)
-    elif args.search == "beam":
-        return SearchBeam(env, output_dir)
-    elif args.search == "best":
-        return SearchBest(env, output_dir)
-
-
-def get_agent():
-    """Get the agent based on user input"""
-    if args.agent == "rand":
-        return AgentRandom()
-    elif args.agent == "mpn":
-        return AgentSupervised(use_gcn=True, use_aug=args.augment)
-    elif args.agent == "mlp":
-        return AgentSupervised(use_gcn=False, use_aug=args.augment)
-
-
-def load_results(output_dir):
-    """Load the results file"""
-    results_file = output_dir / "search_results.json"
-    if results_file.exists():
-        with open(results_file, encoding="utf8") as f:
-            return json.load(f)
-    else:
-        return {}
-
-
-def save_results(output_dir, results):
-    """Save the results file"""
-    results_file = output_dir / "search_results.json"
-    with open(results_file, "w", encoding="utf8") as f:
-        json.dump(results, f, indent=4)
-
-
 def add_result(results, file, result, output_dir):
-    """Add a result to the list"""
-    if file.stem not in results:
-        results[file.stem] = result
-        save_results(output_dir, results)
+    """Add a result to the results journal"""
+    results.add(file.stem, result)
 
 # Global variable to indicated if we have timed out
 halted = False
@@ -153,15 +96,17 @@ def setup_timer(env, file):
 
 def main():
     global halted
-    files = get_files()
     output_dir = get_output_dir()
-    results = load_results(output_dir)
+    files = get_files(output_dir)
+    # Results are appended to a journal, so resuming only loads the index
+    results = ResultsJournal(output_dir)
 
     # Setup the search and the environment that connects to FusionGym
-    env = ReplEnv(host="127.0.0.1", port=8080, launch_gym=args.launch_gym)
+    env = get_env(args.env, launch_gym=args.launch_gym,
+                  response_format=args.response_format, graph_delta=args.graph_delta)
     # Initialize these once and reuse them
-    search = get_search(env, output_dir)
-    agent = get_agent()
+    search = get_search(args.search, env, output_dir, args.log_format)
+    agent = get_agent(args.agent, use_aug=args.augment, cache_size=args.cache_size)
 
     files_to_process = copy.deepcopy(files)
     files_processed = 0
@@ -187,8 +132,11 @@ def main():
                 target_graph, bounding_box = search.set_target(file)
                 agent.set_target(target_graph, bounding_box)
                 best_score_over_time = search.search(agent, args.budget, screenshot=args.screenshot)
+                # Make sure the log is on disk before the result is recorded
+                search.log.sync()
                 time_taken = time.time() - start_time
-                print(f"---> Score: {best_score_over_time[-1]:.3f} in {len(best_score_over_time)}/{args.budget} steps ({time_taken:.2f} sec)")
+                steps_per_sec = len(best_score_over_time) / time_taken if time_taken > 0 else 0
+                print(f"---> Score: {best_score_over_time[-1]:.3f} in {len(best_score_over_time)}/{args.budget} steps ({time_taken:.2f} sec, {steps_per_sec:.1f} steps/sec)")
                 files_processed += 1
             except ConnectionError as ex:
                 # ConnectionError is thrown when the Fusion 360 Gym is down and we can't connect
@@ -236,6 +184,8 @@ def main():
                 files_processed += 1
         halt_timer.cancel()
         add_result(results, file, result, output_dir)
+    search.log.close()
+    results.close()
 
 if __name__ == "__main__":
     main()
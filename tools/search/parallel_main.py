@@ -0,0 +1,326 @@
+"""
+
+Search a folder of targets in parallel with multiple Fusion 360 Gym instances.
+Target files are handed out from a shared work queue to worker processes,
+each with its own gym endpoint, agent and search,
+and their results are merged into a single results journal
+
+"""
+import sys
+import time
+import queue
+import argparse
+import traceback
+import subprocess
+import multiprocessing
+from pathlib import Path
+from threading import Timer
+from requests.exceptions import ConnectionError
+
+from repl_env import ReplEnv
+from search_factory import get_env, get_agent, get_search
+from results_journal import ResultsJournal
+import file_manifest
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, required=True, help="File or folder target smt files to reconstruct")
+    parser.add_argument("--split", type=str, help="Train/test split file from which to select test files to process")
+    parser.add_argument("--output", type=str, help="Folder to save the output logs to [default: log]")
+    parser.add_argument("--rescan", dest="rescan", default=False, action="store_true", help="Search the input folder for files again instead of using the cached file manifest [default: False]")
+    parser.add_argument("--log_format", type=str, default="jsonl", help="Format of the search logs, jsonl or json [default: jsonl]")
+    parser.add_argument("--screenshot", dest="screenshot", default=False, action="store_true", help="Save screenshots during reconstruction [default: False]")
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes, each with its own gym [default: 2]")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host name of the gyms as an IP address [default: 127.0.0.1]")
+    parser.add_argument("--start_port", type=int, default=8080, help="Port of the gym of the first worker, the other workers use the following ports [default: 8080]")
+    parser.add_argument("--gym", type=str, default="fusion", help="Gym to use, can be fusion, or sim to start stand-in servers that replay *_sequence.json files [default: fusion]")
+    parser.add_argument("--launch_gym", dest="launch_gym", default=False, action="store_true",
+                        help="Launch a Fusion 360 Gym for each worker automatically, requires the gym to be set to run on startup [default: False]")
+    parser.add_argument("--graph_delta", dest="graph_delta", default=False, action="store_true", help="Request the changes since the last graph from the gym rather than the whole graph [default: False]")
+    parser.add_argument("--response_format", type=str, default="binary", help="Format of the graphs in gym responses, binary to decode the face features straight into arrays, or json [default: binary]")
+    parser.add_argument("--dataset", type=str, help="Folder of *_sequence.json files for the sim gym [default: input folder]")
+    parser.add_argument("--delay", type=float, default=0, help="Seconds the sim gym waits in each extrude command, to simulate Fusion 360 [default: 0]")
+    parser.add_argument("--timeout", type=int, default=60 * 10, help="Seconds before the search of a file is halted [default: 600]")
+    parser.add_argument("--agent", type=str, default="rand", help="Agent to use, can be rand, mpn, or mlp [default: rand]")
+    parser.add_argument("--search", type=str, default="rand", help="Search to use, can be rand, beam or best [default: rand]")
+    parser.add_argument("--budget", type=int, default=100, help="The number of steps to search [default: 100]")
+    parser.add_argument("--cache_size", type=int, default=1024, help="The number of encoded graphs the mpn/mlp agents keep in memory, 0 to disable [default: 1024]")
+    parser.add_argument("--augment", dest="augment", default=False, action="store_true", help="Use an agent trained on augmented data [default: False]")
+    return parser.parse_args()
+
+
+def get_output_dir(args):
+    """Get the output directory to save the logs"""
+    if args.output is not None:
+        output_dir = Path(args.output)
+    else:
+        output_dir = Path(__file__).resolve().parent / "log"
+    if not output_dir.exists():
+        output_dir.mkdir(parents=True)
+    return output_dir
+
+
+class SearchWorker:
+    """Searches target files from the work queue with its own gym, agent and search,
+        sending each result to the orchestrator"""
+
+    def __init__(self, worker_id, args, output_dir, launch_lock, result_queue):
+        self.worker_id = worker_id
+        self.args = args
+        self.launch_lock = launch_lock
+        self.result_queue = result_queue
+        # Both the Fusion 360 Gym and the sim gym are reached through the repl env
+        self.env = get_env("gym", host=args.host, port=args.start_port + worker_id,
+                           response_format=args.response_format, graph_delta=args.graph_delta)
+        self.search = get_search(args.search, self.env, output_dir, args.log_format)
+        self.agent = get_agent(args.agent, use_aug=args.augment, cache_size=args.cache_size)
+        # Set by the timer when the current file takes too long
+        self.halted = False
+        self.crash_counts = {}
+
+    def launch_gym(self):
+        """Launch the gym of this worker, if we manage the gyms"""
+        if not self.args.launch_gym:
+            return
+        # Each gym claims the first endpoint in launch.json that is not connected,
+        # so gyms are launched one at a time
+        with self.launch_lock:
+            self.env.launch_gym()
+
+    def halt(self, file):
+        """Halt search of the current file"""
+        print(f"[Worker {self.worker_id}] Halting {file.name}")
+        self.halted = True
+        self.env.kill_gym()
+
+    def setup_timer(self, file):
+        """Setup the timer to halt execution if needed"""
+        self.halted = False
+        halt_timer = Timer(self.args.timeout, self.halt, [file])
+        halt_timer.daemon = True
+        halt_timer.start()
+        return halt_timer
+
+    def is_gym_responding(self, attempts=5):
+        """Check if the gym responds to pings"""
+        for attempt in range(attempts):
+            try:
+                r = self.env.client.ping()
+                if r is not None and r.status_code == 200:
+                    return True
+            except ConnectionError:
+                pass
+            time.sleep(1)
+        return False
+
+    def run(self, work_queue):
+        """Search files from the work queue until there are none left"""
+        self.launch_gym()
+        while True:
+            try:
+                file = Path(work_queue.get(timeout=1))
+            except queue.Empty:
+                break
+            if not self.process(file):
+                # Our gym is down, so give the file back to the other workers
+                print(f"[Worker {self.worker_id}] Gym is not responding, returning {file.name}")
+                self.result_queue.put(("requeue", self.worker_id, file.stem, None))
+                # Don't wait for the file to be sent if no other worker takes it,
+                # it will be searched when the run is resumed
+                work_queue.cancel_join_thread()
+                work_queue.put(str(file))
+                break
+        self.search.log.close()
+
+    def process(self, file):
+        """Search a file, retrying if the gym crashes.
+            Returns False if the gym is down and can't be relaunched"""
+        self.result_queue.put(("start", self.worker_id, file.stem, None))
+        stats = {"steps": 0, "score": 0}
+        while True:
+            halt_timer = self.setup_timer(file)
+            result = {
+                "status": "Success"
+            }
+            try:
+                target_graph, bounding_box = self.search.set_target(file)
+                self.agent.set_target(target_graph, bounding_box)
+                best_score_over_time = self.search.search(self.agent, self.args.budget, screenshot=self.args.screenshot)
+                # Make sure the log is on disk before the result is recorded
+                self.search.log.sync()
+                stats["steps"] = len(best_score_over_time)
+                stats["score"] = best_score_over_time[-1] if len(best_score_over_time) > 0 else 0
+            except ConnectionError as ex:
+                halt_timer.cancel()
+                # If the timer has stopped, then we have killed Fusion after a time out
+                if self.halted:
+                    print(f"[Worker {self.worker_id}] ConnectionError timeout...")
+                    result["status"] = "Timeout"
+                    self.launch_gym()
+                    break
+                # If the timer is still running Fusion has crashed
+                # and we want to rerun the file again
+                print(f"[Worker {self.worker_id}] ConnectionError due to Fusion crash...")
+                self.crash_counts[file.stem] = self.crash_counts.get(file.stem, 0) + 1
+                print(f"[Worker {self.worker_id}] Crash count: {self.crash_counts[file.stem]}")
+                self.launch_gym()
+                # Without a launcher we can only wait for the gym to come back
+                if not self.args.launch_gym and not self.is_gym_responding():
+                    return False
+                # We only want to restart 3 times
+                if self.crash_counts[file.stem] < 3:
+                    continue
+                # Lets give up and move on
+                result["status"] = "Crash"
+                break
+            except Exception as ex:
+                ex_arg = str(ex.args).split("\\n")[0]
+                print(f"[Worker {self.worker_id}] Exception! {type(ex).__name__}: {ex_arg}")
+                result["status"] = "Fail"
+                result["exception"] = type(ex).__name__
+                result["exception_args"] = str(ex.args)
+                result["trace"] = traceback.format_exc()
+            halt_timer.cancel()
+            break
+        self.result_queue.put(("result", self.worker_id, file.stem, (result, stats)))
+        return True
+
+
+def worker_main(worker_id, args, output_dir, work_queue, result_queue, launch_lock):
+    """Entry point of a worker process"""
+    worker = SearchWorker(worker_id, args, output_dir, launch_lock, result_queue)
+    worker.run(work_queue)
+
+
+def start_sim_gyms(args):
+    """Start a stand-in gym server for each worker and wait for them to respond"""
+    dataset = args.dataset if args.dataset is not None else args.input
+    server_file = Path(__file__).resolve().parent / "sim_gym_server.py"
+    servers = []
+    for worker_id in range(args.workers):
+        servers.append(subprocess.Popen([
+            sys.executable, str(server_file),
+            "--dataset", str(dataset),
+            "--host", args.host,
+            "--port", str(args.start_port + worker_id),
+            "--delay", str(args.delay)
+        ]))
+    for worker_id in range(args.workers):
+        env = ReplEnv(host=args.host, port=args.start_port + worker_id)
+        for attempt in range(100):
+            try:
+                r = env.client.ping()
+                if r.status_code == 200:
+                    break
+            except ConnectionError:
+                time.sleep(0.1)
+        else:
+            raise Exception(f"Sim gym on port {args.start_port + worker_id} is not responding")
+        # The server handles one connection at a time, so leave it to the worker
+        env.close()
+    return servers
+
+
+def collect_results(results, processes, result_queue, file_count):
+    """Merge the results from the workers into the results journal
+        until all the workers have finished"""
+    # Worker id -> stem of the file being searched
+    in_progress = {}
+    done = 0
+    steps = 0
+    start_time = time.time()
+    while True:
+        try:
+            kind, worker_id, file_stem, data = result_queue.get(timeout=1)
+        except queue.Empty:
+            # A worker that exited has sent all its messages,
+            # so read them before checking for a lost file
+            exited = [worker_id for worker_id, process in enumerate(processes) if not process.is_alive()]
+            if not result_queue.empty():
+                continue
+            for worker_id in exited:
+                if worker_id in in_progress:
+                    file_stem = in_progress.pop(worker_id)
+                    print(f"[Worker {worker_id}] Exited while searching {file_stem}")
+                    results.add(file_stem, {"status": "Crash"})
+                    done += 1
+            if len(exited) == len(processes):
+                break
+            continue
+        if kind == "start":
+            in_progress[worker_id] = file_stem
+            continue
+        if kind == "requeue":
+            in_progress.pop(worker_id, None)
+            continue
+        in_progress.pop(worker_id, None)
+        result, stats = data
+        results.add(file_stem, result)
+        done += 1
+        steps += stats["steps"]
+        print(f"[{done}/{file_count} files] [Worker {worker_id}] {file_stem} {result['status']}, score {stats['score']:.3f} in {stats['steps']} steps")
+    time_taken = time.time() - start_time
+    return done, steps, time_taken
+
+
+def main():
+    args = get_args()
+    output_dir = get_output_dir(args)
+    input = Path(args.input)
+    if not input.exists():
+        print("Input file/folder does not exist")
+        exit()
+    split_file = None
+    if args.split is not None:
+        split_file = Path(args.split)
+        if not split_file.exists():
+            print("Split file does not exists")
+            split_file = None
+    files = file_manifest.get_files(input, ".smt", split_file, output_dir, args.rescan)
+    # Results are appended to a single journal by this process only
+    results = ResultsJournal(output_dir)
+    files_to_process = [file for file in files if file.stem not in results]
+    print(f"Skipping {len(files) - len(files_to_process)} processed files")
+    if len(files_to_process) == 0:
+        results.close()
+        return
+
+    # Spawn the workers, as each loads its own agent
+    context = multiprocessing.get_context("spawn")
+    work_queue = context.Queue()
+    # Workers stop when the queue is empty
+    for file in files_to_process:
+        work_queue.put(str(file))
+    result_queue = context.Queue()
+    launch_lock = context.Lock()
+
+    servers = []
+    processes = []
+    try:
+        if args.gym == "sim":
+            servers = start_sim_gyms(args)
+        for worker_id in range(args.workers):
+            process = context.Process(
+                target=worker_main,
+                args=(worker_id, args, output_dir, work_queue, result_queue, launch_lock)
+            )
+            process.start()
+            processes.append(process)
+        done, steps, time_taken = collect_results(results, processes, result_queue, len(files_to_process))
+        files_per_sec = done / time_taken if time_taken > 0 else 0
+        steps_per_sec = steps / time_taken if time_taken > 0 else 0
+        print(f"---> Searched {done} files with {args.workers} workers in {time_taken:.2f} sec ({files_per_sec:.2f} files/sec, {steps_per_sec:.1f} steps/sec)")
+        if done < len(files_to_process):
+            print(f"{len(files_to_process) - done} files were not searched as gyms were not responding, run again to resume")
+    finally:
+        for process in processes:
+            process.join()
+        for server in servers:
+            server.terminate()
+            server.wait()
+        results.close()
+
+
+if __name__ == "__main__":
+    main()
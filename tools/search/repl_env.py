@@ -1,6 +1,7 @@
 
 import sys
 import os
+import threading
 
 
 # Add the client folder to sys.path
@@ -9,29 +10,75 @@ if CLIENT_DIR not in sys.path:
     sys.path.append(CLIENT_DIR)
 
 from gym_env import GymEnv
+from graph_delta import apply_delta
 
 
 class ReplEnv(GymEnv):
 
+    # Thread of the last screenshot that was requested without blocking
+    screenshot_thread = None
+
+    def __init__(self, host="127.0.0.1", port=8080, launch_gym=False, response_format="json", graph_delta=False):
+        super().__init__(host, port, launch_gym)
+        # Format of the graphs in responses, json or binary
+        # to decode the node features straight into arrays
+        self.response_format = response_format
+        # Request the changes since the last graph rather than the whole graph
+        self.graph_delta = graph_delta
+        # Last graph received and its version
+        self.graph = None
+        self.graph_version = 0
+
     def set_target(self, target_file):
         """Setup search and connect to the Fusion Gym"""
+        self.wait_for_screenshot()
         # Set the target
-        r = self.client.set_target(target_file)
+        r = self.client.set_target(
+            target_file, self.response_format, self.get_graph_version(), upload=True)
         self.check_response("set_target", r)
-        response_json = r.json()
-        if "data" not in response_json or "graph" not in response_json["data"]:
+        response_json = self.client.decode_response(r)
+        if "data" not in response_json or not self.has_graph(response_json["data"]):
             raise Exception("[set_target] response graph missing")
-        return (response_json["data"]["graph"],
+        return (self.get_graph(response_json["data"]),
                 response_json["data"]["bounding_box"])
 
     def revert_to_target(self):
         """Revert to the target to start the search again"""
-        r = self.client.revert_to_target()
+        self.wait_for_screenshot()
+        r = self.client.revert_to_target(
+            self.response_format, self.get_graph_version())
         self.check_response("revert_to_target", r)
-        response_json = r.json()
-        if "data" not in response_json or "graph" not in response_json["data"]:
+        response_json = self.client.decode_response(r)
+        if "data" not in response_json or not self.has_graph(response_json["data"]):
             raise Exception("[revert_to_target] response graph missing")
-        return response_json["data"]["graph"]
+        return self.get_graph(response_json["data"])
+
+    def get_graph_version(self):
+        """Get the version of the last graph to request a delta from,
+            or None to request the whole graph"""
+        if not self.graph_delta:
+            return None
+        return self.graph_version
+
+    def has_graph(self, response_data):
+        """Check if the response data has a graph or a graph delta"""
+        return "graph" in response_data or "graph_delta" in response_data
+
+    def get_graph(self, response_data):
+        """Get the graph from the response data,
+            applying a graph delta to the last graph received"""
+        if "graph_delta" in response_data:
+            delta = response_data["graph_delta"]
+            if self.graph is None or delta["base_version"] != self.graph_version:
+                raise Exception("Graph delta does not apply to the last graph")
+            graph = apply_delta(self.graph, delta)
+        else:
+            graph = response_data["graph"]
+        if self.graph_delta:
+            self.graph = graph
+            # Servers without graph deltas don't give a version
+            self.graph_version = response_data.get("graph_version", 0)
+        return graph
 
     def get_empty_graph(self):
         """Get an empty graph to kick things off"""
@@ -45,17 +92,19 @@ class ReplEnv(GymEnv):
 
     def extrude(self, start_face, end_face, operation):
         """Extrude wrapper around the gym client"""
+        self.wait_for_screenshot()
         is_invalid = False
         return_graph = None
         return_iou = None
         r = self.client.add_extrude_by_target_face(
-            start_face, end_face, operation)
+            start_face, end_face, operation,
+            self.response_format, self.get_graph_version())
         if r is not None and r.status_code == 200:
-            response_json = r.json()
+            response_json = self.client.decode_response(r)
             if ("data" in response_json and
-                    "graph" in response_json["data"] and
+                    self.has_graph(response_json["data"]) and
                     "iou" in response_json["data"]):
-                return_graph = response_json["data"]["graph"]
+                return_graph = self.get_graph(response_json["data"])
                 return_iou = response_json["data"]["iou"]
         return return_graph, return_iou
 
@@ -63,20 +112,36 @@ class ReplEnv(GymEnv):
         """Extrudes wrapper around the gym client"""
         if len(actions) == 0:
             return None, None
+        self.wait_for_screenshot()
         is_invalid = False
         return_graph = None
         return_iou = None
-        r = self.client.add_extrudes_by_target_face(actions, revert)
+        r = self.client.add_extrudes_by_target_face(
+            actions, revert, self.response_format, self.get_graph_version())
         if r is not None and r.status_code == 200:
-            response_json = r.json()
+            response_json = self.client.decode_response(r)
             if ("data" in response_json and
-                    "graph" in response_json["data"] and
+                    self.has_graph(response_json["data"]) and
                     "iou" in response_json["data"]):
-                return_graph = response_json["data"]["graph"]
+                return_graph = self.get_graph(response_json["data"])
                 return_iou = response_json["data"]["iou"]
         return return_graph, return_iou
 
-    def screenshot(self, file):
-        """Save out a screenshot"""
-        r = self.client.screenshot(file)
-        return r is not None and r.status_code == 200
+    def screenshot(self, file, block=True):
+        """Save out a screenshot. Without blocking, the screenshot
+            is taken on a thread that the next command waits for"""
+        self.wait_for_screenshot()
+        if block:
+            r = self.client.screenshot(file)
+            return r is not None and r.status_code == 200
+        self.screenshot_thread = threading.Thread(
+            target=self.client.screenshot, args=(file,), daemon=True)
+        self.screenshot_thread.start()
+        return True
+
+    def wait_for_screenshot(self):
+        """Wait for the last screenshot to finish,
+            so the design doesn't change before it is taken"""
+        if self.screenshot_thread is not None:
+            self.screenshot_thread.join()
+            self.screenshot_thread = None
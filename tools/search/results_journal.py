@@ -0,0 +1,116 @@
+import os
+import json
+from pathlib import Path
+
+
+class ResultsJournal:
+    """Append-only journal of the search result of each file,
+        stored as one JSON record per line in search_results.jsonl.
+        Each record is synced to disk as it is added, so a crash
+        can at most lose the record being written.
+        A compact index of the files in the journal, and the journal size
+        it covers, is saved every few records so resuming a run
+        only reads the records added since"""
+
+    def __init__(self, output_dir, compact_every=100):
+        self.output_dir = Path(output_dir)
+        self.journal_file = self.output_dir / "search_results.jsonl"
+        self.index_file = self.output_dir / "search_results_index.json"
+        # Results file written by previous versions
+        self.legacy_file = self.output_dir / "search_results.json"
+        self.compact_every = compact_every
+        # File stem -> result status
+        self.files = {}
+        self.offset = 0
+        self.added = 0
+        self.f = None
+        self.load()
+
+    def __contains__(self, file_stem):
+        return file_stem in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def load(self):
+        """Load the index and the journal records after it"""
+        is_new = not self.journal_file.exists()
+        if is_new:
+            self.journal_file.touch()
+        journal_size = self.journal_file.stat().st_size
+        if self.index_file.exists():
+            with open(self.index_file, encoding="utf8") as f:
+                index = json.load(f)
+            # Only trust an index that covers part of this journal
+            if index["offset"] <= journal_size:
+                self.files = index["files"]
+                self.offset = index["offset"]
+        with open(self.journal_file, "rb") as f:
+            f.seek(self.offset)
+            for line in f:
+                # A partial last line is left when a crash happens mid write
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.files[record["file"]] = record["result"]["status"]
+                self.offset += len(line)
+        # Remove a partial record so new records start on a new line
+        if self.offset < journal_size:
+            print(f"Removing partial record from {self.journal_file.name}")
+            with open(self.journal_file, "r+b") as f:
+                f.truncate(self.offset)
+        self.f = open(self.journal_file, "ab")
+        if is_new and self.legacy_file.exists():
+            with open(self.legacy_file, encoding="utf8") as f:
+                for file_stem, result in json.load(f).items():
+                    self.add(file_stem, result)
+        self.save_index()
+
+    def add(self, file_stem, result):
+        """Add the result of a file if it is not in the journal"""
+        if file_stem in self.files:
+            return False
+        record = json.dumps({"file": file_stem, "result": result}) + "\n"
+        record = record.encode("utf8")
+        self.f.write(record)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.files[file_stem] = result["status"]
+        self.offset += len(record)
+        self.added += 1
+        if self.added % self.compact_every == 0:
+            self.save_index()
+        return True
+
+    def save_index(self):
+        """Save the index of the files in the journal,
+            replacing the previous index in one step"""
+        temp_file = self.index_file.with_suffix(".tmp")
+        with open(temp_file, "w", encoding="utf8") as f:
+            json.dump({"offset": self.offset, "files": self.files}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.index_file)
+
+    def close(self):
+        """Save the index and close the journal"""
+        if self.f is not None:
+            self.save_index()
+            self.f.close()
+            self.f = None
+
+
+def load_results(results_file):
+    """Load the results of each file from a journal file,
+        as the dict saved in search_results.json"""
+    results = {}
+    with open(results_file, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            record = json.loads(line)
+            results[record["file"]] = record["result"]
+    return results
@@ -1,31 +1,51 @@
 import time
 import json
+import operator
+import itertools
+import numpy as np
 from pathlib import Path
 
 from log import Log
+from action_space import ActionSpace
+from agent import OPERATIONS
+from transposition_table import TranspositionTable
+from face_pair_index import FacePairIndex
 
 
 class Search:
 
-    def __init__(self, env, log_dir=None):
+    def __init__(self, env, log_dir=None, log_format="jsonl"):
         self.env = env
-        self.log = Log(env, log_dir)
+        self.log = Log(env, log_dir, log_format)
+        self.transpositions = TranspositionTable()
 
     def set_target(self, target_file):
         """Set the target we are searching for"""
         assert target_file.exists()
         self.target_file = target_file
         self.log.set_target(target_file)
+        self.transpositions.clear()
         self.target_graph, self.target_bounding_box = self.env.set_target(
             self.target_file
         )
-        # Make a set of the valid nodes that are planar
-        # We use this for filtering later on
-        nodes = self.target_graph["nodes"]
-        self.valid_nodes = set()
-        for node in nodes:
-            if node["surface_type"] == "PlaneSurfaceType":
-                self.valid_nodes.add(node["id"])
+        # Face pairs that the server is not expected to reject as non-planar,
+        # non-parallel or coplanar, so we don't spend an env call on the others
+        self.face_pairs = FacePairIndex(self.target_graph)
+        # Validity of each target face pair and operation, with a trailing invalid entry
+        # for faces and operations that are not in the target
+        self.node_index = self.face_pairs.node_index
+        self.operation_index = {operation: index for index, operation in enumerate(OPERATIONS)}
+        self.valid_pair_mask = np.pad(self.face_pairs.valid, (0, 1))
+        # NewComponentFeatureOperation is not valid for the reconstruction task
+        self.valid_operation_mask = np.array(
+            [operation != "NewComponentFeatureOperation" for operation in OPERATIONS] + [False])
+        # If the current graph is empty, we want a new body operation
+        self.empty_operation_mask = self.valid_operation_mask & np.array(
+            [operation == "NewBodyFeatureOperation" for operation in OPERATIONS] + [False])
+        # Masks over the (start_face, end_face, operation) index space of action spaces,
+        # keyed by node names and operations, starting with those of the target
+        self.action_space_masks = {}
+        self.get_action_space_masks(self.face_pairs.node_names, OPERATIONS)
         return self.target_graph, self.target_bounding_box
 
     def search(self, agent, budget, score_function=None, screenshot=False):
@@ -37,28 +57,106 @@ class Search:
             the best score obtained from the set of explored programs in the search"""
         assert self.target_graph is not None
 
+    def add_agent_log_data(self, agent, log_data):
+        """Add the agent cache statistics to the log data"""
+        cache_stats = agent.get_cache_stats()
+        if cache_stats is not None:
+            log_data["agent_cache"] = cache_stats
+        return log_data
+
+    def add_transposition_log_data(self, log_data):
+        """Add the transposition table statistics to the log data"""
+        log_data["transpositions"] = self.transpositions.get_stats()
+        return log_data
+
+    def extrudes_prefix(self, prefix):
+        """Execute a prefix of actions, reverting first,
+            unless an equivalent prefix has been executed before.
+            Returns the graph, iou, if the result was cached
+            and if the prefix reaches a duplicate state"""
+        entry = self.transpositions.get(prefix)
+        if entry is not None:
+            new_graph, cur_iou, is_duplicate = entry
+            return new_graph, cur_iou, True, is_duplicate
+        new_graph, cur_iou = self.env.extrudes(list(prefix), revert=True)
+        is_duplicate = self.transpositions.put(prefix, new_graph, cur_iou)
+        return new_graph, cur_iou, False, is_duplicate
+
     def filter_bad_actions(self, current_graph, actions, action_probabilities):
         """Filter out some actions we clearly don't want to take"""
         assert self.target_graph is not None
-        epsilon = 0.00000000001
         # Flag for if the current graph is empty
         is_current_graph_empty = len(current_graph["nodes"]) == 0
-        # Adjust the probabilities of bad actions
-        for index, action in enumerate(actions):
-            # We only want faces that are planar
-            if action["start_face"] not in self.valid_nodes:
-                action_probabilities[index] = epsilon
-            elif action["end_face"] not in self.valid_nodes:
-                action_probabilities[index] = epsilon
-            # If the current graph is empty, we want a new body operation
-            elif is_current_graph_empty and action["operation"] != "NewBodyFeatureOperation":
-                action_probabilities[index] = epsilon
-            # This operation is not valid for the reconstruction task
-            elif action["operation"] == "NewComponentFeatureOperation":
-                action_probabilities[index] = epsilon
-            # Hack to avoid divide by zero
-            if action_probabilities[index] < epsilon:
-                action_probabilities[index] = epsilon
+        if isinstance(actions, ActionSpace):
+            return self.filter_bad_action_space(
+                is_current_graph_empty, actions, action_probabilities)
+        # Look up the index of the faces and operation of each action
+        # and apply the target masks to them
+        num_nodes = len(self.valid_pair_mask) - 1
+        num_operations = len(self.valid_operation_mask) - 1
+        start_indices = self.lookup_indices(actions, "start_face", self.node_index, num_nodes)
+        end_indices = self.lookup_indices(actions, "end_face", self.node_index, num_nodes)
+        operation_indices = self.lookup_indices(actions, "operation", self.operation_index, num_operations)
+        if is_current_graph_empty:
+            operation_mask = self.empty_operation_mask
+        else:
+            operation_mask = self.valid_operation_mask
+        possible = self.valid_pair_mask[start_indices, end_indices]
+        valid = possible & operation_mask[operation_indices]
+        return self.apply_action_mask(valid, action_probabilities, possible)
+
+    def lookup_indices(self, actions, key, index, default):
+        """Get the index of a value of each action dict, or default if it is not in the index"""
+        values = map(operator.itemgetter(key), actions)
+        return np.fromiter(
+            map(index.get, values, itertools.repeat(default)),
+            dtype=np.int64, count=len(actions))
 
-        action_probabilities = action_probabilities / sum(action_probabilities)
+    def filter_bad_action_space(self, is_current_graph_empty, actions, action_probabilities):
+        """Filter out bad actions from an ActionSpace
+            using the cached masks over the start, end, and operation indices"""
+        valid, empty_valid, possible = self.get_action_space_masks(actions.node_names, actions.operations)
+        if is_current_graph_empty:
+            valid = empty_valid
+        return self.apply_action_mask(valid, action_probabilities, possible)
+
+    def get_action_space_masks(self, node_names, operations):
+        """Get the flattened masks of valid actions, when the current graph
+            is not empty and when it is empty, and of the actions
+            the server does not reject, over the action space
+            of the given node names and operations"""
+        key = (tuple(node_names), tuple(operations))
+        if key not in self.action_space_masks:
+            # We only want face pairs that are planar, parallel and not coplanar
+            valid_pairs = self.face_pairs.get_mask(node_names)
+            valid_operations = np.array([
+                operation != "NewComponentFeatureOperation" for operation in operations
+            ])
+            new_body_operations = np.array([
+                operation == "NewBodyFeatureOperation" for operation in operations
+            ])
+            possible = np.repeat(valid_pairs[:, :, None], len(operations), axis=2)
+            valid = possible & valid_operations[None, None, :]
+            empty_valid = valid & new_body_operations[None, None, :]
+            self.action_space_masks[key] = (
+                valid.reshape(-1), empty_valid.reshape(-1), possible.reshape(-1))
+        return self.action_space_masks[key]
+
+    def apply_action_mask(self, valid, action_probabilities, possible=None):
+        """Set the probability of invalid actions to a small value and renormalize.
+            Actions that are not possible are given a probability of 0,
+            unless no action is possible"""
+        epsilon = 0.00000000001
+        action_probabilities = np.where(valid, action_probabilities, epsilon)
+        # Hack to avoid divide by zero
+        action_probabilities = np.maximum(action_probabilities, epsilon)
+        if possible is not None and np.any(possible):
+            action_probabilities = np.where(possible, action_probabilities, 0)
+        action_probabilities = action_probabilities / np.sum(action_probabilities)
         return action_probabilities
+
+    def get_action_logprs(self, action_probabilities):
+        """Convert probabilities to logprs,
+            actions with a probability of 0 get a logpr of -inf"""
+        with np.errstate(divide="ignore"):
+            return np.log(action_probabilities)
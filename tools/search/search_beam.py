@@ -3,16 +3,20 @@ import os
 import random
 import math
 from pathlib import Path
+import heapq
+import itertools
 import numpy as np
 
 
 from search import Search
+from action_space import iter_sorted_indices, take_actions
+from transposition_table import action_key
 
 
 class SearchBeam(Search):
 
-    def __init__(self, env, log_dir=None):
-        super().__init__(env, log_dir)
+    def __init__(self, env, log_dir=None, log_format="jsonl"):
+        super().__init__(env, log_dir, log_format)
 
     def search(self, agent, budget, score_function=None, screenshot=False):
         super().search(agent, budget, score_function, screenshot)
@@ -35,8 +39,17 @@ class SearchBeam(Search):
 
         # we set a beam width, and double it each time if we did not solve it
         beam_width = 1
+        # the beam of width 2k contains the beam of width k,
+        # so the best children of each expanded prefix are kept between rounds
+        # and env results are kept in the transposition table,
+        # so a new round only pays for the prefixes it newly admits
+        # expansions maps a prefix to (child actions, child logprs, complete)
+        # with the children sorted by logpr, only as many as the next round can use,
+        # and complete set if there are no other children the env would accept
+        expansions = {}
 
         while used_budget < budget:
+            round_start_budget = used_budget
             # We begin each rollout an empty graph
             cur_graph = self.env.get_empty_graph()
             # the beam datastructure, for each time_step, holds a list,
@@ -69,9 +82,18 @@ class SearchBeam(Search):
                 new_beam_candidates = []
                 for prefix, prefix_logpr in last_beam_head:
                     # execute the prefix, and since we took an envstep, add 1 to budget (make extrudes able to handle empty enumerables)
-                    new_graph, cur_iou = self.env.extrudes(list(prefix), revert=True)
-                    # Only increment the budget when we did work
+                    # prefixes executed in an earlier round or that are equivalent
+                    # to one executed before are looked up without an envstep
+                    is_cached, is_duplicate = False, False
                     if len(prefix) > 0:
+                        new_graph, cur_iou, is_cached, is_duplicate = self.extrudes_prefix(prefix)
+                    else:
+                        new_graph, cur_iou = self.env.extrudes(list(prefix), revert=True)
+                    if is_cached:
+                        if new_graph is not None:
+                            cur_graph = new_graph
+                    # Only increment the budget when we did work
+                    elif len(prefix) > 0:
                         used_budget += 1
                         take_screenshot = screenshot
                         if cur_iou is not None:
@@ -92,6 +114,8 @@ class SearchBeam(Search):
                             "max_iou": max_score,
                             "prefix": list(prefix)
                         }
+                        self.add_agent_log_data(agent, log_data)
+                        self.add_transposition_log_data(log_data)
                         self.log.log(log_data, take_screenshot)
                         max_scores.append(max_score)
                         # Stop early if we find a solution
@@ -105,32 +129,39 @@ class SearchBeam(Search):
                     # continue without adding it to the search space
                     if (new_graph is None or cur_iou is None) and len(prefix) > 0:
                         continue
+                    # Do not expand a state already reached by another prefix
+                    if is_duplicate:
+                        continue
 
                     # extend the current prefix by 1 step forward
-                    actions, action_probabilities = agent.get_actions_probabilities(cur_graph, self.target_graph)
-                    # Filter for clearly bad actions
-                    action_probabilities = self.filter_bad_actions(cur_graph, actions, action_probabilities)
-                    # Convert probability to logpr so they can be added rather than multiplied for numerical stability
-                    action_logprs = np.log(action_probabilities)
+                    prefix_key = tuple(action_key(action) for action in prefix)
+                    children = expansions.get(prefix_key)
+                    if children is None or (len(children[1]) < beam_width and not children[2]):
+                        children = self.get_children(agent, cur_graph, beam_width * 2)
+                        expansions[prefix_key] = children
+                    child_actions, child_logprs, complete = children
                     # add to the candidates the extended prefix
                     # and the added log_probability (note the logpr will get more and more negative)
-                    new_beam_candidates = []
-                    for (a, a_logpr) in zip(actions, action_logprs):
-                        child_prefix = prefix + (a,)
-                        child_prob = prefix_logpr + a_logpr
+                    # only the top beam_width children of a prefix can make it into the beam
+                    for rank in range(min(beam_width, len(child_logprs))):
+                        child_prefix = prefix + (child_actions[rank],)
+                        child_prob = prefix_logpr + child_logprs[rank]
                         new_beam_candidates.append((child_prefix, child_prob))
 
                 if used_budget >= budget:
                     break
-                # take the top_beam_width number of candidates, sort by -log_prob
-                new_beam_candidates_sorted = sorted(new_beam_candidates, key = lambda xx : -xx[1])
-                new_beam_head = new_beam_candidates_sorted[:beam_width]
+                # take the top_beam_width number of candidates by log_prob,
+                # ties keep their order as with a stable sort
+                new_beam_head = heapq.nlargest(beam_width, new_beam_candidates, key=lambda xx: xx[1])
                 if len(new_beam_head) == 0:
                     # print("All prefixed are not good, restarting")
                     break
                 print(f"[{used_budget}/{budget}] Score: {max_score}")
                 beam.append(new_beam_head)
 
+            # Stop if the whole round was cached, as a wider beam has nothing new to try
+            if used_budget == round_start_budget:
+                break
             # if we did not solve with the current beam width, multiply width by 2
             beam_width = beam_width * 2
             # print(f"Doubling the beam width: {beam_width}")
@@ -139,3 +170,24 @@ class SearchBeam(Search):
             self.env.revert_to_target()
             rollout_attempt += 1
         return max_scores
+
+    def get_children(self, agent, cur_graph, max_children):
+        """Get up to max_children of the current graph sorted by descending logpr,
+            as (child actions, child logprs, complete), where complete is set
+            if there are no other children the env would accept"""
+        actions, action_probabilities = agent.get_actions_probabilities(cur_graph, self.target_graph)
+        # Filter for clearly bad actions
+        action_probabilities = self.filter_bad_actions(cur_graph, actions, action_probabilities)
+        # Convert probability to logpr so they can be added rather than multiplied for numerical stability
+        action_logprs = self.get_action_logprs(action_probabilities)
+        sorted_indices = iter_sorted_indices(action_logprs, max_children)
+        indices = []
+        for a_index in itertools.islice(sorted_indices, max_children):
+            # the remaining actions would be rejected by the env
+            if np.isneginf(action_logprs[a_index]):
+                break
+            indices.append(a_index)
+        indices = np.array(indices, dtype=np.int64)
+        complete = len(indices) < max_children
+        # only the children are kept, not the whole action space
+        return take_actions(actions, indices), action_logprs[indices], complete
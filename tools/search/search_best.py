@@ -2,19 +2,19 @@ import sys
 import os
 import random
 import math
-import functools
 from pathlib import Path
 import numpy as np
-from queue import PriorityQueue
+import heapq
 
 
 from search import Search
+from action_space import top_k_indices, take_actions
 
 
 class SearchBest(Search):
 
-    def __init__(self, env, log_dir=None):
-        super().__init__(env, log_dir)
+    def __init__(self, env, log_dir=None, log_format="jsonl"):
+        super().__init__(env, log_dir, log_format)
 
     def search(self, agent, budget, score_function=None, screenshot=False):
         super().search(agent, budget, score_function, screenshot)
@@ -37,22 +37,50 @@ class SearchBest(Search):
         # We begin each rollout an empty graph
         cur_graph = self.env.get_empty_graph()
         # like beam search, we keep track of prefixes, but instead of a beam we keep a "fringe"
-        # we implement this with a priority queue, the queue ordered by min first max last
+        # we implement this with a heap ordered by min first max last
         # so we'll use _negative_ log likelihood and go after the "smallest" nll instead of the max like we do in beam
-        # each entry in the fringe is a custom PriorityAction (neg_likelihood, (prefix))
-        # where prefix is a tuple that contains the actions, that are dicts
-        # for example an element of the queue is something like : (10, (a1, a4, a10))
-        fringe = PriorityQueue()
-        fringe.put(PriorityAction(0, ()))
+        # each entry in the fringe is (neg_likelihood, node_id), ties are broken by node_id,
+        # i.e. the order nodes were created in
+        # nodes are kept in an arena of parent pointers, node 0 is the empty prefix,
+        # and the prefix of a node is rebuilt by following the parents
+        # for example an element of the heap is something like : (10, 7)
+        # where node 7 has the prefix (a1, a4, a10)
+        nodes = FringeArena()
+        fringe = [(0, nodes.add(None, None))]
 
         # while there is item in the fridge and we still have budget
-        while fringe.qsize() > 0 and used_budget < budget:
-            priority_action = fringe.get()
+        while len(fringe) > 0 and used_budget < budget:
             # nll is something like 10, prefix is something like (a1, a4, a10)
-            nll = priority_action.nll
-            prefix = priority_action.prefix
-            new_graph, cur_iou = self.env.extrudes(list(prefix), revert=True)
+            nll, node_id = heapq.heappop(fringe)
+            if nodes.is_pruned(node_id):
+                # the parent has more successors than it kept,
+                # so expand it again to find the action of the node
+                parent_id = nodes.parents[node_id]
+                parent_graph = self.get_expanded_graph(nodes.get_prefix(parent_id))
+                max_successors = nodes.ranks[node_id] + budget - used_budget
+                nodes.set_successors(parent_id, *self.get_successors(agent, parent_graph, max_successors))
+                if not nodes.unprune(node_id):
+                    continue
+                # the fringe entry was a lower bound of the nll
+                if nodes.nlls[node_id] > nll:
+                    heapq.heappush(fringe, (nodes.nlls[node_id], node_id))
+                    continue
+            prefix = nodes.get_prefix(node_id)
+            # children are pushed lazily, so once a child is popped
+            # its next best sibling takes its place in the fringe
+            sibling = nodes.next_sibling(node_id)
+            if sibling is not None:
+                heapq.heappush(fringe, sibling)
+            # prefixes equivalent to one executed before are looked up without an envstep
+            is_cached, is_duplicate = False, False
             if len(prefix) > 0:
+                new_graph, cur_iou, is_cached, is_duplicate = self.extrudes_prefix(prefix)
+            else:
+                new_graph, cur_iou = self.env.extrudes(list(prefix), revert=True)
+            if is_cached:
+                if new_graph is not None:
+                    cur_graph = new_graph
+            elif len(prefix) > 0:
                 used_budget += 1
                 take_screenshot = screenshot
                 if cur_iou is not None:
@@ -73,6 +101,8 @@ class SearchBest(Search):
                     "max_iou": max_score,
                     "prefix": list(prefix)
                 }
+                self.add_agent_log_data(agent, log_data)
+                self.add_transposition_log_data(log_data)
                 self.log.log(log_data, take_screenshot)
                 max_scores.append(max_score)
                 # Stop early if we find a solution
@@ -85,38 +115,134 @@ class SearchBest(Search):
             # continue without adding it to the search space
             if (new_graph is None or cur_iou is None) and len(prefix) > 0:
                 continue
+            # Do not expand a state already reached by another prefix
+            if is_duplicate:
+                continue
 
-            # extend the current prefix by 1 step forward
-            actions, action_probabilities = agent.get_actions_probabilities(cur_graph, self.target_graph)
-            # Filter for clearly bad actions
-            action_probabilities = self.filter_bad_actions(cur_graph, actions, action_probabilities)
-            # Convert probability to logpr so they can be added rather than multiplied for numerical stability
-            action_logprs = np.log(action_probabilities)
-            # add to the candidates back to fringe
-            for (a, a_logpr) in zip(actions, action_logprs):
-                child_prefix = prefix + (a,)
-                child_nll = nll - a_logpr
-                # do not add a prefix that's longer than rollout length
-                if len(child_prefix) < rollout_length:
-                    fringe.put(PriorityAction(child_nll, child_prefix))
+            # do not add a prefix that's longer than rollout length
+            if len(prefix) + 1 < rollout_length:
+                # extend the current prefix by 1 step forward
+                # add the children back to fringe, sorted by logpr,
+                # starting with only the best child
+                # each pop that is not cached uses budget, so only the children ranked
+                # within the remaining budget among their siblings are kept,
+                # and the node is expanded again if cached pops reach past them
+                successors = self.get_successors(agent, cur_graph, budget - used_budget)
+                child = nodes.expand(node_id, *successors)
+                if child is not None:
+                    heapq.heappush(fringe, child)
 
             print(f"[{used_budget}/{budget}] Score: {max_score}")
         return max_scores
 
-
-@functools.total_ordering
-class PriorityAction():
-
-    def __init__(self, nll, prefix):
-        self.nll = nll
-        self.prefix = prefix
-        self.prefix_str = str(prefix)
-
-    def __gt__(self, other):
-        if self.nll == other.nll:
-            return self.prefix_str > other.prefix_str
+    def get_expanded_graph(self, prefix):
+        """Get the graph of a prefix that was expanded before,
+            from the transposition table without an envstep"""
+        if len(prefix) == 0:
+            return self.env.get_empty_graph()
+        new_graph, cur_iou, is_cached, is_duplicate = self.extrudes_prefix(prefix)
+        assert is_cached
+        return new_graph
+
+    def get_successors(self, agent, cur_graph, max_successors):
+        """Get the successors of the current graph ranked within max_successors,
+            as (actions, logprs, complete) sorted by descending logpr,
+            where complete is set if no other successor would be accepted by the env"""
+        actions, action_probabilities = agent.get_actions_probabilities(cur_graph, self.target_graph)
+        # Filter for clearly bad actions
+        action_probabilities = self.filter_bad_actions(cur_graph, actions, action_probabilities)
+        # Convert probability to logpr so they can be added rather than multiplied for numerical stability
+        action_logprs = self.get_action_logprs(action_probabilities)
+        successors = top_k_indices(action_logprs, max_successors, include_ties=True)
+        # children that would be rejected by the env are not kept
+        successors = successors[np.isfinite(action_logprs[successors])]
+        complete = len(successors) == np.count_nonzero(np.isfinite(action_logprs))
+        return take_actions(actions, successors), action_logprs[successors], complete
+
+
+class FringeArena():
+    """Arena of search nodes with parent pointers.
+        Each expanded node keeps only the actions and logprs of its best successors,
+        sorted by logpr, and its children are only created as they are pushed
+        onto the fringe, so memory grows with the number of expansions
+        and kept successors, not the size of the action space.
+        The child after the kept successors of a node is pruned, with the nll
+        of the last kept successor as a lower bound, until the node is expanded again"""
+
+    def __init__(self):
+        # Parent node id, rank of the node among its siblings, and nll of each node
+        self.parents = []
+        self.ranks = []
+        self.nlls = []
+        # Expanded node id -> (sorted successor actions, successor logprs,
+        # True if there are no other successors)
+        self.successors = {}
+
+    def __len__(self):
+        return len(self.parents)
+
+    def add(self, parent_id, rank, nll=0):
+        """Add a node, returning its id"""
+        self.parents.append(parent_id)
+        self.ranks.append(rank)
+        self.nlls.append(nll)
+        return len(self.parents) - 1
+
+    def get_action(self, node_id):
+        """Get the action taken from the parent to reach a node"""
+        actions, logprs, complete = self.successors[self.parents[node_id]]
+        return actions[self.ranks[node_id]]
+
+    def get_prefix(self, node_id):
+        """Get the prefix of actions of a node"""
+        prefix = []
+        while self.parents[node_id] is not None:
+            prefix.append(self.get_action(node_id))
+            node_id = self.parents[node_id]
+        return tuple(reversed(prefix))
+
+    def get_child(self, parent_id, rank):
+        """Create the child at a rank among the successors of a node,
+            returning the (nll, node_id) fringe entry or None if there are no more"""
+        actions, logprs, complete = self.successors[parent_id]
+        if rank < len(logprs):
+            nll = self.nlls[parent_id] - logprs[rank]
+        elif complete or len(logprs) == 0:
+            return None
         else:
-            return self.nll > other.nll
-
-    def __eq__(self, other):
-        return self.nll == other.nll and self.prefix_str == other.prefix_str
+            nll = self.nlls[parent_id] - logprs[-1]
+        return nll, self.add(parent_id, rank, nll)
+
+    def is_pruned(self, node_id):
+        """Check if a node is after the kept successors of its parent"""
+        parent_id = self.parents[node_id]
+        if parent_id is None:
+            return False
+        actions, logprs, complete = self.successors[parent_id]
+        return self.ranks[node_id] >= len(logprs)
+
+    def unprune(self, node_id):
+        """Set the nll of a pruned node after its parent was expanded again,
+            returning False if the parent has no successor at its rank"""
+        if self.is_pruned(node_id):
+            return False
+        actions, logprs, complete = self.successors[self.parents[node_id]]
+        self.nlls[node_id] = self.nlls[self.parents[node_id]] - logprs[self.ranks[node_id]]
+        return True
+
+    def set_successors(self, node_id, actions, logprs, complete):
+        """Set the successor actions of a node sorted by descending logpr"""
+        self.successors[node_id] = (actions, logprs, complete)
+
+    def expand(self, node_id, actions, logprs, complete):
+        """Set the successors of a node,
+            returning the fringe entry of its best child"""
+        self.set_successors(node_id, actions, logprs, complete)
+        return self.get_child(node_id, 0)
+
+    def next_sibling(self, node_id):
+        """Get the fringe entry of the next best sibling of a node"""
+        parent_id = self.parents[node_id]
+        if parent_id is None:
+            return None
+        return self.get_child(parent_id, self.ranks[node_id] + 1)
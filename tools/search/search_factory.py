@@ -0,0 +1,41 @@
+from repl_env import ReplEnv
+from sim_env import SimEnv
+from agent_random import AgentRandom
+from search_random import SearchRandom
+from search_beam import SearchBeam
+from search_best import SearchBest
+
+
+def get_env(env_type, host="127.0.0.1", port=8080, launch_gym=False,
+            response_format="binary", graph_delta=False):
+    """Get the environment by name, gym or sim"""
+    if env_type == "sim":
+        return SimEnv()
+    elif env_type == "gym":
+        return ReplEnv(host=host, port=port, launch_gym=launch_gym,
+                       response_format=response_format, graph_delta=graph_delta)
+    raise Exception(f"Unknown env: {env_type}")
+
+
+def get_agent(agent_type, use_aug=False, cache_size=1024):
+    """Get the agent by name, rand, mpn or mlp"""
+    if agent_type == "rand":
+        return AgentRandom()
+    # Only import torch and the network when needed
+    from agent_supervised import AgentSupervised
+    if agent_type == "mpn":
+        return AgentSupervised(use_gcn=True, use_aug=use_aug, cache_size=cache_size)
+    elif agent_type == "mlp":
+        return AgentSupervised(use_gcn=False, use_aug=use_aug, cache_size=cache_size)
+    raise Exception(f"Unknown agent: {agent_type}")
+
+
+def get_search(search_type, env, log_dir=None, log_format="jsonl"):
+    """Get the search by name, rand, beam or best"""
+    if search_type == "rand":
+        return SearchRandom(env, log_dir, log_format)
+    elif search_type == "beam":
+        return SearchBeam(env, log_dir, log_format)
+    elif search_type == "best":
+        return SearchBest(env, log_dir, log_format)
+    raise Exception(f"Unknown search: {search_type}")
@@ -11,8 +11,8 @@ from search import Search
 
 class SearchRandom(Search):
 
-    def __init__(self, env, log_dir=None):
-        super().__init__(env, log_dir)
+    def __init__(self, env, log_dir=None, log_format="jsonl"):
+        super().__init__(env, log_dir, log_format)
         self.log_probs = False
 
     def search(self, agent, budget, score_function=None, screenshot=False):
@@ -41,7 +41,9 @@ class SearchRandom(Search):
                 actions, action_probabilities = agent.get_actions_probabilities(cur_graph, self.target_graph)
                 # Filter for clearly bad actions
                 action_probabilities = self.filter_bad_actions(cur_graph, actions, action_probabilities)
-                action = np.random.choice(actions, 1, p=action_probabilities)[0]
+                # Sample an index so this works with arrays of actions and action spaces
+                action_index = np.random.choice(len(actions), p=action_probabilities)
+                action = actions[action_index]
                 new_graph, cur_iou = self.env.extrude(action["start_face"], action["end_face"], action["operation"])
                 take_screenshot = screenshot
                 if cur_iou is not None:
@@ -68,6 +70,7 @@ class SearchRandom(Search):
                     probs = np.sort(action_probabilities).tolist()
                     log_data["probabilities"] = probs
 
+                self.add_agent_log_data(agent, log_data)
                 self.log.log(log_data, take_screenshot)
                 max_scores.append(max_score)
                 # Stop early if we find a solution
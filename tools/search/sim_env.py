@@ -0,0 +1,168 @@
+import json
+from pathlib import Path
+
+from face_pair_index import FacePairIndex
+
+
+class SimEnv:
+    """Offline stand-in for ReplEnv that replays RegraphPerFace sequences
+        (*_sequence.json and the per step graphs) instead of running
+        extrudes in the Fusion 360 Gym"""
+
+    # Score of each extra valid action after the longest correct prefix
+    # is multiplied by this factor
+    incorrect_penalty = 0.5
+
+    def __init__(self, dataset_dir=None):
+        self.dataset_dir = Path(dataset_dir) if dataset_dir is not None else None
+        self.target_graph = None
+        self.actions = []
+        self.extrude_count = 0
+
+    def launch_gym(self):
+        """No gym to launch offline"""
+        return True
+
+    def kill_gym(self, including_parent=True):
+        """No gym to kill offline"""
+        return True
+
+    def get_sequence_file(self, target_file):
+        """Find the sequence file for a target file,
+            either the sequence file itself or one with the same stem"""
+        target_file = Path(target_file)
+        if target_file.name.endswith("_sequence.json"):
+            return target_file
+        sequence_name = f"{target_file.stem}_sequence.json"
+        for folder in [self.dataset_dir, target_file.parent]:
+            if folder is not None and (folder / sequence_name).exists():
+                return folder / sequence_name
+        raise Exception(f"[set_target] sequence file missing for {target_file.name}")
+
+    def set_target(self, target_file):
+        """Load the ground truth sequence for the target"""
+        sequence_file = self.get_sequence_file(target_file)
+        with open(sequence_file, encoding="utf8") as f:
+            sequence_data = json.load(f)
+        self.sequence = []
+        self.step_graphs = []
+        for step in sequence_data["sequence"]:
+            with open(sequence_file.parent / step["graph"], encoding="utf8") as f:
+                self.step_graphs.append(json.load(f))
+            self.sequence.append(
+                (step["start_face"], step["end_face"], step["operation"]))
+        self.target_graph = self.step_graphs[-1]
+        self.bounding_box = sequence_data["properties"]["bounding_box"]
+        self.target_faces = set(node["id"] for node in self.target_graph["nodes"])
+        self.target_nodes = {node["id"]: node for node in self.target_graph["nodes"]}
+        # Score of the graph after each step of the sequence
+        self.step_scores = [
+            self.face_score(graph) for graph in self.step_graphs
+        ]
+        self.face_pairs = FacePairIndex(self.target_graph)
+        self.actions = []
+        return self.target_graph, self.bounding_box
+
+    def face_score(self, graph):
+        """IoU-like score as the intersection over union
+            of the graph faces and the target faces"""
+        faces = set(node["id"] for node in graph["nodes"])
+        union = faces | self.target_faces
+        if len(union) == 0:
+            return 0
+        return len(faces & self.target_faces) / len(union)
+
+    def is_valid_face_pair(self, start_face, end_face):
+        """Check if two faces are planar, parallel and not coplanar,
+            as needed to extrude from one to the other"""
+        return self.face_pairs.is_valid(start_face, end_face)
+
+    def is_valid_action(self, actions, action):
+        """Check if an action can be applied after the given actions"""
+        start_face, end_face, operation = action
+        if not self.is_valid_face_pair(start_face, end_face):
+            return False
+        # There is nothing to cut or intersect without a body
+        if len(actions) == 0 and operation in ["CutFeatureOperation", "IntersectFeatureOperation"]:
+            return False
+        return True
+
+    def get_state(self, actions):
+        """Get the graph and score after the given actions.
+            The graph is the ground truth graph after the longest correct prefix,
+            with a face added for each action after it so incorrect sequences
+            reach distinct states, and each action after it reduces the score
+            by the incorrect penalty"""
+        correct = 0
+        while (correct < len(actions) and correct < len(self.sequence) and
+                actions[correct] == self.sequence[correct]):
+            correct += 1
+        if correct == 0:
+            graph = self.get_empty_graph()
+            score = 0
+        else:
+            graph = self.step_graphs[correct - 1]
+            score = self.step_scores[correct - 1]
+        if correct < len(actions):
+            graph = self.add_incorrect_faces(graph, actions[correct:])
+        score *= self.incorrect_penalty ** (len(actions) - correct)
+        return graph, score
+
+    def add_incorrect_faces(self, graph, actions):
+        """Add a stand-in for the face made by each incorrect action,
+            a copy of the target end face with an id made from the action"""
+        nodes = list(graph["nodes"])
+        node_ids = set(node["id"] for node in nodes)
+        for start_face, end_face, operation in actions:
+            node = dict(self.target_nodes[end_face])
+            node["id"] = f"{start_face}_{end_face}_{operation}"
+            if node["id"] not in node_ids:
+                node_ids.add(node["id"])
+                nodes.append(node)
+        return dict(graph, nodes=nodes)
+
+    def revert_to_target(self):
+        """Revert to the target to start the search again"""
+        self.actions = []
+        return self.get_empty_graph()
+
+    def get_empty_graph(self):
+        """Get an empty graph to kick things off"""
+        return {
+            "directed": False,
+            "multigraph": False,
+            "graph": {},
+            "nodes": [],
+            "links": []
+        }
+
+    def extrude(self, start_face, end_face, operation):
+        """Extrude from the current state"""
+        assert self.target_graph is not None
+        self.extrude_count += 1
+        action = (start_face, end_face, operation)
+        if not self.is_valid_action(self.actions, action):
+            return None, None
+        self.actions.append(action)
+        return self.get_state(self.actions)
+
+    def extrudes(self, actions, revert=False):
+        """Extrude a list of actions, optionally reverting first"""
+        assert self.target_graph is not None
+        if len(actions) == 0:
+            return None, None
+        self.extrude_count += 1
+        if revert:
+            self.actions = []
+        new_actions = list(self.actions)
+        for action in actions:
+            action = (action["start_face"], action["end_face"], action["operation"])
+            if not self.is_valid_action(new_actions, action):
+                return None, None
+            new_actions.append(action)
+        self.actions = new_actions
+        return self.get_state(self.actions)
+
+    def screenshot(self, file, block=True):
+        """No screenshots offline"""
+        return False
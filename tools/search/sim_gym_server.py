@@ -0,0 +1,194 @@
+"""
+
+Stand-in for the Fusion 360 Gym server that speaks the same HTTP protocol
+and replays RegraphPerFace sequences with the offline environment,
+to test search clients and orchestration without Fusion 360
+
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+from pathlib import Path
+from http.server import HTTPServer
+from http.server import BaseHTTPRequestHandler
+
+from sim_env import SimEnv
+
+# Add the common folder to sys.path
+COMMON_DIR = os.path.join(os.path.dirname(__file__), "..", "common")
+if COMMON_DIR not in sys.path:
+    sys.path.append(COMMON_DIR)
+
+import graph_binary
+import graph_delta
+import request_body
+from command_batch import CommandBatch
+
+
+class SimGymRequestHandler(BaseHTTPRequestHandler):
+    """Handles gym commands on the offline environment of the server"""
+
+    # Keep connections alive like the gym
+    protocol_version = "HTTP/1.1"
+    # Close idle connections to let other clients connect
+    timeout = 10
+    # Send small responses immediately rather than waiting for the previous ack
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        try:
+            try:
+                post_data = self.get_post_data()
+            except ValueError as ex:
+                # The rest of the body may not have been read
+                self.close_connection = True
+                self.respond(400, f"Invalid request body: {ex}")
+                return
+            if "command" not in post_data:
+                self.respond(400, "Command not present")
+                return
+            command = post_data["command"]
+            data = post_data.get("data")
+            if command == "detach":
+                # Close this connection so the server can stop
+                self.close_connection = True
+            status_code, message, return_data = self.server.run_command(command, data)
+            request_body.remove_upload(data)
+            if ("graph_delta" in post_data and
+                    return_data is not None and "graph" in return_data):
+                # Send the changes since the last graph the client has
+                return_data = self.server.graph_deltas.encode(return_data, post_data["graph_delta"])
+            if (post_data.get("response_format") == "binary" and
+                    return_data is not None and ("graph" in return_data or "graph_delta" in return_data)):
+                self.respond_binary_graph(status_code, message, return_data)
+            else:
+                self.respond(status_code, message, return_data)
+        except Exception as ex:
+            self.respond(500, f"Error processing command: {traceback.format_exc()}")
+
+    def do_GET(self):
+        self.respond(400, "GET not supported, use POST")
+
+    def get_post_data(self):
+        if request_body.is_upload(self.headers):
+            # Saved to a temp file like the gym, though only the name is used
+            return request_body.read_upload(self.rfile, self.headers)
+        return request_body.read_json(self.rfile, self.headers)
+
+    def respond_binary_graph(self, status_code, message, return_data):
+        binary_bytes = graph_binary.encode_response(status_code, message, return_data)
+        self.send_response(status_code)
+        self.send_header("Content-type", graph_binary.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(binary_bytes)))
+        self.end_headers()
+        self.wfile.write(binary_bytes)
+
+    def respond(self, status_code, message, return_data=None):
+        data = {
+            "status": status_code,
+            "message": message
+        }
+        if return_data is not None:
+            data["data"] = return_data
+        json_bytes = json.dumps(data).encode(encoding="utf_8")
+        self.send_response(status_code)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(json_bytes)))
+        self.end_headers()
+        self.wfile.write(json_bytes)
+
+    def log_message(self, format, *args):
+        # Don't log every request to stderr
+        return
+
+
+class SimGymServer(HTTPServer):
+    """Single threaded server, like the gym, that runs commands on an offline environment.
+        Each extrude command can be delayed to simulate the time taken by Fusion 360"""
+
+    def __init__(self, host, port, dataset_dir, delay=0, protocol_version="HTTP/1.1"):
+        # HTTP/1.0 closes the connection after each command
+        handler = type("SimGymRequestHandler", (SimGymRequestHandler,), {
+            "protocol_version": protocol_version
+        })
+        super().__init__((host, port), handler)
+        self.env = SimEnv(dataset_dir)
+        self.delay = delay
+        self.target_set = False
+        # Last graph sent, for clients that request graph deltas
+        self.graph_deltas = graph_delta.GraphDeltaEncoder()
+        self.batch = CommandBatch(self.run_command)
+
+    def run_command(self, command, data):
+        """Run a command, returning the status code, message and data"""
+        if command == "ping":
+            return 200, "Ping success", None
+        elif command == "clear":
+            self.target_set = False
+            return 200, "Clear success", None
+        elif command == "detach":
+            # Shutdown from a separate thread to avoid deadlock
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return 200, "Detach success", None
+        elif command == "batch":
+            return self.batch.run(data)
+        elif command == "set_target":
+            target_graph, bounding_box = self.env.set_target(Path(data["file"]))
+            self.target_set = True
+            return 200, "set_target success", {
+                "graph": target_graph,
+                "bounding_box": bounding_box
+            }
+        if not self.target_set:
+            return 500, f"Failed processing {command} command due to Target not set", None
+        if command == "revert_to_target":
+            self.env.revert_to_target()
+            return 200, "revert_to_target success", {
+                "graph": self.env.target_graph,
+                "bounding_box": self.env.bounding_box
+            }
+        elif command == "add_extrude_by_target_face":
+            time.sleep(self.delay)
+            graph, iou = self.env.extrude(data["start_face"], data["end_face"], data["operation"])
+        elif command == "add_extrudes_by_target_face":
+            time.sleep(self.delay)
+            graph, iou = self.env.extrudes(data["actions"], data.get("revert", False))
+        else:
+            return 500, f"Failed processing {command} command due to Unsupported command", None
+        if iou is None:
+            return 500, f"Failed processing {command} command due to Invalid extrude", None
+        return 200, f"{command} success", {
+            "graph": graph,
+            "iou": iou
+        }
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, required=True, help="Folder of *_sequence.json files matching the names of the target files")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host name as an IP address [default: 127.0.0.1]")
+    parser.add_argument("--port", type=int, default=8080, help="Port to serve on [default: 8080]")
+    parser.add_argument("--delay", type=float, default=0, help="Seconds to wait in each extrude command, to simulate Fusion 360 [default: 0]")
+    parser.add_argument("--protocol", type=str, default="HTTP/1.1", help="HTTP protocol version, HTTP/1.1 to keep connections alive or HTTP/1.0 [default: HTTP/1.1]")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    server = SimGymServer(args.host, args.port, args.dataset, args.delay, args.protocol)
+    print(f"Serving on: {args.host}:{args.port}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever(poll_interval=0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+from graph_cache import graph_hash
+
+
+# Consecutive extrudes with the same operation commute
+# (union, subtraction, intersection and adding bodies)
+# so their order does not change the resulting geometry
+COMMUTING_OPERATIONS = {
+    "JoinFeatureOperation",
+    "CutFeatureOperation",
+    "IntersectFeatureOperation",
+    "NewBodyFeatureOperation"
+}
+
+
+def action_key(action):
+    """Hashable (start_face, end_face, operation) key of an action dict"""
+    return (action["start_face"], action["end_face"], action["operation"])
+
+
+def canonical_prefix(prefix):
+    """Canonical encoding of a prefix of actions,
+        sorting each run of consecutive actions with the same commuting operation"""
+    keys = [action_key(action) for action in prefix]
+    canonical = []
+    run = []
+    for key in keys:
+        if len(run) > 0 and (key[2] != run[0][2] or key[2] not in COMMUTING_OPERATIONS):
+            canonical.extend(sorted(run))
+            run = []
+        run.append(key)
+    canonical.extend(sorted(run))
+    return tuple(canonical)
+
+
+class TranspositionTable:
+    """Cache of env results for prefixes of actions,
+        keyed by the canonical encoding of the prefix
+        and by the hash of the graph the prefix reaches.
+        A prefix that reaches the same state as a different prefix
+        is a duplicate that search does not need to expand"""
+
+    def __init__(self):
+        self.prefixes = {}
+        self.states = {}
+        self.hits = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        self.prefixes.clear()
+        self.states.clear()
+        self.hits = 0
+        self.duplicates = 0
+
+    def get(self, prefix):
+        """Get the cached (graph, iou, is_duplicate) for a prefix,
+            or None if no equivalent prefix has been executed"""
+        key = canonical_prefix(prefix)
+        if key not in self.prefixes:
+            return None
+        owner, graph, iou, is_duplicate = self.prefixes[key]
+        self.hits += 1
+        # An equivalent prefix in a different order is a duplicate
+        if owner != tuple(action_key(action) for action in prefix):
+            is_duplicate = True
+        if is_duplicate:
+            self.duplicates += 1
+        return graph, iou, is_duplicate
+
+    def put(self, prefix, graph, iou):
+        """Add the env result for a prefix,
+            returning True if the state was already reached by another prefix"""
+        owner = tuple(action_key(action) for action in prefix)
+        is_duplicate = False
+        if graph is not None and iou is not None:
+            state = graph_hash(graph)
+            if state in self.states and self.states[state] != owner:
+                is_duplicate = True
+                self.duplicates += 1
+            else:
+                self.states[state] = owner
+        self.prefixes[canonical_prefix(prefix)] = (owner, graph, iou, is_duplicate)
+        return is_duplicate
+
+    def get_stats(self):
+        """Get the size and dedup counts of the table"""
+        return {
+            "prefixes": len(self.prefixes),
+            "states": len(self.states),
+            "hits": self.hits,
+            "duplicates": self.duplicates
+        }